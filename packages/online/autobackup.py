@@ -1,12 +1,19 @@
+import fnmatch
+import glob
+import hashlib
+import json
+import math
 import os
 import time
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor, CancelledError, as_completed
+from threading import Thread, Event, Semaphore
+from typing import Dict, Iterable, List, Optional, Set
 
 import dt_data_api
 from dt_authentication import DuckietownToken
+from dt_data_api.constants import BUCKET_NAME
 
 from dt_class_utils import DTProcess
-from dt_device_utils import get_device_id, get_device_hostname
 from dt_permissions_utils import permission_granted
 from dt_secrets_utils import get_secret
 
@@ -14,7 +21,177 @@ from .constants import \
     FILES_TO_BACKUP, \
     REMOTE_BACKUP_LOCATION, \
     BACKUP_BUCKET_NAME, \
+    BACKUP_MANIFEST_FILE, \
+    BACKUP_DEBOUNCE_SECS, \
+    BACKUP_RESCAN_SECS, \
+    BACKUP_MAX_CONCURRENT_UPLOADS, \
+    BACKUP_CHUNK_SIZE, \
     DELAY_BACKUP_AFTER_START_SECS
+from .bandwidth import ThrottledBody, Priority
+from .device import get_device_facts
+from .inotify import \
+    Inotify, \
+    IN_CLOSE_WRITE, \
+    IN_MOVED_TO, \
+    IN_CREATE, \
+    IN_ISDIR, \
+    IN_IGNORED, \
+    IN_Q_OVERFLOW, \
+    IN_ONLYDIR
+from .metrics import get_registry
+from .network import has_default_route, wait_for_connectivity
+from .retry import RetryPolicy
+from .scheduler import get_scheduler, ScheduledTask
+from .session import get_session
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_ONLYDIR
+
+_metrics = get_registry()
+BACKUP_PENDING = _metrics.gauge(
+    "dt_online_backup_pending_files", "Files waiting to be checked (and uploaded if changed).")
+BACKUP_FILES = _metrics.counter(
+    "dt_online_backup_files_total", "Files checked by outcome (uploaded, unchanged, failed).", ["outcome"])
+BACKUP_BYTES = _metrics.counter(
+    "dt_online_backup_bytes_total", "Bytes of backed up files sent.")
+BACKUP_LAST_SUCCESS = _metrics.gauge(
+    "dt_online_backup_last_success_timestamp_seconds", "Time of the last successful upload of a file.")
+
+
+class BackupSet:
+    # The files matching a list of entries, each entry is a file, a glob or a directory (i.e., all
+    # the files in it, recursively).
+
+    def __init__(self, entries: Iterable[str]):
+        self._directories: List[str] = []
+        self._patterns: List[str] = []
+        for entry in entries:
+            if entry.endswith(os.sep) or os.path.isdir(entry):
+                self._directories.append(entry.rstrip(os.sep) + os.sep)
+            else:
+                self._patterns.append(entry)
+
+    @staticmethod
+    def _walk(directory: str) -> Iterable[str]:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                yield os.path.join(root, name)
+
+    def files(self) -> Set[str]:
+        files = set()
+        for directory in self._directories:
+            files.update(self._walk(directory))
+        for pattern in self._patterns:
+            files.update(glob.glob(pattern, recursive=True))
+        return {f for f in files if os.path.isfile(f)}
+
+    def directories(self) -> Set[str]:
+        # the directories to watch for changes
+        directories = set()
+        for directory in self._directories:
+            directories.update(root for root, _, _ in os.walk(directory))
+        for pattern in self._patterns:
+            parent = os.path.dirname(pattern)
+            if not glob.has_magic(parent):
+                directories.add(parent)
+                continue
+            # the longest parent without wildcards, and everything below it
+            static = []
+            for part in parent.split(os.sep):
+                if glob.has_magic(part):
+                    break
+                static.append(part)
+            directories.update(root for root, _, _ in os.walk(os.sep.join(static) or os.sep))
+        return {os.path.normpath(d) for d in directories if os.path.isdir(d)}
+
+    def __contains__(self, filepath: str) -> bool:
+        # `**/` also matches no directories at all (as in `glob`)
+        return any(filepath.startswith(d) for d in self._directories) or \
+            any(fnmatch.fnmatch(filepath, p) or fnmatch.fnmatch(filepath, p.replace("**/", ""))
+                for p in self._patterns)
+
+
+class BackupManifest:
+    # Content hash, size and mtime of the last version of each file that was backed up, indexed by
+    # remote location. Size and mtime let us skip hashing files that were not touched.
+    # Uploads in parts also keep track of the parts that made it to the server, so that an
+    # interrupted upload of the same content can resume.
+
+    def __init__(self, filepath: str = BACKUP_MANIFEST_FILE):
+        self._filepath = filepath
+        self._lock = Semaphore(1)
+        self._files: Dict[str, dict] = {}
+        self._uploads: Dict[str, dict] = {}
+        try:
+            with open(filepath, 'rt') as fin:
+                content = json.load(fin)
+            self._files = content.get("files", {})
+            self._uploads = content.get("uploads", {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            DTProcess.get_instance().logger.warning(
+                f"Could not read the backup manifest '{filepath}', reason: {str(e)}")
+
+    @staticmethod
+    def _hash(filepath: str) -> str:
+        sha = hashlib.sha256()
+        with open(filepath, 'rb') as fin:
+            for chunk in iter(lambda: fin.read(64 * 1024), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def changed(self, local: str, remote: str) -> Optional[dict]:
+        # returns the new entry if the file needs to be uploaded, None otherwise
+        stat = os.stat(local)
+        entry = self._files.get(remote, None)
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return None
+        new = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": self._hash(local)}
+        if entry is not None and entry["sha256"] == new["sha256"]:
+            # touched but not changed, remember the new mtime so that we do not hash it again
+            self.update(remote, new)
+            return None
+        return new
+
+    def unchanged(self, local: str, entry: dict) -> bool:
+        # whether the file still has the content the entry was made from
+        return self._hash(local) == entry["sha256"]
+
+    def update(self, remote: str, entry: dict):
+        with self._lock:
+            self._files[remote] = entry
+            self._uploads.pop(remote, None)
+            self._write()
+
+    def resume(self, remote: str, entry: dict) -> Set[int]:
+        # returns the parts already uploaded for this exact content
+        with self._lock:
+            upload = self._uploads.get(remote, None)
+            if upload is not None and upload["sha256"] == entry["sha256"] and \
+                    upload["chunk"] == BACKUP_CHUNK_SIZE:
+                return set(upload["parts"])
+            self._uploads[remote] = {"sha256": entry["sha256"], "chunk": BACKUP_CHUNK_SIZE, "parts": []}
+            return set()
+
+    def part_done(self, remote: str, part: int):
+        with self._lock:
+            self._uploads[remote]["parts"].append(part)
+            self._write()
+
+    def abort(self, remote: str):
+        # the parts uploaded so far cannot be resumed
+        with self._lock:
+            if self._uploads.pop(remote, None) is not None:
+                self._write()
+
+    def _write(self):
+        try:
+            os.makedirs(os.path.dirname(self._filepath), exist_ok=True)
+            with open(self._filepath + '.tmp', 'wt') as fout:
+                json.dump({"files": self._files, "uploads": self._uploads}, fout)
+            os.rename(self._filepath + '.tmp', self._filepath)
+        except OSError as e:
+            DTProcess.get_instance().logger.warning(f"Could not write the backup manifest: {str(e)}")
 
 
 class AutoBackupWorker(Thread):
@@ -22,12 +199,175 @@ class AutoBackupWorker(Thread):
     def __init__(self):
         super().__init__()
         self._shutdown = False
+        # the worker sleeps until the scheduler (or a shutdown) wakes it up
+        self._wakeup = Event()
+        # backoffs and waits for connectivity end only when their task fires (or on shutdown), not on changes
+        self._resume = Event()
+        # files that changed (or might have) since we last looked at them
+        self._dirty: Set[str] = set()
+        self._lock = Semaphore(1)
+        self._debounce: Dict[str, ScheduledTask] = {}
+        self._rescan_task: Optional[ScheduledTask] = None
+        self._inotify: Optional[Inotify] = None
+        self._files: Optional[BackupSet] = None
+        self._manifest: Optional[BackupManifest] = None
+        self._storage = None
+        self._user_id: Optional[int] = None
+        self._device_id: Optional[str] = None
 
     def is_shutdown(self) -> bool:
         return self._shutdown
 
     def shutdown(self):
         self._shutdown = True
+        if self._rescan_task is not None:
+            self._rescan_task.cancel()
+        if self._inotify is not None:
+            self._inotify.wakeup()
+        self._wakeup.set()
+        self._resume.set()
+
+    def _wait(self, task: ScheduledTask):
+        # block until the given task (scheduled with `self._resume.set` as callback) or a shutdown wakes us up
+        self._resume.wait()
+        self._resume.clear()
+        task.cancel()
+
+    def _sleep(self, secs: float):
+        self._wait(get_scheduler().call_later(secs, self._resume.set))
+
+    def _requeue(self, *filepaths: str):
+        # files to look at again the next time we wake up, without waking up now
+        with self._lock:
+            self._dirty.update(filepaths)
+
+    def _mark_dirty(self, *filepaths: str):
+        self._requeue(*filepaths)
+        self._wakeup.set()
+
+    def _on_change(self, filepath: str):
+        # a file that is being rewritten is uploaded once it stays untouched for a while
+        with self._lock:
+            task = self._debounce.pop(filepath, None)
+            if task is not None:
+                task.cancel()
+
+            def _settled():
+                with self._lock:
+                    self._debounce.pop(filepath, None)
+                self._mark_dirty(filepath)
+
+            self._debounce[filepath] = get_scheduler().call_later(BACKUP_DEBOUNCE_SECS, _settled)
+
+    def _add_watches(self):
+        if self._inotify is None:
+            return
+        watched = set(self._inotify.watched)
+        for directory in self._files.directories() - watched:
+            try:
+                self._inotify.add_watch(directory, WATCH_MASK)
+            except OSError as e:
+                DTProcess.get_instance().logger.debug(f"Could not watch '{directory}': {str(e)}")
+
+    def _watch(self):
+        while not self.is_shutdown():
+            for directory, name, mask in self._inotify.read():
+                if mask & (IN_Q_OVERFLOW | IN_IGNORED) or (mask & IN_CREATE and mask & IN_ISDIR):
+                    # we lost events or a watch, or there is a new directory, look at everything again
+                    self._rescan()
+                    continue
+                if mask & IN_CREATE:
+                    # files are picked up once they are closed
+                    continue
+                filepath = os.path.join(directory, name)
+                if filepath in self._files:
+                    self._on_change(filepath)
+        self._inotify.close()
+
+    def _rescan(self):
+        # directories might have been created in the meantime
+        self._add_watches()
+        self._mark_dirty(*self._files.files())
+
+    def _put(self, obj: str, data: bytes, metadata: Dict[str, str]):
+        # same request the data API client makes, but throttled by the bandwidth governor
+        bucket = BUCKET_NAME.format(name=BACKUP_BUCKET_NAME)
+        url = self._storage.api.authorize_request("put_object", bucket, obj, headers=metadata)
+        res = get_session().put(url, data=ThrottledBody(data, Priority.BACKUP), headers=metadata)
+        if res.status_code != 200:
+            raise IOError(f"Upload of '{obj}' was rejected with status {res.status_code}")
+        BACKUP_BYTES.inc(amount=len(data))
+
+    def _upload_file(self, local: str, remote: str):
+        metadata = {
+            "x-amz-meta-number-of-parts": "1",
+            "x-amz-meta-owner-id": str(self._user_id),
+        }
+        with open(local, 'rb') as fin:
+            self._put(remote.lstrip('/'), fin.read(), metadata)
+
+    def _upload_parts(self, local: str, remote: str, entry: dict):
+        app = DTProcess.get_instance()
+        # same layout used by the data API for multipart objects, `<remote>.000`, `<remote>.001`, ...
+        parts = math.ceil(entry["size"] / BACKUP_CHUNK_SIZE)
+        done = self._manifest.resume(remote, entry)
+        if done:
+            app.logger.info(f"Resuming backup of file '{local}' from part {len(done) + 1}/{parts}.")
+        metadata = {
+            "x-amz-meta-number-of-parts": str(parts),
+            "x-amz-meta-owner-id": str(self._user_id),
+        }
+        obj = remote.lstrip('/')
+        with open(local, 'rb') as fin:
+            for part in range(parts):
+                if part in done:
+                    continue
+                if self.is_shutdown():
+                    raise InterruptedError("The backup worker is shutting down")
+                fin.seek(part * BACKUP_CHUNK_SIZE)
+                chunk = fin.read(BACKUP_CHUNK_SIZE)
+                self._put(f"{obj}.{part:03d}", chunk, metadata)
+                self._manifest.part_done(remote, part)
+        # parts read from different versions of the file do not make a file, start over with the new one
+        if not self._manifest.unchanged(local, entry):
+            self._manifest.abort(remote)
+            raise ValueError("The file changed while it was being uploaded")
+        # a previous single-object version of the file would be downloaded instead of the parts
+        try:
+            self._storage.delete(obj)
+        except FileNotFoundError:
+            pass
+
+    def _backup(self, local: str) -> bool:
+        app = DTProcess.get_instance()
+        # files that do not exist (anymore) are checked again at the next rescan
+        if not os.path.isfile(local):
+            return True
+        remote = REMOTE_BACKUP_LOCATION(self._user_id, self._device_id, local)
+        try:
+            entry = self._manifest.changed(local, remote)
+        except OSError as e:
+            app.logger.debug(f"Could not read '{local}': {str(e)}")
+            return True
+        if entry is None:
+            BACKUP_FILES.inc("unchanged")
+            return True
+        # try uploading
+        try:
+            if entry["size"] > BACKUP_CHUNK_SIZE:
+                self._upload_parts(local, remote, entry)
+            else:
+                self._upload_file(local, remote)
+        except (Exception, dt_data_api.APIError, dt_data_api.TransferError) as e:
+            if not self.is_shutdown():
+                app.logger.warning(f"Backup of file '{local}' failed, reason: {str(e)}")
+            BACKUP_FILES.inc("failed")
+            return False
+        app.logger.info(f"File '{local}' successfully backed up!")
+        self._manifest.update(remote, entry)
+        BACKUP_FILES.inc("uploaded")
+        BACKUP_LAST_SUCCESS.set(value=time.time())
+        return True
 
     def run(self):
         app = DTProcess.get_instance()
@@ -38,7 +378,7 @@ class AutoBackupWorker(Thread):
             # no token? nothing to do
             app.logger.warning('No secret token dt1 found. Cannot backup device.')
             return
-        user_id = DuckietownToken.from_string(token).uid
+        self._user_id = DuckietownToken.from_string(token).uid
         # read the permissions
         granted = permission_granted('allow_push_config_data')
         if not granted:
@@ -46,56 +386,90 @@ class AutoBackupWorker(Thread):
             return
         # (try to) read the device ID
         try:
-            device_id = get_device_id()
+            self._device_id = get_device_facts().device_id
         except ValueError:
             # no device ID? nothing to do
             app.logger.warning("Could not find the device's unique ID. Cannot backup device.")
             return
         # prepare data for placeholders
         data = {
-            'hostname': get_device_hostname()
+            'hostname': get_device_facts().hostname
         }
         # prepare list of files to upload
-        to_upload = [f.format(**data) for f in FILES_TO_BACKUP]
-        uploaded = set()
-        missing = set()
+        self._files = BackupSet(f.format(**data) for f in FILES_TO_BACKUP)
+        self._manifest = BackupManifest()
         # spin up a Storage interface
         client = dt_data_api.DataClient(token)
-        storage = client.storage(BACKUP_BUCKET_NAME)
-        # try to upload the robot configuration
+        self._storage = client.storage(BACKUP_BUCKET_NAME)
+        # uploads run concurrently and are retried with exponential backoff
+        pool = ThreadPoolExecutor(max_workers=BACKUP_MAX_CONCURRENT_UPLOADS)
+        retry = RetryPolicy()
+        # wait for some time before backing up
+        self._sleep(DELAY_BACKUP_AFTER_START_SECS - app.uptime())
+        # changes to the files are picked up through inotify, with a periodic rescan as fallback
+        try:
+            self._inotify = Inotify()
+            self._add_watches()
+            Thread(target=self._watch, daemon=True).start()
+        except OSError as e:
+            app.logger.warning(f"Could not initialize inotify, reason: {str(e)}. "
+                               f"Changes will be picked up every {BACKUP_RESCAN_SECS} seconds.")
+            self._inotify = None
+        self._rescan_task = get_scheduler().call_every(BACKUP_RESCAN_SECS, self._rescan)
+        # back up whatever changed, then wait for the next change
         while not self.is_shutdown():
-            left_to_process = 0
-            # wait for some time before backing up
-            if app.uptime() <= DELAY_BACKUP_AFTER_START_SECS:
-                time.sleep(1)
+            self._wakeup.wait()
+            self._wakeup.clear()
+            with self._lock:
+                dirty, self._dirty = self._dirty, set()
+            if not dirty:
                 continue
-            # go through the list of files to upload
-            for local_filepath in to_upload:
-                # make sure the app is still running
-                if self.is_shutdown():
-                    return
-                # make sure the file hasn't been uploaded or blacklisted
-                if local_filepath in uploaded or local_filepath in missing:
-                    continue
-                # make sure the file exists
-                if not os.path.isfile(local_filepath):
-                    missing.add(local_filepath)
+            # skip attempts while the device is offline, resume as soon as it is back
+            if not has_default_route():
+                self._requeue(*dirty)
+                self._wait(wait_for_connectivity(self._resume.set))
+                self._wakeup.set()
+                retry.reset()
+                continue
+            # after an outage, a single file probes the storage before we release the whole list
+            held = set()
+            if retry.probing and len(dirty) > 1:
+                probe = min(dirty)
+                held = dirty - {probe}
+                dirty = {probe}
+                self._requeue(*held)
+            # go through the list of files that might have changed
+            futures = {pool.submit(self._backup, local_filepath): local_filepath for local_filepath in dirty}
+            failed = set()
+            BACKUP_PENDING.set(value=len(futures))
+            for future in as_completed(futures):
+                BACKUP_PENDING.inc(amount=-1)
+                try:
+                    success = future.result()
+                except CancelledError:
+                    success = False
+                if success:
                     continue
-                left_to_process += 1
-                # try uploading
-                remote_filepath = REMOTE_BACKUP_LOCATION(user_id, device_id, local_filepath)
-                handler = storage.upload(local_filepath, remote_filepath)
-                handler.join()
-                if handler.status == dt_data_api.TransferStatus.FINISHED:
-                    app.logger.info(f"File '{local_filepath}' successfully backed up!")
-                    uploaded.add(local_filepath)
-                    left_to_process -= 1
-                else:
-                    app.logger.warning(f"Backup of file '{local_filepath}' ended with "
-                                       f"status {handler.status.name}, reason: {handler.reason}")
-            # if we uploaded everything, you can stop
-            if left_to_process == 0:
-                app.logger.info(f"Files backup completed!")
-                break
-            # retry every 60 seconds
-            time.sleep(60)
+                failed.add(futures[future])
+                # no point in starting the other files right now
+                for other in futures:
+                    other.cancel()
+            # back off before retrying
+            if failed:
+                self._requeue(*failed)
+                delay = retry.failure()
+                # the first failures are retried right away
+                if delay > 0:
+                    app.logger.info(f"Retrying backup in {int(delay)} seconds.")
+                    self._sleep(delay)
+                    # the backoff expired, the next upload is a probe
+                    retry.allow()
+                self._wakeup.set()
+            else:
+                # this also closes the circuit if the last attempt was a probe
+                retry.success()
+                # the probe went through, release the files it held back
+                if held:
+                    self._wakeup.set()
+        # ---
+        pool.shutdown(wait=False)
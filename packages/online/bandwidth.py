@@ -0,0 +1,124 @@
+import re
+import time
+from enum import IntEnum
+from threading import Condition, Semaphore
+from typing import Dict, Iterator, Optional
+
+from dt_class_utils import DTProcess
+
+from .constants import \
+    BANDWIDTH_LIMIT_BPS, \
+    BANDWIDTH_BURST_BYTES, \
+    BANDWIDTH_ADAPT_TO_LINK, \
+    BANDWIDTH_POOR_LINK_QUALITY, \
+    BANDWIDTH_POOR_LINK_BITRATE_MBPS, \
+    BANDWIDTH_POOR_LINK_FACTOR
+
+
+class Priority(IntEnum):
+    # lower values go first
+    STATISTICS = 0
+    BACKUP = 1
+
+
+class BandwidthGovernor:
+    # Token bucket shared by everything that sends data out of the device. Tokens (bytes) refill at
+    # `rate` bytes per second up to `burst`. Callers waiting with a lower priority are only served
+    # when nobody with a higher priority is waiting.
+
+    def __init__(self, rate: float = BANDWIDTH_LIMIT_BPS, burst: int = BANDWIDTH_BURST_BYTES):
+        self._base_rate = rate
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._cond = Condition()
+        self._waiting: Dict[Priority, int] = {p: 0 for p in Priority}
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def set_factor(self, factor: float):
+        with self._cond:
+            self._rate = self._base_rate * factor
+            self._cond.notify_all()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def acquire(self, nbytes: int, priority: Priority):
+        if self._base_rate <= 0:
+            return
+        # a single request can never need more than a full bucket
+        nbytes = min(nbytes, self._burst)
+        with self._cond:
+            self._waiting[priority] += 1
+            try:
+                while True:
+                    self._refill()
+                    blocked = any(self._waiting[p] for p in Priority if p < priority)
+                    if not blocked and self._tokens >= nbytes:
+                        self._tokens -= nbytes
+                        return
+                    # sleep until there are enough tokens, or until the others are done
+                    self._cond.wait(None if blocked else (nbytes - self._tokens) / self._rate)
+            finally:
+                self._waiting[priority] -= 1
+                self._cond.notify_all()
+
+    def adapt_to_link(self, quality: Optional[int], bitrate_mbps: Optional[float]):
+        if not BANDWIDTH_ADAPT_TO_LINK:
+            return
+        poor = (quality is not None and quality < BANDWIDTH_POOR_LINK_QUALITY) or \
+            (bitrate_mbps is not None and bitrate_mbps < BANDWIDTH_POOR_LINK_BITRATE_MBPS)
+        factor = BANDWIDTH_POOR_LINK_FACTOR if poor else 1.0
+        if self._rate != self._base_rate * factor:
+            DTProcess.get_instance().logger.info(
+                f"Wi-Fi link is {'poor' if poor else 'good'} (quality: {quality}, "
+                f"bit rate: {bitrate_mbps} Mb/s), outbound bandwidth set to "
+                f"{int(self._base_rate * factor)} bytes/s.")
+            self.set_factor(factor)
+
+
+class ThrottledBody:
+    # A request body that is released to the network only as fast as the governor allows. It has a
+    # length, so requests still sends a Content-Length header instead of a chunked body.
+
+    def __init__(self, data: bytes, priority: Priority, chunk: int = 16 * 1024):
+        self._data = data
+        self._priority = priority
+        self._chunk = chunk
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __iter__(self) -> Iterator[bytes]:
+        governor = get_governor()
+        view = memoryview(self._data)
+        for i in range(0, len(self._data), self._chunk):
+            piece = view[i:i + self._chunk]
+            governor.acquire(len(piece), self._priority)
+            yield bytes(piece)
+
+
+def parse_bitrate(bitrate: str) -> Optional[float]:
+    # e.g., "72.2 Mb/s" -> 72.2
+    match = re.match(r"\s*([\d.]+)\s*([kMG])b/s", bitrate or "")
+    if match is None:
+        return None
+    return float(match.group(1)) * {"k": 1e-3, "M": 1.0, "G": 1e3}[match.group(2)]
+
+
+_governor: Optional[BandwidthGovernor] = None
+_lock = Semaphore(1)
+
+
+def get_governor() -> BandwidthGovernor:
+    global _governor
+    with _lock:
+        if _governor is None:
+            _governor = BandwidthGovernor()
+        return _governor
@@ -0,0 +1,168 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from threading import Timer
+from typing import Dict, List, Optional
+
+from .scenarios import SCENARIOS, Scenario
+from .server import FakeStatsServer
+
+# Benchmarks the statistics uploader (and the collector side of a step) against a local stand-in
+# for the statistics server, e.g., on the robot:
+#
+#   python3 -m online.benchmark [--json results.json] [--baseline previous.json] [scenario ...]
+#
+# or replays a trace recorded on a robot (see STATS_TRACE_FILE) through the collector and the
+# uploader, e.g., a day in 24 minutes:
+#
+#   python3 -m online.benchmark --replay trace.jsonl --speed 60
+#
+# Each scenario runs in its own process (so that peak RSS and CPU time are its own), the server
+# runs in this one. The environment of the scenarios points STATS_SERVER_* to the local server.
+
+PACKAGES_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# metrics where a higher value is better, all the others are better when lower
+HIGHER_IS_BETTER = {"points_per_sec"}
+COMPARED = ["points_per_sec", "flush_p50_ms", "flush_p99_ms", "cpu_secs", "peak_rss_mib"]
+
+
+def _run(server: FakeStatsServer, scenario: Scenario, verbose: bool,
+         replay: Optional[List[str]] = None) -> dict:
+    server.reset()
+    server.batch = scenario.batch
+    server.latency = scenario.latency
+    server.error_rate = scenario.error_rate
+    server.duplicate_rate = scenario.duplicate_rate
+    server.online = scenario.offline_secs <= 0
+    env = dict(os.environ)
+    env.update({
+        "STATS_SERVER_PROTOCOL": "http",
+        "STATS_SERVER_HOST": "127.0.0.1",
+        "STATS_SERVER_PORT": str(server.port),
+        "PYTHONPATH": os.pathsep.join([PACKAGES_DIR] + [p for p in [env.get("PYTHONPATH", None)] if p]),
+    })
+    # the server only serves the default location
+    env.pop("STATS_SERVER_PATH", None)
+    env.pop("STATS_SERVER_VERSION", None)
+    # the bandwidth budget is not what we are measuring, unless asked to
+    env.setdefault("BANDWIDTH_LIMIT_BPS", "0")
+    timer = Timer(scenario.offline_secs, lambda: setattr(server, "online", True))
+    with tempfile.TemporaryDirectory() as tmp:
+        output = os.path.join(tmp, "result.json")
+        if not server.online:
+            timer.start()
+        proc = subprocess.run(
+            [sys.executable, "-m", "online.benchmark", "--child", scenario.name, "--output", output] +
+            (replay or []),
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=None if verbose else subprocess.PIPE
+        )
+        timer.cancel()
+        if proc.returncode != 0:
+            if proc.stderr:
+                sys.stderr.write(proc.stderr.decode("utf-8", errors="replace"))
+            raise RuntimeError(f"Scenario '{scenario.name}' exited with code {proc.returncode}")
+        with open(output, "rt") as fin:
+            result = json.load(fin)
+    result.update({
+        "requests": server.requests,
+        "accepted": server.accepted,
+        "server_errors": server.errors,
+        "duplicates": server.duplicates,
+    })
+    return result
+
+
+def _print(results: Dict[str, dict]):
+    header = f"{'scenario':<24} {'points':>7} {'points/s':>9} {'p50 ms':>8} {'p99 ms':>8} " \
+             f"{'CPU s':>7} {'RSS MiB':>8} {'requests':>8}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results.items():
+        incomplete = "" if r["complete"] else f"  (incomplete, {r['uploaded']} uploaded)"
+        print(f"{name:<24} {r['points']:>7} {r['points_per_sec']:>9.1f} {r['flush_p50_ms']:>8.1f} "
+              f"{r['flush_p99_ms']:>8.1f} {r['cpu_secs']:>7.2f} {r['peak_rss_mib']:>8.1f} "
+              f"{r['requests']:>8}{incomplete}")
+
+
+def _compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> bool:
+    # returns False if any metric got worse than the baseline by more than `tolerance`
+    ok = True
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for metric in COMPARED:
+            before, after = baseline[name].get(metric, 0), result[metric]
+            if before <= 0:
+                continue
+            change = (after - before) / before
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            if worse > tolerance:
+                print(f"REGRESSION: {name}/{metric} went from {before:.2f} to {after:.2f} "
+                      f"({100 * change:+.1f}%)")
+                ok = False
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python3 -m online.benchmark",
+                                     description="Benchmarks the statistics uploader against a local server")
+    parser.add_argument("scenarios", nargs="*", help="Scenarios to run (default: all)")
+    parser.add_argument("--list", action="store_true", help="List the scenarios and exit")
+    parser.add_argument("--json", metavar="FILE", help="Write the results to FILE")
+    parser.add_argument("--baseline", metavar="FILE", help="Compare with the results in FILE")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative change that counts as a regression (default: 0.2)")
+    parser.add_argument("--verbose", action="store_true", help="Show the logs of the scenarios")
+    parser.add_argument("--replay", metavar="TRACE", help="Replay the recorded TRACE instead")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Speed of the replay, e.g., 60 replays an hour in a minute (default: 1)")
+    # used internally, to run a single scenario in a process of its own
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    # ---
+    if args.child:
+        # imported here, the configuration is read from the environment prepared by the parent
+        from .runner import run, replay
+        result = replay(args.replay, args.speed) if args.replay else run(SCENARIOS[args.child])
+        with open(args.output, "wt") as fout:
+            json.dump(result, fout)
+        return
+    if args.list:
+        for scenario in SCENARIOS.values():
+            print(f"{scenario.name:<24} {scenario.description}")
+        return
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+    # ---
+    server = FakeStatsServer()
+    server.start()
+    results = {}
+    try:
+        if args.replay:
+            name = f"replay:{os.path.basename(args.replay)}"
+            replay = ["--replay", os.path.abspath(args.replay), "--speed", str(args.speed)]
+            results[name] = _run(server, Scenario(name, "Replay of a recorded trace"), args.verbose, replay)
+        for name in [] if args.replay else args.scenarios or list(SCENARIOS):
+            results[name] = _run(server, SCENARIOS[name], args.verbose)
+    finally:
+        server.shutdown()
+    _print(results)
+    if args.json:
+        with open(args.json, "wt") as fout:
+            json.dump(results, fout, indent=4)
+    if args.baseline:
+        with open(args.baseline, "rt") as fin:
+            baseline = json.load(fin)
+        if not _compare(results, baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
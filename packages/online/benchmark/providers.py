@@ -0,0 +1,48 @@
+import json
+import random
+import string
+import time
+from typing import Optional, Tuple
+
+from online.statistics.providers import StatisticsProvider
+
+# rough size (bytes of JSON) of the payloads of the real providers
+PAYLOAD_PROFILES = {
+    "event": 300,
+    "wireless/status": 800,
+    "health": 1500,
+    "docker/images": 6 * 1024,
+    "docker/ps": 12 * 1024,
+    "ros/graph": 40 * 1024,
+}
+
+
+class SyntheticProvider(StatisticsProvider):
+    # Produces payloads of the size of one of the profiles above, made of records that look like
+    # the ones of the real providers (repeated keys, random identifiers, a few numbers).
+
+    def __init__(self, profile: str, index: int, frequency: float = 0):
+        category = "event" if profile == "event" else "usage"
+        # keys are unique, the outbox would otherwise coalesce the points of snapshot-style providers
+        super(SyntheticProvider, self).__init__(category, f"benchmark/{profile}/{index}", frequency)
+        self._random = random.Random(index)
+        self._last = 0.0
+        record = self._record()
+        self._records = max(1, PAYLOAD_PROFILES[profile] // (len(json.dumps(record)) + 2))
+
+    def _token(self, length: int) -> str:
+        return "".join(self._random.choices(string.hexdigits.lower(), k=length))
+
+    def _record(self) -> dict:
+        return {
+            "id": self._token(12),
+            "name": f"{self._token(6)}-{self._token(6)}",
+            "state": self._random.choice(["running", "exited", "created", "restarting"]),
+            "value": round(self._random.random() * 100, 3),
+            "labels": {"org.duckietown.label.module.type": self._random.choice(["ros", "other"])},
+        }
+
+    def step(self) -> Tuple[Optional[float], Optional[dict]]:
+        # the server tells points apart by their stamp (in milliseconds)
+        self._last = max(time.time(), self._last + 0.001)
+        return self._last, {"records": [self._record() for _ in range(self._records)]}
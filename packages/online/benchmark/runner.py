@@ -0,0 +1,167 @@
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from dt_class_utils import DTProcess
+
+from online.constants import STATS_PROVIDERS_WORKERS, STATS_PUBLISHER_PERIOD_SECS
+from online.scheduler import get_scheduler
+from online.statistics import trace
+from online.statistics.collector import StatisticsUploader
+from online.statistics.point import StatisticsCategory, StatisticsPoint
+from online.statistics.providers import StatisticsProvider
+from online.statistics.replay import ReplayWorker
+from .providers import SyntheticProvider
+from .scenarios import Scenario
+
+# the uploader is flushed this often, also after a failure (instead of backing off)
+FLUSH_PERIOD_SECS = 0.5
+# scenarios that did not upload everything by then are reported as incomplete
+TIMEOUT_SECS = 10 * 60
+TOKEN = "benchmark"
+DEVICE = "benchmark"
+
+
+class BenchmarkProcess(DTProcess):
+    pass
+
+
+class _TimedUploader(StatisticsUploader):
+    # Keeps track of how long each page of the outbox takes to upload.
+
+    def __init__(self, outbox_file: str, period: float = STATS_PUBLISHER_PERIOD_SECS):
+        super(_TimedUploader, self).__init__(outbox_file, period)
+        self.pages: List[float] = []
+
+    @staticmethod
+    def _get_token() -> Optional[str]:
+        # the local server does not check tokens
+        return TOKEN
+
+    def flush(self):
+        self._flush(TOKEN)
+
+    def _upload(self, queue: List[StatisticsPoint], token: str) -> List[StatisticsPoint]:
+        start = time.monotonic()
+        try:
+            return super(_TimedUploader, self)._upload(queue, token)
+        finally:
+            self.pages.append(time.monotonic() - start)
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def _cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _point(provider: StatisticsProvider) -> StatisticsPoint:
+    # same as a step of the collector
+    with provider.profile("step"):
+        stamp, payload = provider.data
+    with provider.profile("format"):
+        payload = provider.format(payload)
+    return StatisticsPoint(
+        category=StatisticsCategory(provider.category),
+        key=provider.point_key(payload),
+        device=DEVICE,
+        stamp=stamp,
+        payload=payload,
+        provider=provider
+    )
+
+
+def _produce(uploader: StatisticsUploader, provider: StatisticsProvider, steps: int):
+    for _ in range(steps):
+        uploader.add(_point(provider))
+
+
+def run(scenario: Scenario) -> dict:
+    BenchmarkProcess()
+    workdir = tempfile.mkdtemp(prefix="dt-online-benchmark-")
+    uploader = _TimedUploader(os.path.join(workdir, "outbox.sqlite"))
+    profiles = scenario.profiles
+    # the backlog is ready before we start measuring
+    backlog = [SyntheticProvider(profile, i) for i, profile in enumerate(profiles)]
+    for i in range(scenario.backlog):
+        uploader.add(_point(backlog[i % len(backlog)]))
+    total = scenario.backlog + scenario.providers * scenario.steps
+    # ---
+    cpu, start = _cpu(), time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=STATS_PROVIDERS_WORKERS)
+    producing = [
+        pool.submit(_produce, uploader, SyntheticProvider(profiles[i % len(profiles)], len(backlog) + i),
+                    scenario.steps)
+        for i in range(scenario.providers)
+    ]
+    while time.monotonic() - start < TIMEOUT_SECS:
+        busy = not all(f.done() for f in producing)
+        if not busy and len(uploader) == 0:
+            break
+        uploader.flush()
+        if busy or len(uploader) > 0:
+            time.sleep(FLUSH_PERIOD_SECS)
+    elapsed = time.monotonic() - start
+    cpu = _cpu() - cpu
+    pool.shutdown()
+    # ---
+    uploaded = total - len(uploader)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "points": total,
+        "uploaded": uploaded,
+        "complete": uploaded == total,
+        "secs": elapsed,
+        "points_per_sec": uploaded / elapsed if elapsed > 0 else 0.0,
+        "flush_p50_ms": _percentile(uploader.pages, 0.5) * 1000,
+        "flush_p99_ms": _percentile(uploader.pages, 0.99) * 1000,
+        "cpu_secs": cpu,
+        # kilobytes on Linux
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+
+
+def replay(filepath: str, speed: float) -> dict:
+    BenchmarkProcess()
+    recording = trace.load(filepath)
+    workdir = tempfile.mkdtemp(prefix="dt-online-replay-")
+    # the uploader runs on its own, as fast as the replay
+    uploader = _TimedUploader(os.path.join(workdir, "outbox.sqlite"), STATS_PUBLISHER_PERIOD_SECS / speed)
+    worker = ReplayWorker(recording, uploader, os.path.join(workdir, "fingerprints.json"), speed)
+    scheduler = get_scheduler()
+    scheduler.start()
+    # ---
+    cpu, start = _cpu(), time.monotonic()
+    worker.start()
+    while not worker.finished and time.monotonic() - start < worker.duration + TIMEOUT_SECS:
+        time.sleep(FLUSH_PERIOD_SECS)
+    elapsed = time.monotonic() - start
+    cpu = _cpu() - cpu
+    worker.shutdown()
+    worker.join()
+    uploader.join()
+    scheduler.shutdown()
+    # ---
+    shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        # recorded steps, not all of them give a point
+        "points": worker.steps,
+        "uploaded": worker.replayed,
+        "complete": worker.replayed == worker.steps,
+        "secs": elapsed,
+        "points_per_sec": worker.replayed / elapsed if elapsed > 0 else 0.0,
+        "flush_p50_ms": _percentile(uploader.pages, 0.5) * 1000,
+        "flush_p99_ms": _percentile(uploader.pages, 0.99) * 1000,
+        "cpu_secs": cpu,
+        "peak_rss_mib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
@@ -0,0 +1,38 @@
+import dataclasses
+from typing import Dict, List
+
+
+@dataclasses.dataclass
+class Scenario:
+    name: str
+    description: str
+    # points waiting in the outbox before the first flush
+    backlog: int = 0
+    # synthetic providers stepping while we upload, `steps` times each
+    providers: int = 0
+    steps: int = 0
+    # payload profiles (see `providers.PAYLOAD_PROFILES`) the points are drawn from, round-robin
+    profiles: List[str] = dataclasses.field(
+        default_factory=lambda: ["event", "health", "wireless/status", "docker/ps", "docker/images"])
+    # behavior of the server
+    latency: float = 0.0
+    error_rate: float = 0.0
+    duplicate_rate: float = 0.0
+    batch: bool = True
+    # the server is unreachable for this long after the scenario starts
+    offline_secs: float = 0.0
+
+
+SCENARIOS: Dict[str, Scenario] = {s.name: s for s in [
+    Scenario("backlog-1k", "1000 points waiting in the outbox", backlog=1000),
+    Scenario("backlog-10k", "10000 points waiting in the outbox", backlog=10000),
+    Scenario("backlog-large-payloads", "1000 ROS graphs waiting in the outbox",
+             backlog=1000, profiles=["ros/graph"]),
+    Scenario("no-batch", "2000 points, the server does not support batches", backlog=2000, batch=False),
+    Scenario("flaky-server", "2000 points, slow server with errors and duplicates",
+             backlog=2000, latency=0.05, error_rate=0.05, duplicate_rate=0.02),
+    Scenario("offline-online", "2000 points, the server comes back after 5 seconds",
+             backlog=2000, offline_secs=5),
+    Scenario("providers-10", "10 providers stepping 50 times each", providers=10, steps=50),
+    Scenario("providers-100", "100 providers stepping 20 times each", providers=100, steps=20),
+]}
@@ -0,0 +1,139 @@
+import gzip
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Semaphore
+from typing import Set, Tuple
+from urllib.parse import urlparse, parse_qs
+
+# zstd is optional
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, like the real server
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately, Nagle would hold the body back for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def _reply(self, status: int, content: dict):
+        body = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read(self) -> object:
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        encoding = self.headers.get("Content-Encoding", None)
+        if encoding == "gzip":
+            data = gzip.decompress(data)
+        elif encoding == "zstd" and zstandard is not None:
+            data = zstandard.ZstdDecompressor().decompress(data)
+        elif encoding is not None:
+            raise ValueError(f"Unsupported content encoding '{encoding}'")
+        return json.loads(data)
+
+    def do_POST(self):
+        fake: FakeStatsServer = self.server.fake
+        url = urlparse(self.path)
+        if not fake.online:
+            # the connection is dropped without a response, as if the server was not there
+            self.close_connection = True
+            return
+        try:
+            content = self._read()
+        except ValueError:
+            self._reply(415, {"success": False})
+            return
+        if fake.latency > 0:
+            time.sleep(fake.latency)
+        if not fake.request():
+            self._reply(500, {"success": False})
+            return
+        if not url.path.startswith(fake.prefix):
+            self._reply(404, {"success": False})
+            return
+        resource = url.path[len(fake.prefix):]
+        query = parse_qs(url.query)
+        # batches
+        if resource == "batch":
+            if not fake.batch:
+                self._reply(404, {"success": False})
+                return
+            outcomes = [
+                fake.outcome(p["category"], p["key"], p["device"], p["stamp"]) for p in content
+            ]
+            self._reply(200, {"success": True, "data": outcomes})
+            return
+        # single points, i.e., <category>/<key>?device=...&stamp=...
+        category, _, key = resource.partition("/")
+        self._reply(200, fake.outcome(category, key, query["device"][0], int(query["stamp"][0])))
+
+    def log_message(self, *_):
+        pass
+
+
+class FakeStatsServer(Thread):
+    # Local stand-in for the statistics server, it implements the same API (single points and batches,
+    # 409 for points it already has) and can be made slow, flaky or unreachable at runtime.
+
+    def __init__(self, address: str = "127.0.0.1", port: int = 0, prefix: str = "/api/v0/statistics/"):
+        super(FakeStatsServer, self).__init__(daemon=True)
+        self.prefix = prefix
+        # behavior
+        self.online: bool = True
+        self.batch: bool = True
+        self.latency: float = 0.0
+        self.error_rate: float = 0.0
+        self.duplicate_rate: float = 0.0
+        # counters
+        self.requests: int = 0
+        self.errors: int = 0
+        self.accepted: int = 0
+        self.duplicates: int = 0
+        self._seen: Set[Tuple[str, str, str, int]] = set()
+        self._lock = Semaphore(1)
+        self._server = ThreadingHTTPServer((address, port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def reset(self):
+        with self._lock:
+            self.requests = self.errors = self.accepted = self.duplicates = 0
+            self._seen.clear()
+
+    def request(self) -> bool:
+        # returns False for the requests that should fail
+        with self._lock:
+            self.requests += 1
+            if random.random() < self.error_rate:
+                self.errors += 1
+                return False
+        return True
+
+    def outcome(self, category: str, key: str, device: str, stamp: int) -> dict:
+        point = (category, key, device, stamp)
+        with self._lock:
+            if point in self._seen or random.random() < self.duplicate_rate:
+                self.duplicates += 1
+                return {"success": False, "code": 409}
+            self._seen.add(point)
+            self.accepted += 1
+        return {"success": True}
+
+    def run(self):
+        self._server.serve_forever()
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
@@ -5,12 +5,137 @@ import os
 BACKUP_BUCKET_NAME = 'user'
 REMOTE_BACKUP_LOCATION = lambda user_id, device, key: \
     os.path.join(str(user_id), 'device', device, 'backup', key.lstrip('/'))
+# - entries are files, globs (`**` matches any number of directories) or directories (backed up recursively)
 FILES_TO_BACKUP = [
     '/data/config/calibrations/camera_extrinsic/{hostname}.yaml',
     '/data/config/calibrations/camera_intrinsic/{hostname}.yaml',
     '/data/config/calibrations/kinematics/{hostname}.yaml',
 ]
+# - more entries (e.g., the whole '/data/config/', ROS logs, bags) can be given as a colon-separated list
+BACKUP_EXTRA_FILES = [f for f in os.environ.get("BACKUP_EXTRA_FILES", default="").split(":") if f]
+if BACKUP_EXTRA_FILES:
+    print(f"NOTE: Using custom BACKUP_EXTRA_FILES={':'.join(BACKUP_EXTRA_FILES)}")
+FILES_TO_BACKUP += BACKUP_EXTRA_FILES
 DELAY_BACKUP_AFTER_START_SECS = 5
+# - what was uploaded (content hash, size and mtime of each file), files are uploaded again only if they change
+BACKUP_MANIFEST_FILE = '/data/autobackup/manifest.json'
+# - changes are uploaded once a file stays untouched for this long
+BACKUP_DEBOUNCE_SECS = 10
+# - periodic check of all the files, covers for directories that do not exist yet and systems without inotify
+BACKUP_RESCAN_SECS = 10 * 60
+# - number of files uploaded at the same time
+DEFAULT_BACKUP_MAX_CONCURRENT_UPLOADS = 2
+BACKUP_MAX_CONCURRENT_UPLOADS = int(os.environ.get("BACKUP_MAX_CONCURRENT_UPLOADS",
+                                                   default=DEFAULT_BACKUP_MAX_CONCURRENT_UPLOADS))
+if BACKUP_MAX_CONCURRENT_UPLOADS != DEFAULT_BACKUP_MAX_CONCURRENT_UPLOADS:
+    print(f"NOTE: Using custom BACKUP_MAX_CONCURRENT_UPLOADS={BACKUP_MAX_CONCURRENT_UPLOADS}\n"
+          f"      (default is {DEFAULT_BACKUP_MAX_CONCURRENT_UPLOADS})")
+# - files bigger than this are uploaded in parts of this size, an interrupted upload resumes from the last part
+BACKUP_CHUNK_SIZE = 8 * 1024 * 1024
+
+
+# HTTP connection pooling (shared by the statistics uploader and the HTTP-based providers)
+# - number of hosts to keep a pool of connections for
+DEFAULT_HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", default=DEFAULT_HTTP_POOL_CONNECTIONS))
+if HTTP_POOL_CONNECTIONS != DEFAULT_HTTP_POOL_CONNECTIONS:
+    print(f"NOTE: Using custom HTTP_POOL_CONNECTIONS={HTTP_POOL_CONNECTIONS}\n"
+          f"      (default is {DEFAULT_HTTP_POOL_CONNECTIONS})")
+# - number of connections to keep alive for each host
+DEFAULT_HTTP_POOL_MAXSIZE = 4
+HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", default=DEFAULT_HTTP_POOL_MAXSIZE))
+if HTTP_POOL_MAXSIZE != DEFAULT_HTTP_POOL_MAXSIZE:
+    print(f"NOTE: Using custom HTTP_POOL_MAXSIZE={HTTP_POOL_MAXSIZE}\n"
+          f"      (default is {DEFAULT_HTTP_POOL_MAXSIZE})")
+# - default (connect, read) timeouts for requests that do not specify one
+DEFAULT_HTTP_CONNECT_TIMEOUT_SECS = 5.0
+HTTP_CONNECT_TIMEOUT_SECS = float(os.environ.get("HTTP_CONNECT_TIMEOUT_SECS",
+                                                 default=DEFAULT_HTTP_CONNECT_TIMEOUT_SECS))
+if HTTP_CONNECT_TIMEOUT_SECS != DEFAULT_HTTP_CONNECT_TIMEOUT_SECS:
+    print(f"NOTE: Using custom HTTP_CONNECT_TIMEOUT_SECS={HTTP_CONNECT_TIMEOUT_SECS}\n"
+          f"      (default is {DEFAULT_HTTP_CONNECT_TIMEOUT_SECS})")
+DEFAULT_HTTP_READ_TIMEOUT_SECS = 30.0
+HTTP_READ_TIMEOUT_SECS = float(os.environ.get("HTTP_READ_TIMEOUT_SECS", default=DEFAULT_HTTP_READ_TIMEOUT_SECS))
+if HTTP_READ_TIMEOUT_SECS != DEFAULT_HTTP_READ_TIMEOUT_SECS:
+    print(f"NOTE: Using custom HTTP_READ_TIMEOUT_SECS={HTTP_READ_TIMEOUT_SECS}\n"
+          f"      (default is {DEFAULT_HTTP_READ_TIMEOUT_SECS})")
+
+
+# Services running on this device (e.g., device health API, ROS graph API)
+# - reached through the first of these hosts that accepts connections (loopback first, then the Docker
+#   host, then `<hostname>.local` through mDNS), the choice is kept for this long
+LOCAL_ENDPOINT_HOSTS = ["127.0.0.1", "host.docker.internal", "{hostname}.local"]
+LOCAL_ENDPOINT_TTL_SECS = 5 * 60
+LOCAL_ENDPOINT_PORT = 80
+LOCAL_ENDPOINT_PROBE_TIMEOUT_SECS = 0.5
+# - a specific host can be given instead
+LOCAL_ENDPOINT_HOST = os.environ.get("LOCAL_ENDPOINT_HOST", default="")
+if LOCAL_ENDPOINT_HOST:
+    print(f"NOTE: Using custom LOCAL_ENDPOINT_HOST={LOCAL_ENDPOINT_HOST}")
+    LOCAL_ENDPOINT_HOSTS = [LOCAL_ENDPOINT_HOST]
+# - facts about the device (hostname, device ID, robot type and configuration) are read again after this long
+DEVICE_FACTS_TTL_SECS = 10 * 60
+
+
+# Bandwidth budget shared by all the outbound traffic (statistics have priority over backups)
+# - sustained rate and burst, in bytes (0 to disable)
+DEFAULT_BANDWIDTH_LIMIT_BPS = 256 * 1024
+BANDWIDTH_LIMIT_BPS = int(os.environ.get("BANDWIDTH_LIMIT_BPS", default=DEFAULT_BANDWIDTH_LIMIT_BPS))
+if BANDWIDTH_LIMIT_BPS != DEFAULT_BANDWIDTH_LIMIT_BPS:
+    print(f"NOTE: Using custom BANDWIDTH_LIMIT_BPS={BANDWIDTH_LIMIT_BPS}\n"
+          f"      (default is {DEFAULT_BANDWIDTH_LIMIT_BPS})")
+BANDWIDTH_BURST_BYTES = 256 * 1024
+# - the budget is scaled down while the Wi-Fi link is poor (quality or bit rate below these)
+DEFAULT_BANDWIDTH_ADAPT_TO_LINK = "1"
+BANDWIDTH_ADAPT_TO_LINK = os.environ.get("BANDWIDTH_ADAPT_TO_LINK", default=DEFAULT_BANDWIDTH_ADAPT_TO_LINK)
+if BANDWIDTH_ADAPT_TO_LINK != DEFAULT_BANDWIDTH_ADAPT_TO_LINK:
+    print(f"NOTE: Using custom BANDWIDTH_ADAPT_TO_LINK={BANDWIDTH_ADAPT_TO_LINK}\n"
+          f"      (default is {DEFAULT_BANDWIDTH_ADAPT_TO_LINK})")
+BANDWIDTH_ADAPT_TO_LINK = BANDWIDTH_ADAPT_TO_LINK.lower() in ["1", "true", "yes"]
+BANDWIDTH_POOR_LINK_QUALITY = 30
+BANDWIDTH_POOR_LINK_BITRATE_MBPS = 12
+BANDWIDTH_POOR_LINK_FACTOR = 0.25
+
+
+# Self-metrics, served in the Prometheus text format on http://<address>:<port>/metrics (port 0 to disable)
+# - local only by default (the container shares the network of the robot), set the address to reach them
+#   from other hosts (e.g., 0.0.0.0)
+DEFAULT_METRICS_ADDRESS = "127.0.0.1"
+METRICS_ADDRESS = os.environ.get("METRICS_ADDRESS", default=DEFAULT_METRICS_ADDRESS)
+if METRICS_ADDRESS != DEFAULT_METRICS_ADDRESS:
+    print(f"NOTE: Using custom METRICS_ADDRESS={METRICS_ADDRESS}\n"
+          f"      (default is {DEFAULT_METRICS_ADDRESS})")
+DEFAULT_METRICS_PORT = 9106
+METRICS_PORT = int(os.environ.get("METRICS_PORT", default=DEFAULT_METRICS_PORT))
+if METRICS_PORT != DEFAULT_METRICS_PORT:
+    print(f"NOTE: Using custom METRICS_PORT={METRICS_PORT}\n"
+          f"      (default is {DEFAULT_METRICS_PORT})")
+
+
+# Profiling, one of "off", "hooks" (wall time, CPU time and allocated bytes of provider steps,
+# formatting, serialization and uploads, exposed as metrics) or "sampling" (hooks, plus a sampling
+# profiler that periodically dumps per-provider flame data)
+DEFAULT_STATS_PROFILE = "off"
+STATS_PROFILE = os.environ.get("STATS_PROFILE", default=DEFAULT_STATS_PROFILE).lower()
+if STATS_PROFILE != DEFAULT_STATS_PROFILE:
+    print(f"NOTE: Using custom STATS_PROFILE={STATS_PROFILE}\n"
+          f"      (default is {DEFAULT_STATS_PROFILE})")
+# - stacks are written in the collapsed format (one `<provider>.folded` file per provider), ready for
+#   flamegraph.pl or speedscope
+STATS_PROFILE_DIR = "/data/stats/profile"
+STATS_PROFILE_SAMPLING_INTERVAL_SECS = 0.01
+STATS_PROFILE_DUMP_SECS = 5 * 60
+
+
+# Retry policy shared by the workers talking to remote services
+# - exponential backoff with jitter
+RETRY_INITIAL_DELAY_SECS = 30
+RETRY_MAX_DELAY_SECS = 30 * 60
+RETRY_BACKOFF_FACTOR = 2.0
+# - fraction of the delay that is randomized (0 to disable)
+RETRY_JITTER = 0.5
+# - how often to check whether the device got back online
+CONNECTIVITY_CHECK_PERIOD_SECS = 5
 
 
 # Statistics collection for Duckietown
@@ -57,7 +182,45 @@ if STATS_API_LOCATION != DEFAULT_STATS_API_LOCATION:
 STATS_API_BASE_URL = f"{STATS_API_PROTOCOL}://{STATS_API_HOSTNAME}:{STATS_API_PORT}/" \
                      f"{STATS_API_BASE_URL}/{STATS_API_VERSION}/{STATS_API_LOCATION}"
 STATS_API_URL = STATS_API_BASE_URL + "{category}/{key}?device={device}&boot_id={boot_id}&stamp={stamp}"
+STATS_API_BATCH_URL = STATS_API_BASE_URL + "batch?boot_id={boot_id}"
 STATS_PUBLISHER_PERIOD_SECS = 60
+# - content encoding of the upload bodies, one of "gzip", "zstd" (needs the `zstandard` package), "none";
+#   opt-in, the server has to decode `Content-Encoding` (uploads fall back to "none" if it does not)
+DEFAULT_STATS_UPLOAD_COMPRESSION = "none"
+STATS_UPLOAD_COMPRESSION = os.environ.get("STATS_UPLOAD_COMPRESSION", default=DEFAULT_STATS_UPLOAD_COMPRESSION)
+if STATS_UPLOAD_COMPRESSION != DEFAULT_STATS_UPLOAD_COMPRESSION:
+    print(f"NOTE: Using custom STATS_UPLOAD_COMPRESSION={STATS_UPLOAD_COMPRESSION}\n"
+          f"      (default is {DEFAULT_STATS_UPLOAD_COMPRESSION})")
+# - bodies smaller than this (in bytes) are sent as they are
+DEFAULT_STATS_UPLOAD_COMPRESSION_THRESHOLD = 1024
+STATS_UPLOAD_COMPRESSION_THRESHOLD = int(os.environ.get("STATS_UPLOAD_COMPRESSION_THRESHOLD",
+                                                        default=DEFAULT_STATS_UPLOAD_COMPRESSION_THRESHOLD))
+if STATS_UPLOAD_COMPRESSION_THRESHOLD != DEFAULT_STATS_UPLOAD_COMPRESSION_THRESHOLD:
+    print(f"NOTE: Using custom STATS_UPLOAD_COMPRESSION_THRESHOLD={STATS_UPLOAD_COMPRESSION_THRESHOLD}\n"
+          f"      (default is {DEFAULT_STATS_UPLOAD_COMPRESSION_THRESHOLD})")
+# - compression level (gzip: 1-9, zstd: 1-22), empty to use the default level of the codec
+STATS_UPLOAD_COMPRESSION_LEVEL = os.environ.get("STATS_UPLOAD_COMPRESSION_LEVEL", default="")
+STATS_UPLOAD_COMPRESSION_LEVEL = int(STATS_UPLOAD_COMPRESSION_LEVEL) if STATS_UPLOAD_COMPRESSION_LEVEL else None
+if STATS_UPLOAD_COMPRESSION_LEVEL is not None:
+    print(f"NOTE: Using custom STATS_UPLOAD_COMPRESSION_LEVEL={STATS_UPLOAD_COMPRESSION_LEVEL}")
+# - maximum number of points packed into a single batch request (use 1 to disable batching)
+DEFAULT_STATS_UPLOAD_BATCH_SIZE = 50
+STATS_UPLOAD_BATCH_SIZE = int(os.environ.get("STATS_UPLOAD_BATCH_SIZE", default=DEFAULT_STATS_UPLOAD_BATCH_SIZE))
+if STATS_UPLOAD_BATCH_SIZE != DEFAULT_STATS_UPLOAD_BATCH_SIZE:
+    print(f"NOTE: Using custom STATS_UPLOAD_BATCH_SIZE={STATS_UPLOAD_BATCH_SIZE}\n"
+          f"      (default is {DEFAULT_STATS_UPLOAD_BATCH_SIZE})")
+# - maximum size (serialized payloads, in bytes) of a single batch request, bigger points go on their own
+DEFAULT_STATS_UPLOAD_BATCH_BYTES = 1024 * 1024
+STATS_UPLOAD_BATCH_BYTES = int(os.environ.get("STATS_UPLOAD_BATCH_BYTES",
+                                              default=DEFAULT_STATS_UPLOAD_BATCH_BYTES))
+if STATS_UPLOAD_BATCH_BYTES != DEFAULT_STATS_UPLOAD_BATCH_BYTES:
+    print(f"NOTE: Using custom STATS_UPLOAD_BATCH_BYTES={STATS_UPLOAD_BATCH_BYTES}\n"
+          f"      (default is {DEFAULT_STATS_UPLOAD_BATCH_BYTES})")
+# - points the server keeps rejecting (i.e., not as duplicates) leave the outbox after this many attempts,
+#   a copy of each one (payload included) is kept in the dead-letter directory, newest N only
+STATS_UPLOAD_MAX_REJECTIONS = 5
+STATS_DEAD_LETTER_DIR = "/data/stats/rejected"
+STATS_DEAD_LETTER_MAX_FILES = 1000
 STATS_BOOT_ID_FILE = "/proc/sys/kernel/random/boot_id"
 
 STATS_CATEGORY_TO_DIR = {
@@ -65,6 +228,129 @@ STATS_CATEGORY_TO_DIR = {
     "usage": "/data/stats/usage"
 }
 
+# New files in the statistics directories are picked up through inotify, with a periodic rescan as fallback
+STATS_WATCHER_RESCAN_SECS = 5 * 60
+# - files modified less than this long ago are considered still being written to
+STATS_WATCHER_SETTLE_SECS = 2
+# - backlogged files are turned into providers a window at a time, the rest is only a list of paths
+STATS_FILES_WINDOW = 200
+
+# Providers run concurrently on a bounded pool of workers
+STATS_PROVIDERS_WORKERS = 4
+# - default deadline for a single step of a provider
+STATS_PROVIDER_TIMEOUT_SECS = 30
+# - providers failing (or timing out) this many times in a row are quarantined with exponential backoff
+STATS_PROVIDER_MAX_FAILURES = 3
+STATS_PROVIDER_QUARANTINE_SECS = 10 * 60
+STATS_PROVIDER_MAX_QUARANTINE_SECS = 6 * 60 * 60
+# - one-shot providers that did not produce any data are tried again after this long
+STATS_ONESHOT_RETRY_SECS = 60
+# - periodic providers are stepped at their own frequency ("fixed") or less and less often while their
+#   payload does not change, back at their frequency as soon as it does ("adaptive")
+DEFAULT_STATS_SCHEDULING = "adaptive"
+STATS_SCHEDULING = os.environ.get("STATS_SCHEDULING", default=DEFAULT_STATS_SCHEDULING).lower()
+if STATS_SCHEDULING != DEFAULT_STATS_SCHEDULING:
+    print(f"NOTE: Using custom STATS_SCHEDULING={STATS_SCHEDULING}\n"
+          f"      (default is {DEFAULT_STATS_SCHEDULING})")
+#   + the period grows by this factor after every step that did not change the payload
+STATS_ADAPTIVE_BACKOFF_FACTOR = 2.0
+#   + default bounds (seconds between two steps) are the period of the provider and N times that
+STATS_ADAPTIVE_MAX_FACTOR = 8
+#   + bounds of specific providers, None keeps the default
+STATS_ADAPTIVE_PERIODS = {
+    # changes are reported by the Docker events stream, polling is only a fallback
+    "docker/ps": (None, 10 * 60),
+    "docker/images": (None, 30 * 60),
+}
+#   + more (or different) bounds can be given as `<key>=<min>:<max>` separated by commas, e.g.,
+#     STATS_ADAPTIVE_PERIODS="lsusb=7200:86400,health=:7200" (an empty bound keeps the default)
+for _entry in [e for e in os.environ.get("STATS_ADAPTIVE_PERIODS", default="").split(",") if e.strip()]:
+    _key, _bounds = _entry.strip().split("=", 1)
+    _min, _max = _bounds.split(":", 1)
+    _default = STATS_ADAPTIVE_PERIODS.get(_key, (None, None))
+    STATS_ADAPTIVE_PERIODS[_key] = (float(_min) if _min else _default[0], float(_max) if _max else _default[1])
+    print(f"NOTE: Using custom STATS_ADAPTIVE_PERIODS[{_key}]={STATS_ADAPTIVE_PERIODS[_key]}")
+# - resources of the device health API fetched less than this long ago are not fetched again
+DEVICE_HEALTH_MAX_AGE_SECS = 10
+# - timeout on calls to the Docker engine API
+DOCKER_API_TIMEOUT_SECS = 20
+# - how docker/ps and docker/images learn about changes, "events" (Docker events stream) or "polling"
+DEFAULT_DOCKER_STATS_MODE = "events"
+DOCKER_STATS_MODE = os.environ.get("DOCKER_STATS_MODE", default=DEFAULT_DOCKER_STATS_MODE)
+if DOCKER_STATS_MODE != DEFAULT_DOCKER_STATS_MODE:
+    print(f"NOTE: Using custom DOCKER_STATS_MODE={DOCKER_STATS_MODE}\n"
+          f"      (default is {DEFAULT_DOCKER_STATS_MODE})")
+# - changes happening within this time window are reported together
+DOCKER_EVENTS_DEBOUNCE_SECS = 2
+
+# ROS graph reporting
+# - send compact diffs between full keyframes instead of the whole graph every time, opt-in as the
+#   server has to know how to rebuild the graph from them
+DEFAULT_ROS_GRAPH_DELTA_MODE = "0"
+ROS_GRAPH_DELTA_MODE = os.environ.get("ROS_GRAPH_DELTA_MODE", default=DEFAULT_ROS_GRAPH_DELTA_MODE)
+if ROS_GRAPH_DELTA_MODE != DEFAULT_ROS_GRAPH_DELTA_MODE:
+    print(f"NOTE: Using custom ROS_GRAPH_DELTA_MODE={ROS_GRAPH_DELTA_MODE}\n"
+          f"      (default is {DEFAULT_ROS_GRAPH_DELTA_MODE})")
+ROS_GRAPH_DELTA_MODE = ROS_GRAPH_DELTA_MODE.lower() in ["1", "true", "yes"]
+# - a full graph (keyframe) is sent every N steps of the provider
+ROS_GRAPH_KEYFRAME_EVERY = 12
+
+# Change detection, providers that opt in do not report payloads identical to the last one they sent
+STATS_FINGERPRINTS_FILE = "/data/stats/fingerprints.json"
+# - an unchanged payload is sent anyway every N intervals of the provider (0 to disable)
+STATS_HEARTBEAT_EVERY = 24
+# - same, for one-shot providers (they only run once per boot)
+STATS_ONESHOT_HEARTBEAT_SECS = 24 * 60 * 60
+
+# Record-and-replay, the output and duration of every step of the providers are appended to this file
+# (JSON lines), a recording is replayed with `python3 -m online.benchmark --replay <file>`
+STATS_TRACE_FILE = os.environ.get("STATS_TRACE_FILE", default="")
+if STATS_TRACE_FILE:
+    print(f"NOTE: Recording the output of the providers to STATS_TRACE_FILE={STATS_TRACE_FILE}")
+# - the recording stops once the file grows this big
+STATS_TRACE_MAX_BYTES = 512 * 1024 * 1024
+
+# Durable outbox for the statistics points waiting to be uploaded
+STATS_OUTBOX_FILE = "/data/stats/outbox.sqlite"
+# - pending points are written to disk together (one fsync) every N points or every N seconds
+STATS_OUTBOX_SYNC_POINTS = 100
+STATS_OUTBOX_SYNC_SECS = 30
+# - number of points read back from disk at once during a flush
+STATS_OUTBOX_PAGE_SIZE = 500
+# - number of free pages in the database file that triggers a compaction
+STATS_OUTBOX_VACUUM_PAGES = 256
+# - size caps, the oldest usage/configuration points are dropped first, events are never dropped
+STATS_OUTBOX_MAX_POINTS = 20000
+STATS_OUTBOX_MAX_BYTES = 64 * 1024 * 1024
+# - snapshot-style keys for which only the newest N points are worth keeping
+STATS_OUTBOX_COALESCE = {
+    "docker/ps": 1,
+    "docker/images": 1,
+    "health": 1,
+    "wireless/status": 1,
+    "network/configuration": 1,
+    "ros/graph": 1,
+    "battery/history": 1,
+    "lsusb": 1,
+    "uptime": 1,
+}
+# - keys of points that only make sense applied on top of the points before them (delta key -> keyframe
+#   key), a keyframe or delta dropped from the outbox takes the deltas queued after it along, and new
+#   deltas of the same chain are dropped until the next keyframe
+STATS_OUTBOX_CHAINS = {
+    "ros/graph/delta": "ros/graph",
+}
+
+# Packed spool for events, an alternative to one JSON file per event
+# - producers append records to the open segment, sealed segments are uploaded and deleted as a whole
+STATS_SPOOL_DIR = "/data/stats/events/spool"
+# - the open segment is sealed once it grows this big or stays idle for this long
+STATS_SPOOL_SEGMENT_BYTES = 256 * 1024
+STATS_SPOOL_SEGMENT_SECS = 60
+# - retention, the oldest sealed segments are deleted first
+STATS_SPOOL_MAX_BYTES = 32 * 1024 * 1024
+STATS_SPOOL_MAX_AGE_SECS = 30 * 24 * 60 * 60
+
 
 class FREQUENCY:
     ONESHOT = 0
@@ -77,4 +363,4 @@ class FREQUENCY:
     EVERY_10_MINUTES = 1.0 / (60 * 10)
     EVERY_30_MINUTES = 1.0 / (60 * 30)
     EVERY_1_HOUR = 1.0 / (60 * 60 * 1)
-    EVERY_2_HOURS = 1.0 / (60 * 60 * 1)
+    EVERY_2_HOURS = 1.0 / (60 * 60 * 2)
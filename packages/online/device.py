@@ -0,0 +1,140 @@
+import socket
+import time
+from threading import Semaphore
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+from dt_device_utils import get_device_id, get_device_hostname
+from dt_robot_utils import get_robot_type, get_robot_configuration, RobotType, RobotConfiguration
+
+from .constants import \
+    DEVICE_FACTS_TTL_SECS, \
+    LOCAL_ENDPOINT_HOSTS, \
+    LOCAL_ENDPOINT_PORT, \
+    LOCAL_ENDPOINT_TTL_SECS, \
+    LOCAL_ENDPOINT_PROBE_TIMEOUT_SECS
+from .session import get_session
+
+
+class DeviceFacts:
+    # Facts about this device that do not change while we run (or rarely do, e.g., the robot configuration).
+    # Each one is read the first time it is needed and then kept for `ttl` seconds, failed reads are not kept.
+
+    def __init__(self, ttl: float = DEVICE_FACTS_TTL_SECS):
+        self._ttl = ttl
+        self._lock = Semaphore(1)
+        self._facts: Dict[str, Tuple[Any, float]] = {}
+
+    def _get(self, name: str, read: Callable[[], Any]) -> Any:
+        with self._lock:
+            value, expires = self._facts.get(name, (None, 0))
+            if time.monotonic() < expires:
+                return value
+        value = read()
+        with self._lock:
+            self._facts[name] = (value, time.monotonic() + self._ttl)
+        return value
+
+    @property
+    def hostname(self) -> str:
+        return self._get("hostname", get_device_hostname)
+
+    @property
+    def device_id(self) -> str:
+        # raises ValueError if the device does not have one
+        return self._get("device_id", get_device_id)
+
+    @property
+    def robot_type(self) -> RobotType:
+        return self._get("robot_type", get_robot_type)
+
+    @property
+    def robot_configuration(self) -> RobotConfiguration:
+        return self._get("robot_configuration", get_robot_configuration)
+
+    def invalidate(self):
+        with self._lock:
+            self._facts.clear()
+
+
+class LocalEndpoints:
+    # Reaches the services running on this device. The candidate hosts are resolved and probed once (an
+    # mDNS lookup of `<hostname>.local` can take seconds), the address of the first one that accepts
+    # connections is kept for `ttl` seconds, or until a request to it fails to connect.
+
+    def __init__(self, hosts: List[str] = LOCAL_ENDPOINT_HOSTS, port: int = LOCAL_ENDPOINT_PORT,
+                 ttl: float = LOCAL_ENDPOINT_TTL_SECS):
+        self._hosts = hosts
+        self._port = port
+        self._ttl = ttl
+        self._lock = Semaphore(1)
+        self._address: Optional[str] = None
+        self._expires: float = 0
+
+    def _probe(self, host: str) -> Optional[str]:
+        # returns the address `host` resolves to, if something listens there
+        try:
+            _, _, _, _, sockaddr = socket.getaddrinfo(host, self._port, type=socket.SOCK_STREAM)[0]
+            with socket.create_connection(sockaddr[:2], timeout=LOCAL_ENDPOINT_PROBE_TIMEOUT_SECS):
+                return sockaddr[0]
+        except OSError:
+            return None
+
+    def _resolve(self) -> str:
+        hostname = get_device_facts().hostname
+        hosts = [host.format(hostname=hostname) for host in self._hosts]
+        for host in hosts:
+            address = self._probe(host)
+            if address is not None:
+                return address
+        # nobody answered (yet), the last candidate is the one that used to work
+        return hosts[-1]
+
+    @property
+    def address(self) -> str:
+        # other callers wait for an ongoing resolution instead of starting their own
+        with self._lock:
+            if self._address is None or time.monotonic() >= self._expires:
+                self._address = self._resolve()
+                self._expires = time.monotonic() + self._ttl
+            return self._address
+
+    def url(self, path: str) -> str:
+        address = self.address
+        host = f"[{address}]" if ":" in address else address
+        return f"http://{host}:{self._port}/{path.lstrip('/')}"
+
+    def invalidate(self):
+        with self._lock:
+            self._address = None
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        # services are still addressed by name (e.g., by a reverse proxy), whatever address we reach them at
+        headers = {"Host": f"{get_device_facts().hostname}.local", **kwargs.pop("headers", {})}
+        try:
+            return get_session().get(self.url(path), headers=headers, **kwargs)
+        except requests.ConnectionError:
+            # the service might have moved, look for it again next time
+            self.invalidate()
+            raise
+
+
+_facts: Optional[DeviceFacts] = None
+_endpoints: Optional[LocalEndpoints] = None
+_lock = Semaphore(1)
+
+
+def get_device_facts() -> DeviceFacts:
+    global _facts
+    with _lock:
+        if _facts is None:
+            _facts = DeviceFacts()
+        return _facts
+
+
+def get_local_endpoints() -> LocalEndpoints:
+    global _endpoints
+    with _lock:
+        if _endpoints is None:
+            _endpoints = LocalEndpoints()
+        return _endpoints
@@ -0,0 +1,98 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+from typing import Dict, List, Optional, Tuple
+
+# event masks (see `man 7 inotify`)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0x00080000
+IN_NONBLOCK = 0x00000800
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    return _libc
+
+
+class Inotify:
+    # Thin wrapper around the Linux inotify API. Events are returned as (directory, name, mask),
+    # an event with mask IN_Q_OVERFLOW means that events were lost and the caller should rescan.
+
+    def __init__(self):
+        libc = _get_libc()
+        self._fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        # a pipe is used to wake up a reader blocked on `read()`
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        self._watches: Dict[int, str] = {}
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = _get_libc().inotify_add_watch(self._fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        self._watches[wd] = path
+        return wd
+
+    @property
+    def watched(self) -> List[str]:
+        return list(self._watches.values())
+
+    def wakeup(self):
+        os.write(self._wakeup_w, b"\0")
+
+    def read(self, timeout: Optional[float] = None) -> List[Tuple[str, str, int]]:
+        ready, _, _ = select.select([self._fd, self._wakeup_r], [], [], timeout)
+        if self._wakeup_r in ready:
+            os.read(self._wakeup_r, 1024)
+        if self._fd not in ready:
+            return []
+        try:
+            buffer = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(buffer):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(buffer, offset)
+            offset += _EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b"\0").decode("utf-8", errors="replace")
+            offset += length
+            if mask & IN_IGNORED:
+                # the watch was removed (e.g., the directory was deleted)
+                directory = self._watches.pop(wd, None)
+            else:
+                directory = self._watches.get(wd, None)
+            if directory is None and not mask & IN_Q_OVERFLOW:
+                continue
+            events.append((directory, name, mask))
+        return events
+
+    def close(self):
+        for fd in [self._fd, self._wakeup_r, self._wakeup_w]:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
@@ -1,27 +1,45 @@
-import time
-
 from dt_class_utils import DTProcess
 from online.statistics.collector import StatisticsWorker
 
 from .autobackup import AutoBackupWorker
+from .constants import METRICS_PORT
+from .metrics import MetricsServer
+from .profiling import SamplingProfiler, get_profiler
+from .scheduler import get_scheduler
+from .session import close_session
 
 
 class DeviceOnlineApp(DTProcess):
 
     def __init__(self):
         super().__init__()
+        self._scheduler = get_scheduler()
         self._backup_worker = AutoBackupWorker()
         self._statistics_worker = StatisticsWorker()
+        self._metrics_server = MetricsServer()
+        self._profiler = SamplingProfiler()
+        # start scheduler
+        self._scheduler.start()
         # start backup worker
         self._backup_worker.start()
         # start statistics collector worker
         self._statistics_worker.start()
+        # serve self-metrics
+        if METRICS_PORT > 0:
+            self._metrics_server.start()
+        # sample where the time goes (opt-in)
+        if get_profiler().sampling:
+            self._profiler.start()
         # register shutdown
         self.register_shutdown_callback(self._backup_worker.shutdown)
         self.register_shutdown_callback(self._statistics_worker.shutdown)
-        # keep process alive
-        while not self.is_shutdown():
-            time.sleep(1)
+        self.register_shutdown_callback(self._metrics_server.shutdown)
+        self.register_shutdown_callback(self._profiler.shutdown)
+        self.register_shutdown_callback(self._scheduler.shutdown)
+        # release pooled HTTP connections last
+        self.register_shutdown_callback(close_session)
+        # keep process alive, the scheduler only stops on shutdown
+        self._scheduler.join()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,196 @@
+import bisect
+import math
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Semaphore
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from dt_class_utils import DTProcess
+
+from .constants import METRICS_ADDRESS, METRICS_PORT
+
+# Minimal metrics registry exposed in the Prometheus text format (version 0.0.4)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = Semaphore(1)
+
+    def _labels(self, values: LabelValues, extra: Dict[str, str] = None) -> str:
+        pairs = list(zip(self.labels, values)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in pairs) + "}"
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super(Counter, self).__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{self._labels(k)} {_format_value(v)}" for k, v in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super(Gauge, self).__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+        # gauges without labels can be computed when they are scraped
+        self._function = function
+
+    def set(self, *labels: str, value: float):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, *labels: str, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            return [f"{self.name} {_format_value(self._function())}"]
+        with self._lock:
+            return [f"{self.name}{self._labels(k)} {_format_value(v)}" for k, v in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labels)
+        self._buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> (count per bucket, sum)
+        self._values: Dict[LabelValues, Tuple[List[int], float]] = {}
+
+    def observe(self, *labels: str, value: float):
+        with self._lock:
+            counts, total = self._values.get(labels, ([0] * len(self._buckets), 0.0))
+            counts[bisect.bisect_left(self._buckets, value)] += 1
+            self._values[labels] = (counts, total + value)
+
+    def samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            for labels, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self._buckets, counts):
+                    cumulative += count
+                    le = {"le": "+Inf" if math.isinf(bound) else repr(bound)}
+                    lines.append(f"{self.name}_bucket{self._labels(labels, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{self._labels(labels)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{self._labels(labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = Semaphore(1)
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            # the same metric can be asked for more than once (e.g., by multiple instances of a class)
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = (),
+              function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self._register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(m.render() for m in metrics) + "\n"
+
+
+_registry = Registry()
+
+
+def get_registry() -> Registry:
+    return _registry
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ["/", "/metrics"]:
+            self.send_error(404)
+            return
+        body = _registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_):
+        # scrapes are not worth a log line
+        pass
+
+
+class MetricsServer(Thread):
+
+    def __init__(self, address: str = METRICS_ADDRESS, port: int = METRICS_PORT):
+        super(MetricsServer, self).__init__(daemon=True)
+        self._address = address
+        self._port = port
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def run(self):
+        app = DTProcess.get_instance()
+        try:
+            self._server = ThreadingHTTPServer((self._address, self._port), _Handler)
+        except OSError as e:
+            app.logger.warning(f"Could not serve metrics on {self._address}:{self._port}, reason: {str(e)}")
+            return
+        app.logger.info(f"Serving metrics on http://{self._address}:{self._port}/metrics")
+        self._server.serve_forever()
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
@@ -0,0 +1,42 @@
+from typing import List, Callable
+
+from .constants import CONNECTIVITY_CHECK_PERIOD_SECS
+from .scheduler import get_scheduler, ScheduledTask
+
+IPV4_ROUTES_FILE = "/proc/net/route"
+IPV6_ROUTES_FILE = "/proc/net/ipv6_route"
+
+
+def _read_lines(filepath: str) -> List[str]:
+    try:
+        with open(filepath, 'rt') as fin:
+            return fin.readlines()
+    except OSError:
+        return []
+
+
+def has_default_route() -> bool:
+    # IPv4: destination and mask are both 00000000 (first line is the header)
+    for line in _read_lines(IPV4_ROUTES_FILE)[1:]:
+        fields = line.split()
+        if len(fields) >= 8 and fields[1] == "00000000" and fields[7] == "00000000":
+            return True
+    # IPv6: destination ::/0, ignoring the loopback interface
+    for line in _read_lines(IPV6_ROUTES_FILE):
+        fields = line.split()
+        if len(fields) >= 10 and fields[0] == "0" * 32 and fields[1] == "00" and fields[9] != "lo":
+            return True
+    return False
+
+
+def wait_for_connectivity(callback: Callable[[], None]) -> ScheduledTask:
+    # checks for a default route periodically, calls `callback` once as soon as there is one
+    task = None
+
+    def _check():
+        if has_default_route():
+            task.cancel()
+            callback()
+
+    task = get_scheduler().call_every(CONNECTIVITY_CHECK_PERIOD_SECS, _check, delay=CONNECTIVITY_CHECK_PERIOD_SECS)
+    return task
@@ -0,0 +1,163 @@
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from threading import Thread, Event, Semaphore, get_ident
+from types import FrameType
+from typing import Dict, Iterator, Optional
+
+from dt_class_utils import DTProcess
+
+from .constants import \
+    STATS_PROFILE, \
+    STATS_PROFILE_DIR, \
+    STATS_PROFILE_SAMPLING_INTERVAL_SECS, \
+    STATS_PROFILE_DUMP_SECS
+from .metrics import get_registry
+
+PROFILE_MODES = ["off", "hooks", "sampling"]
+ALLOC_BUCKETS = tuple(2 ** i for i in range(10, 27, 2))
+
+
+class Profiler:
+    # Hooks around the sections of work we want to account for (provider steps, formatting,
+    # serialization, uploads), nothing is measured unless profiling is enabled.
+    # CPU time is measured on the thread running the section. Allocations are traced process-wide,
+    # sections running at the same time on other threads show up in each other's numbers.
+
+    def __init__(self, mode: str = STATS_PROFILE):
+        if mode not in PROFILE_MODES:
+            DTProcess.get_instance().logger.warning(f"Unknown profiling mode '{mode}', profiling is disabled.")
+            mode = "off"
+        self._mode = mode
+        self._lock = Semaphore(1)
+        # thread -> target of the section the thread is in
+        self._active: Dict[int, str] = {}
+        if not self.enabled:
+            return
+        tracemalloc.start()
+        metrics = get_registry()
+        self._wall = metrics.histogram(
+            "dt_online_profile_wall_seconds", "Wall time spent in a profiled section.", ["target", "phase"])
+        self._cpu = metrics.histogram(
+            "dt_online_profile_cpu_seconds", "CPU time spent in a profiled section.", ["target", "phase"])
+        self._alloc = metrics.histogram(
+            "dt_online_profile_alloc_bytes", "Memory allocated (and still held) by a profiled section.",
+            ["target", "phase"], buckets=ALLOC_BUCKETS)
+
+    @property
+    def enabled(self) -> bool:
+        return self._mode != "off"
+
+    @property
+    def sampling(self) -> bool:
+        return self._mode == "sampling"
+
+    def active(self) -> Dict[int, str]:
+        with self._lock:
+            return dict(self._active)
+
+    @contextmanager
+    def measure(self, target: str, phase: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        ident = get_ident()
+        with self._lock:
+            outer = self._active.get(ident, None)
+            self._active[ident] = target
+        memory = tracemalloc.get_traced_memory()[0]
+        cpu, wall = time.thread_time(), time.monotonic()
+        try:
+            yield
+        finally:
+            wall, cpu = time.monotonic() - wall, time.thread_time() - cpu
+            memory = tracemalloc.get_traced_memory()[0] - memory
+            with self._lock:
+                if outer is None:
+                    self._active.pop(ident, None)
+                else:
+                    self._active[ident] = outer
+            self._wall.observe(target, phase, value=wall)
+            self._cpu.observe(target, phase, value=cpu)
+            self._alloc.observe(target, phase, value=max(0, memory))
+
+
+class SamplingProfiler(Thread):
+    # Samples the stacks of the threads that are inside a profiled section and counts them per target.
+    # Counts are cumulative and are written in the collapsed format (`frame;frame;frame count`) to
+    # `<directory>/<target>.folded` every `dump_every` seconds and on shutdown.
+
+    def __init__(self, directory: str = STATS_PROFILE_DIR,
+                 interval: float = STATS_PROFILE_SAMPLING_INTERVAL_SECS,
+                 dump_every: float = STATS_PROFILE_DUMP_SECS):
+        super(SamplingProfiler, self).__init__(daemon=True)
+        self._directory = directory
+        self._interval = interval
+        self._dump_every = dump_every
+        self._stacks: Dict[str, Counter] = defaultdict(Counter)
+        self._stopped = Event()
+
+    @staticmethod
+    def _collapse(frame: FrameType) -> str:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            # frames are identified by function (not line), so that samples of a function add up
+            stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(stack))
+
+    def _sample(self, active: Dict[int, str]):
+        if not active:
+            return
+        frames = sys._current_frames()
+        for ident, target in active.items():
+            frame = frames.get(ident, None)
+            if frame is not None:
+                self._stacks[target][self._collapse(frame)] += 1
+
+    def _dump(self):
+        try:
+            os.makedirs(self._directory, exist_ok=True)
+            for target, stacks in list(self._stacks.items()):
+                filepath = os.path.join(self._directory, f"{target}.folded")
+                with open(filepath + ".tmp", "wt") as fout:
+                    for stack, count in stacks.most_common():
+                        fout.write(f"{stack} {count}\n")
+                os.rename(filepath + ".tmp", filepath)
+        except OSError as e:
+            DTProcess.get_instance().logger.warning(f"Could not write the profile, reason: {str(e)}")
+
+    def run(self):
+        profiler = get_profiler()
+        if not profiler.sampling:
+            return
+        DTProcess.get_instance().logger.info(f"Sampling profiler enabled, writing to '{self._directory}'.")
+        last_dump = time.monotonic()
+        while not self._stopped.wait(self._interval):
+            self._sample(profiler.active())
+            if time.monotonic() - last_dump >= self._dump_every:
+                self._dump()
+                last_dump = time.monotonic()
+        self._dump()
+
+    def shutdown(self):
+        self._stopped.set()
+        # let the last dump happen
+        if self.is_alive():
+            self.join(timeout=5)
+
+
+_profiler: Optional[Profiler] = None
+_lock = Semaphore(1)
+
+
+def get_profiler() -> Profiler:
+    global _profiler
+    with _lock:
+        if _profiler is None:
+            _profiler = Profiler()
+        return _profiler
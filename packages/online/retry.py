@@ -0,0 +1,91 @@
+import math
+import random
+import time
+from enum import Enum
+
+from .constants import \
+    RETRY_INITIAL_DELAY_SECS, \
+    RETRY_MAX_DELAY_SECS, \
+    RETRY_BACKOFF_FACTOR, \
+    RETRY_JITTER
+
+
+class CircuitState(Enum):
+    # requests flow normally
+    CLOSED = "closed"
+    # the remote end is considered down, no requests until the backoff expires
+    OPEN = "open"
+    # the backoff expired, a single probe request decides whether to close the circuit again
+    HALF_OPEN = "half-open"
+
+
+class RetryPolicy:
+
+    def __init__(self,
+                 initial_delay: float = RETRY_INITIAL_DELAY_SECS,
+                 max_delay: float = RETRY_MAX_DELAY_SECS,
+                 factor: float = RETRY_BACKOFF_FACTOR,
+                 jitter: float = RETRY_JITTER,
+                 threshold: int = 1):
+        self._initial_delay = initial_delay
+        self._max_delay = max_delay
+        self._factor = factor
+        self._jitter = jitter
+        # number of consecutive failures that opens the circuit
+        self._threshold = max(1, threshold)
+        # past this many failures the delay is capped anyway, the exponent stops growing there (a float
+        # power overflows after ~1000 failures, i.e., a couple of weeks of an unreachable server)
+        self._max_exponent = 0
+        if factor > 1 and 0 < initial_delay < max_delay:
+            self._max_exponent = math.ceil(math.log(max_delay / initial_delay, factor))
+        # ---
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._next_attempt = 0
+
+    @property
+    def state(self) -> CircuitState:
+        return self._state
+
+    @property
+    def failures(self) -> int:
+        return self._failures
+
+    @property
+    def probing(self) -> bool:
+        return self._state == CircuitState.HALF_OPEN
+
+    @property
+    def delay(self) -> float:
+        # seconds left before the next attempt is allowed
+        return max(0.0, self._next_attempt - time.time())
+
+    def allow(self) -> bool:
+        if self._state == CircuitState.CLOSED:
+            return True
+        if time.time() < self._next_attempt:
+            return False
+        # the backoff expired, let a probe through
+        self._state = CircuitState.HALF_OPEN
+        return True
+
+    def success(self):
+        self._state = CircuitState.CLOSED
+        self._failures = 0
+        self._next_attempt = 0
+
+    def failure(self) -> float:
+        self._failures += 1
+        if self._failures < self._threshold:
+            return 0
+        self._state = CircuitState.OPEN
+        # exponential backoff with jitter, so that a fleet of devices does not retry in lockstep
+        exponent = min(self._failures - self._threshold, self._max_exponent)
+        delay = min(self._max_delay, self._initial_delay * (self._factor ** exponent))
+        delay *= 1.0 - self._jitter * random.random()
+        self._next_attempt = time.time() + delay
+        return delay
+
+    def reset(self):
+        # used when we have reasons to believe the remote end is reachable again (e.g., back online)
+        self.success()
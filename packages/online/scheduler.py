@@ -0,0 +1,103 @@
+import dataclasses
+import heapq
+import itertools
+import time
+from threading import Thread, Condition, Semaphore
+from typing import Callable, List, Optional
+
+from dt_class_utils import DTProcess
+
+
+@dataclasses.dataclass(order=True)
+class ScheduledTask:
+    deadline: float
+    seq: int
+    callback: Callable[[], None] = dataclasses.field(compare=False)
+    # tasks with a period of 0 run only once
+    period: float = dataclasses.field(default=0, compare=False)
+    cancelled: bool = dataclasses.field(default=False, compare=False)
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Scheduler(Thread):
+    # Runs callbacks at their deadline. The thread sleeps exactly until the next task is due and is
+    # woken up immediately when a task is added or the scheduler is shut down.
+    # Callbacks run on the scheduler thread, they are expected to be short (e.g., wake up a worker).
+
+    def __init__(self):
+        super(Scheduler, self).__init__(daemon=True)
+        self._shutdown = False
+        self._heap: List[ScheduledTask] = []
+        self._counter = itertools.count()
+        self._cond = Condition()
+
+    def is_shutdown(self) -> bool:
+        return self._shutdown
+
+    def shutdown(self):
+        with self._cond:
+            self._shutdown = True
+            self._cond.notify_all()
+
+    def call_at(self, deadline: float, callback: Callable[[], None], period: float = 0) -> ScheduledTask:
+        task = ScheduledTask(deadline, next(self._counter), callback, period)
+        with self._cond:
+            heapq.heappush(self._heap, task)
+            # the new task might be due before the one we are currently waiting for
+            if self._heap[0] is task:
+                self._cond.notify_all()
+        return task
+
+    def call_later(self, delay: float, callback: Callable[[], None]) -> ScheduledTask:
+        return self.call_at(time.monotonic() + max(0.0, delay), callback)
+
+    def call_every(self, period: float, callback: Callable[[], None], delay: float = 0) -> ScheduledTask:
+        return self.call_at(time.monotonic() + max(0.0, delay), callback, period)
+
+    def _next(self) -> Optional[ScheduledTask]:
+        with self._cond:
+            while not self._shutdown:
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                task = self._heap[0]
+                if task.cancelled:
+                    heapq.heappop(self._heap)
+                    continue
+                timeout = task.deadline - time.monotonic()
+                if timeout > 0:
+                    self._cond.wait(timeout)
+                    continue
+                heapq.heappop(self._heap)
+                # periodic tasks go back in the heap, missed runs are skipped instead of piling up
+                if task.period > 0:
+                    task.deadline = max(task.deadline + task.period, time.monotonic())
+                    task.seq = next(self._counter)
+                    heapq.heappush(self._heap, task)
+                return task
+        return None
+
+    def run(self):
+        while True:
+            task = self._next()
+            if task is None:
+                return
+            # noinspection PyBroadException
+            try:
+                task.callback()
+            except Exception as e:
+                DTProcess.get_instance().logger.error(f"Scheduled task {task.callback} failed: {str(e)}")
+
+
+_scheduler: Optional[Scheduler] = None
+_lock = Semaphore(1)
+
+
+def get_scheduler() -> Scheduler:
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
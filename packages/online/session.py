@@ -0,0 +1,47 @@
+from threading import Semaphore
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .constants import \
+    HTTP_POOL_CONNECTIONS, \
+    HTTP_POOL_MAXSIZE, \
+    HTTP_CONNECT_TIMEOUT_SECS, \
+    HTTP_READ_TIMEOUT_SECS
+
+
+class PooledSession(requests.Session):
+
+    def __init__(self):
+        super(PooledSession, self).__init__()
+        self._timeout = (HTTP_CONNECT_TIMEOUT_SECS, HTTP_READ_TIMEOUT_SECS)
+        # keep-alive connections are reused across requests to the same host
+        adapter = HTTPAdapter(pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        # never let a request hang forever
+        kwargs.setdefault("timeout", self._timeout)
+        return super(PooledSession, self).request(method, url, **kwargs)
+
+
+_session: Optional[PooledSession] = None
+_lock = Semaphore(1)
+
+
+def get_session() -> PooledSession:
+    global _session
+    with _lock:
+        if _session is None:
+            _session = PooledSession()
+        return _session
+
+
+def close_session():
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
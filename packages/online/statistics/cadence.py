@@ -0,0 +1,44 @@
+from typing import Optional, Tuple
+
+from .providers import StatisticsProvider
+from ..constants import STATS_ADAPTIVE_BACKOFF_FACTOR, STATS_ADAPTIVE_MAX_FACTOR, STATS_ADAPTIVE_PERIODS
+
+
+def bounds(provider: StatisticsProvider) -> Tuple[float, float]:
+    # shortest and longest period (in seconds) of a periodic provider
+    min_period, max_period = STATS_ADAPTIVE_PERIODS.get(provider.key, (None, None))
+    min_period = min_period or provider.period
+    max_period = max_period or min_period * STATS_ADAPTIVE_MAX_FACTOR
+    return min_period, max(min_period, max_period)
+
+
+class AdaptivePeriod:
+    # Seconds between two steps of a periodic provider. The period grows (up to `max_period`) every time
+    # a step gives back the same payload as the step before it and drops back to `min_period` as soon as
+    # the payload changes.
+
+    def __init__(self, min_period: float, max_period: float, factor: float = STATS_ADAPTIVE_BACKOFF_FACTOR):
+        self._min_period = min_period
+        self._max_period = max(min_period, max_period)
+        self._factor = factor
+        # ---
+        self._period = min_period
+        self._last: Optional[str] = None
+
+    @classmethod
+    def for_provider(cls, provider: StatisticsProvider) -> 'AdaptivePeriod':
+        return cls(*bounds(provider))
+
+    @property
+    def period(self) -> float:
+        return self._period
+
+    def update(self, fingerprint: str) -> bool:
+        # takes the fingerprint of the last payload, returns whether the period changed
+        previous = self._period
+        if fingerprint == self._last:
+            self._period = min(self._max_period, self._period * self._factor)
+        else:
+            self._period = self._min_period
+        self._last = fingerprint
+        return self._period != previous
@@ -1,206 +1,731 @@
-import copy
 import json
 import os
 import time
-import requests
-import dataclasses
-from enum import Enum
-from threading import Thread, Semaphore
-from typing import List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from threading import Thread, Event, Semaphore
+from typing import List, Optional, Dict, Set, Any, Callable, Deque, Tuple
 
 import dt_authentication
+import requests
+from requests import RequestException, HTTPError
 from dt_authentication import DuckietownToken
 
-from dt_class_utils import DTProcess, DTReminder
-from dt_device_utils import get_device_id
+from dt_class_utils import DTProcess
 from dt_permissions_utils import permission_granted
 from dt_secrets_utils import get_secret
-from .providers.configuration.RobotConfigurationProvider import RobotConfigurationProvider
-from .providers.configuration.RobotHostnameProvider import RobotHostnameProvider
-from .providers.configuration.RobotTypeProvider import RobotTypeProvider
-from .providers.usage.BatteryHistoryProvider import BatteryHistoryProvider
-from .providers.usage.BatteryInfoProvider import BatteryInfoProvider
-from .providers.usage.DockerImagesProvider import DockerImagesProvider
-from .providers.usage.GeolocationProvider import GeolocationProvider
-from .providers.usage.HealthProvider import HealthProvider
-from .providers.usage.LSUSBProvider import LSUSBProvider
-from .providers.usage.PublicIPProvider import PublicIPProvider
-from .providers.usage.ROSGraphProvider import ROSGraphProvider
-from .providers.usage.UptimeProvider import UptimeProvider
-from .providers.usage.NetworkConfigurationProvider import NetworkConfigurationProvider
-from .providers.usage.WirelessStatusProvider import WirelessStatusProvider
+from ..bandwidth import ThrottledBody, Priority
+from ..device import get_device_facts
+from ..metrics import get_registry
+from ..network import has_default_route, wait_for_connectivity
+from ..profiling import get_profiler
+from ..retry import RetryPolicy
+from ..scheduler import get_scheduler, ScheduledTask
+from ..session import get_session
 
 from ..constants import \
     STATS_CATEGORY_TO_DIR, \
     STATS_PUBLISHER_PERIOD_SECS, \
-    FREQUENCY, \
     STATS_API_URL, \
-    STATS_BOOT_ID_FILE
+    STATS_API_BATCH_URL, \
+    STATS_UPLOAD_BATCH_SIZE, \
+    STATS_UPLOAD_BATCH_BYTES, \
+    STATS_UPLOAD_MAX_REJECTIONS, \
+    STATS_DEAD_LETTER_DIR, \
+    STATS_DEAD_LETTER_MAX_FILES, \
+    STATS_BOOT_ID_FILE, \
+    STATS_OUTBOX_FILE, \
+    STATS_OUTBOX_PAGE_SIZE, \
+    STATS_OUTBOX_SYNC_SECS, \
+    STATS_PROVIDERS_WORKERS, \
+    STATS_PROVIDER_MAX_FAILURES, \
+    STATS_PROVIDER_QUARANTINE_SECS, \
+    STATS_PROVIDER_MAX_QUARANTINE_SECS, \
+    STATS_ONESHOT_RETRY_SECS, \
+    STATS_FILES_WINDOW, \
+    STATS_SPOOL_DIR, \
+    STATS_SPOOL_SEGMENT_SECS, \
+    STATS_SCHEDULING
 
+from . import spool
+from .cadence import AdaptivePeriod
+from .encoding import BodyEncoder, EncodedBody
+from .fingerprints import FingerprintStore, fingerprint
+from .outbox import StatisticsOutbox
+from .point import StatisticsCategory, StatisticsPoint
+from .trace import get_recorder
+from .watcher import StatisticsFilesWatcher
 from .providers import StatisticsProvider
-from .providers.event import glob_event_providers
-from .providers.usage import glob_usage_providers
-from .providers.usage.DockerPSProvider import DockerPSProvider
-
-
-class StatisticsCategory(Enum):
-    EVENT = "event"
-    USAGE = "usage"
-    CONFIGURATION = "configuration"
+from .providers import FileStatsProvider
+from .providers.event import GenericFileEventProvider, SpoolEventProvider
+from .providers.registry import PROVIDERS
+from .providers.usage import GenericFileUsageProvider
 
-
-@dataclasses.dataclass
-class StatisticsPoint:
-    category: StatisticsCategory
-    key: str
-    device: str
-    stamp: float
-    payload: dict
-    provider: StatisticsProvider
-
-    def __str__(self):
-        return json.dumps({
-            "category": self.category.value,
-            "key": self.key,
-            "device": self.device,
-            "stamp": self.stamp,
-            "payload": self.payload
-        })
+_metrics = get_registry()
+PROVIDER_STEP_SECONDS = _metrics.histogram(
+    "dt_online_provider_step_seconds", "Time taken by a provider to step.", ["provider"])
+PROVIDER_FAILURES = _metrics.counter(
+    "dt_online_provider_failures_total", "Steps that failed or did not complete in time.", ["provider"])
+PROVIDER_LAST_SUCCESS = _metrics.gauge(
+    "dt_online_provider_last_success_timestamp_seconds", "Time of the last successful step.", ["provider"])
+PROVIDER_PERIOD = _metrics.gauge(
+    "dt_online_provider_period_seconds", "Current time between two scheduled steps.", ["provider"])
+UPLOAD_SECONDS = _metrics.histogram(
+    "dt_online_upload_seconds", "Time taken by an upload request.", ["mode"])
+UPLOAD_REQUESTS = _metrics.counter(
+    "dt_online_upload_requests_total", "Upload requests by response status (2xx, 409, 4xx, 5xx, error).",
+    ["status"])
+UPLOAD_POINTS = _metrics.counter(
+    "dt_online_upload_points_total", "Uploaded points by outcome (accepted, duplicate, rejected, dropped).",
+    ["outcome"])
+UPLOAD_BYTES = _metrics.counter(
+    "dt_online_upload_bytes_total", "Bytes of statistics sent, after compression.")
+UPLOAD_RAW_BYTES = _metrics.counter(
+    "dt_online_upload_raw_bytes_total", "Bytes of statistics sent, before compression.")
 
 
 class StatisticsWorker(Thread):
 
-    def __init__(self):
+    def __init__(self, uploader: Optional['StatisticsUploader'] = None):
         super().__init__()
         events_dir = STATS_CATEGORY_TO_DIR["event"]
         usage_dir = STATS_CATEGORY_TO_DIR["usage"]
         # ---
         self._shutdown = False
         self._providers: List[StatisticsProvider] = []
-        self._outbox = StatisticsUploader()
-        self._timer = DTReminder(frequency=FREQUENCY.EVERY_MINUTE)
-        # register providers
-        # - stats/events/ dir
-        self._providers.extend(glob_event_providers(events_dir, "*.json"))
-        # - stats/usage/disk_image/ dir
-        self._providers.extend(glob_usage_providers(
-            os.path.join(usage_dir, "disk_image"), "*.json", "disk_image"))
-        # - stats/usage/init_sd_card/ dir
-        self._providers.extend(glob_usage_providers(
-            os.path.join(usage_dir, "init_sd_card"), "*.json", "init_sd_card"))
-        # - docker/ps
-        self._providers.append(DockerPSProvider(FREQUENCY.EVERY_MINUTE))
-        # - docker/images
-        self._providers.append(DockerImagesProvider(FREQUENCY.EVERY_MINUTE))
-        # - uptime
-        self._providers.append(UptimeProvider(FREQUENCY.EVERY_30_MINUTES))
-        # - network/configuration
-        self._providers.append(NetworkConfigurationProvider(FREQUENCY.EVERY_1_HOUR))
-        # - ros/graph
-        self._providers.append(ROSGraphProvider(FREQUENCY.EVERY_30_MINUTES))
-        # - health
-        self._providers.append(HealthProvider(FREQUENCY.EVERY_30_MINUTES))
-        # - network/public_ip
-        self._providers.append(PublicIPProvider(FREQUENCY.ONESHOT))
-        # - geolocation
-        self._providers.append(GeolocationProvider(FREQUENCY.ONESHOT))
-        # - battery/history
-        self._providers.append(BatteryHistoryProvider(FREQUENCY.EVERY_2_HOURS))
-        # - battery/info
-        self._providers.append(BatteryInfoProvider(FREQUENCY.ONESHOT))
-        # - lsusb
-        self._providers.append(LSUSBProvider(FREQUENCY.EVERY_2_HOURS))
-        # - wireless/status
-        self._providers.append(WirelessStatusProvider(FREQUENCY.EVERY_30_MINUTES))
-        # - robot/hostname
-        self._providers.append(RobotHostnameProvider())
-        # - robot/type
-        self._providers.append(RobotTypeProvider())
-        # - robot/configuration
-        self._providers.append(RobotConfigurationProvider())
+        self._outbox = uploader if uploader is not None else StatisticsUploader()
+        self._device_id: Optional[str] = None
+        self._tasks: List[ScheduledTask] = []
+        self._stopped = Event()
+        # providers step concurrently, each one has a deadline and is quarantined if it keeps failing
+        self._pool = ThreadPoolExecutor(max_workers=STATS_PROVIDERS_WORKERS)
+        self._running: Dict[StatisticsProvider, Future] = {}
+        self._expired: Set[Future] = set()
+        self._health: Dict[StatisticsProvider, RetryPolicy] = {}
+        self._lock = Semaphore(1)
+        # payloads identical to the last one sent by the same provider are suppressed
+        self._fingerprints = FingerprintStore(boot_id=self._outbox.boot_id)
+        # periodic providers whose payload does not change are stepped less often (adaptive scheduling)
+        self._adaptive: bool = STATS_SCHEDULING == "adaptive"
+        self._cadence: Dict[StatisticsProvider, AdaptivePeriod] = {}
+        self._periodic: Dict[StatisticsProvider, ScheduledTask] = {}
+        # files in these directories (found at startup or dropped later) are turned into providers
+        # a window at a time, a provider leaves the window once its point is uploaded
+        self._watcher = StatisticsFilesWatcher(self._on_new_file)
+        self._backlog: Deque[Tuple[str, str]] = deque()
+        # providers of files that give more than one (e.g., spool segments) that did not fit in the window
+        self._waiting: Deque[StatisticsProvider] = deque()
+        self._files_admitted: int = 0
+        self._outbox.add_flush_callback(self._admit_files)
+        self._outbox.add_upload_callback(self._on_uploaded)
+        self._files_factories: Dict[str, Callable[[str], List[StatisticsProvider]]] = {
+            events_dir: lambda f: [GenericFileEventProvider(f)],
+            os.path.join(usage_dir, "disk_image"): lambda f: [GenericFileUsageProvider("disk_image", f)],
+            os.path.join(usage_dir, "init_sd_card"): lambda f: [GenericFileUsageProvider("init_sd_card", f)],
+            # a sealed segment of the events spool gives one provider per record
+            STATS_SPOOL_DIR: SpoolEventProvider.from_segment,
+        }
+        self._files_patterns: Dict[str, str] = {
+            STATS_SPOOL_DIR: "*" + spool.SEALED_SUFFIX
+        }
         # launch outbox
         self._outbox.start()
 
+    def _register_providers(self):
+        app = DTProcess.get_instance()
+        # providers (and their dependencies) are only loaded now, off the startup path
+        for spec in PROVIDERS:
+            try:
+                self._providers.append(spec.create())
+            except Exception as e:
+                app.logger.warning(f"Could not create the provider '{spec.key}', reason: {str(e)}")
+
     def is_shutdown(self) -> bool:
         return self._shutdown
 
     def shutdown(self):
         self._outbox.shutdown()
+        self._watcher.shutdown()
         self._shutdown = True
+        for task in self._tasks:
+            task.cancel()
+        # wake up the worker
+        self._stopped.set()
+
+    def _on_new_file(self, directory: str, filepath: str):
+        if directory not in self._files_factories:
+            return
+        with self._lock:
+            self._backlog.append((directory, filepath))
+        self._admit_files()
+
+    def _admit_files(self):
+        if self.is_shutdown() or self._device_id is None:
+            return
+        admitted = []
+        with self._lock:
+            # points of file providers that are waiting in the outbox still count against the window
+            in_flight = self._files_admitted + self._outbox.provider_backed
+            while (self._waiting or self._backlog) and in_flight < STATS_FILES_WINDOW:
+                if not self._waiting:
+                    directory, filepath = self._backlog.popleft()
+                    try:
+                        self._waiting.extend(self._files_factories[directory](filepath))
+                    except (OSError, ValueError) as e:
+                        DTProcess.get_instance().logger.warning(
+                            f"Could not read the statistics file '{filepath}', reason: {str(e)}")
+                    continue
+                admitted.append(self._waiting.popleft())
+                in_flight += 1
+            self._files_admitted += len(admitted)
+        for provider in admitted:
+            if not provider.ready:
+                # the file is already gone
+                self._release_file(provider)
+                continue
+            self._providers.append(provider)
+            # one-shot providers are stepped right away, their data goes straight to the outbox
+            self._schedule(provider)
+
+    def _release_file(self, provider: StatisticsProvider):
+        with self._lock:
+            self._files_admitted -= 1
+        if provider in self._providers:
+            self._providers.remove(provider)
+            self._health.pop(provider, None)
+        self._admit_files()
+
+    def _schedule(self, provider: StatisticsProvider):
+        def _dispatch():
+            self._dispatch(provider)
+
+        self._health[provider] = RetryPolicy(
+            initial_delay=STATS_PROVIDER_QUARANTINE_SECS,
+            max_delay=STATS_PROVIDER_MAX_QUARANTINE_SECS,
+            threshold=STATS_PROVIDER_MAX_FAILURES
+        )
+        # providers can also ask to be stepped outside of their schedule
+        provider.set_trigger(_dispatch)
+        scheduler = get_scheduler()
+        if provider.one_shot:
+            # one-shot tasks are not tracked, they do nothing once we are shut down
+            scheduler.call_later(0, _dispatch)
+        else:
+            period = provider.period
+            if self._adaptive:
+                cadence = self._cadence[provider] = AdaptivePeriod.for_provider(provider)
+                period = cadence.period
+            self._periodic[provider] = scheduler.call_every(period, _dispatch)
+            self._tasks.append(self._periodic[provider])
+            PROVIDER_PERIOD.set(type(provider).__name__, value=period)
+
+    def _dispatch(self, provider: StatisticsProvider):
+        app = DTProcess.get_instance()
+        if self.is_shutdown() or not provider.ready:
+            return
+        with self._lock:
+            # a provider that is still busy with its previous step is not stepped again
+            if provider in self._running:
+                app.logger.debug(f"Provider '{provider.key}' is still busy, skipping this step.")
+                return
+            # removed providers and quarantined providers (until their backoff expires) are left alone
+            health = self._health.get(provider, None)
+            if health is None or not health.allow():
+                return
+            future = self._pool.submit(self._step, provider)
+            self._running[provider] = future
+        future.add_done_callback(lambda f: self._on_done(provider, f))
+        # enforce the deadline
+        get_scheduler().call_later(provider.timeout, lambda: self._on_deadline(provider, future))
+
+    def _step(self, provider: StatisticsProvider) -> Optional[StatisticsPoint]:
+        # get timestamp and payload
+        recorder = get_recorder()
+        start = time.monotonic()
+        try:
+            with provider.profile("step"):
+                stamp, payload = provider.data
+        except Exception as e:
+            recorder.record(provider, time.monotonic() - start, error=str(e))
+            raise
+        finally:
+            PROVIDER_STEP_SECONDS.observe(type(provider).__name__, value=time.monotonic() - start)
+        recorder.record(provider, time.monotonic() - start, stamp, payload)
+        if stamp is None or (payload is None and not provider.lazy):
+            return None
+        # format payload (lazy providers format theirs when it is loaded)
+        if payload is not None:
+            with provider.profile("format"):
+                payload = provider.format(payload)
+        # pack data into a point
+        return StatisticsPoint(
+            category=StatisticsCategory(provider.category),
+            key=provider.point_key(payload),
+            device=self._device_id,
+            stamp=stamp,
+            payload=payload,
+            provider=provider
+        )
+
+    def _on_done(self, provider: StatisticsProvider, future: Future):
+        app = DTProcess.get_instance()
+        with self._lock:
+            self._running.pop(provider, None)
+            expired = future in self._expired
+            self._expired.discard(future)
+        # results that arrive after the deadline are discarded, the failure was already counted
+        if expired or future.cancelled():
+            return
+        exception = future.exception()
+        if exception is not None:
+            self._failure(provider, f"failed with error: {str(exception)}")
+            return
+        self._health[provider].success()
+        PROVIDER_LAST_SUCCESS.set(type(provider).__name__, value=time.time())
+        point = future.result()
+        if point is None and isinstance(provider, FileStatsProvider) and not provider.ready:
+            # invalid files are left where they are, they only make room for the next ones
+            self._release_file(provider)
+            return
+        if point is None:
+            # one-shot providers are tried again until they give us something
+            if provider.one_shot:
+                self._retry_later(provider, STATS_ONESHOT_RETRY_SECS)
+            return
+        # remove exhausted providers
+        if provider.one_shot and provider in self._providers:
+            self._providers.remove(provider)
+            self._health.pop(provider, None)
+        # the schedule of periodic providers follows how often their payload changes
+        self._adapt(provider, point)
+        # nothing changed since the last point we sent
+        if provider.deduplicate and not self._fingerprints.should_send(provider, point.payload, self._outbox):
+            app.logger.debug(f"Provider '{provider.key}' reported no changes, skipping.")
+            return
+        # add point to outbox
+        self._outbox.add(point)
+        if provider.deduplicate and point.seq is not None:
+            self._fingerprints.queue(point)
+        # from now on the point counts against the window from the outbox
+        if isinstance(provider, FileStatsProvider):
+            self._release_file(provider)
+
+    def _on_uploaded(self, points: List[StatisticsPoint]):
+        # payloads count as sent only once the server has them
+        self._fingerprints.commit(points)
+
+    def _adapt(self, provider: StatisticsProvider, point: StatisticsPoint):
+        cadence = self._cadence.get(provider, None)
+        if cadence is None or not cadence.update(fingerprint(point.payload, provider.ignore_fields)):
+            return
+        # the next step is due one (new) period from now
+        with self._lock:
+            task = self._periodic.pop(provider, None)
+            if task is None or self.is_shutdown():
+                return
+            task.cancel()
+            self._tasks.remove(task)
+            self._periodic[provider] = get_scheduler().call_every(cadence.period, provider.trigger,
+                                                                  delay=cadence.period)
+            self._tasks.append(self._periodic[provider])
+        PROVIDER_PERIOD.set(type(provider).__name__, value=cadence.period)
+        DTProcess.get_instance().logger.debug(
+            f"Provider '{provider.key}' is now stepped every {int(cadence.period)} seconds.")
+
+    def _on_deadline(self, provider: StatisticsProvider, future: Future):
+        if future.done():
+            return
+        # threads cannot be killed, if the step already started we let it finish (the provider
+        # is considered busy until then) but we discard its result
+        with self._lock:
+            self._expired.add(future)
+        future.cancel()
+        self._failure(provider, f"did not complete within {provider.timeout} seconds")
+
+    def _failure(self, provider: StatisticsProvider, reason: str):
+        app = DTProcess.get_instance()
+        PROVIDER_FAILURES.inc(type(provider).__name__)
+        health = self._health[provider]
+        health.failure()
+        if health.failures == STATS_PROVIDER_MAX_FAILURES:
+            app.logger.warning(f"Provider '{provider.key}' {reason}. "
+                               f"Quarantined for {int(health.delay)} seconds.")
+        else:
+            app.logger.debug(f"Provider '{provider.key}' {reason}.")
+        # one-shot providers get another chance once their quarantine expires
+        if provider.one_shot:
+            self._retry_later(provider, max(health.delay, STATS_ONESHOT_RETRY_SECS))
+
+    @staticmethod
+    def _maintain_spool():
+        try:
+            spool.maintain(STATS_SPOOL_DIR)
+        except OSError as e:
+            DTProcess.get_instance().logger.warning(f"Could not maintain the events spool, reason: {str(e)}")
+
+    def _retry_later(self, provider: StatisticsProvider, delay: float):
+        get_scheduler().call_later(delay, lambda: self._dispatch(provider))
+
+    @staticmethod
+    def _read_device_id() -> str:
+        return get_device_facts().device_id
 
     def run(self):
         app = DTProcess.get_instance()
         # (try to) read the device ID
         try:
-            device_id = get_device_id()
+            self._device_id = self._read_device_id()
         except ValueError:
             # no device ID? nothing to do
             app.logger.warning("Could not find the device's unique ID. Cannot share stats.")
             return
-        # this process gets data from a bunch of stats providers and places them in the outbox
-        while not app.is_shutdown():
-            # don't do this constantly
-            if not self._timer.is_time():
-                time.sleep(1)
-                continue
-            # temporary structures
-            to_remove = []
-            # go through the providers
-            for provider in self._providers:
-                if provider.istime:
-                    # get timestamp and payload
-                    stamp, payload = provider.data
-                    if stamp is None or payload is None:
-                        continue
-                    # format payload
-                    payload = provider.format(payload)
-                    # pack data into a point
-                    point = StatisticsPoint(
-                        category=StatisticsCategory(provider.category),
-                        key=provider.key,
-                        device=device_id,
-                        stamp=stamp,
-                        payload=payload,
-                        provider=provider
-                    )
-                    # add point to outbox
-                    self._outbox.add(point)
-                    # remove exhausted providers
-                    if provider.one_shot:
-                        to_remove.append(provider)
-            # remove providers
-            self._providers = list(filter(lambda p: p not in to_remove, self._providers))
+        # record what the providers give us (opt-in)
+        get_recorder().start(self._device_id)
+        # register providers
+        self._register_providers()
+        # let the scheduler tell us when each provider is due, providers put their data in the outbox
+        for provider in self._providers:
+            self._schedule(provider)
+        # the first scan of the watcher reports the files that are already there, new ones follow
+        for directory in self._files_factories:
+            self._watcher.watch(directory, pattern=self._files_patterns.get(directory, None))
+        self._watcher.start()
+        # seal idle segments of the events spool and enforce its retention policy
+        self._tasks.append(get_scheduler().call_every(
+            STATS_SPOOL_SEGMENT_SECS, lambda: self._pool.submit(self._maintain_spool)))
+        # ---
+        self._stopped.wait()
+        self._pool.shutdown(wait=False)
+        get_recorder().close()
 
 
 class StatisticsUploader(Thread):
 
-    def __init__(self):
+    def __init__(self, outbox_file: str = STATS_OUTBOX_FILE, period: float = STATS_PUBLISHER_PERIOD_SECS):
         super(StatisticsUploader, self).__init__()
         self._shutdown = False
-        self._queue: List[StatisticsPoint] = []
+        self._outbox_file = outbox_file
+        self._outbox_instance: Optional[StatisticsOutbox] = None
+        self._outbox_lock = Semaphore(1)
+        self._period = period
+        # batch mode is turned off for good the first time the server tells us it does not support it
+        self._batch_supported: bool = STATS_UPLOAD_BATCH_SIZE > 1
+        self._retry = RetryPolicy()
+        # number of times the server rejected each point (by sequence number)
+        self._rejections: Dict[int, int] = {}
+        self._encoder = BodyEncoder()
+        # the uploader sleeps until the scheduler (or a shutdown) wakes it up
+        self._wakeup = Event()
+        self._tasks: List[ScheduledTask] = []
+        self._retry_task: Optional[ScheduledTask] = None
+        self._connectivity_task: Optional[ScheduledTask] = None
+        self._flush_callbacks: List[Callable[[], None]] = []
+        self._upload_callbacks: List[Callable[[List[StatisticsPoint]], None]] = []
         # read boot ID
         with open(STATS_BOOT_ID_FILE, 'rt') as fin:
             self._boot_id = fin.read().strip()
-        # create resource lock for the queue
-        self._lock = Semaphore(1)
+        # metrics
+        _metrics.gauge("dt_online_outbox_points", "Points waiting to be uploaded.",
+                       function=lambda: len(self._outbox))
+        _metrics.gauge("dt_online_outbox_bytes", "Size of the points waiting to be uploaded.",
+                       function=lambda: self._outbox.size)
+
+    @property
+    def _outbox(self) -> StatisticsOutbox:
+        # opened on first use (rebuilding its index reads the whole database), by the uploader thread
+        # or by the first point that comes in, whichever comes first
+        with self._outbox_lock:
+            if self._outbox_instance is None:
+                self._outbox_instance = StatisticsOutbox(self._outbox_file)
+            return self._outbox_instance
 
     def add(self, point: StatisticsPoint):
-        with self._lock:
-            self._queue.append(point)
+        self._outbox.add(point)
+
+    def add_flush_callback(self, callback: Callable[[], None]):
+        # called every time uploaded points leave the outbox
+        self._flush_callbacks.append(callback)
+
+    def add_upload_callback(self, callback: Callable[[List[StatisticsPoint]], None]):
+        # called with the points the server accepted, every time some are
+        self._upload_callbacks.append(callback)
+
+    @property
+    def boot_id(self) -> str:
+        return self._boot_id
+
+    def __contains__(self, seq: int) -> bool:
+        return seq in self._outbox
+
+    @property
+    def provider_backed(self) -> int:
+        return self._outbox.provider_backed
+
+    def __len__(self) -> int:
+        return len(self._outbox)
 
     def is_shutdown(self) -> bool:
         return self._shutdown
 
     def shutdown(self):
         self._shutdown = True
+        self._wakeup.set()
 
-    def run(self):
+    @staticmethod
+    def _check_server(res):
+        # server-side errors (and rate limiting) mean the server is not able to take our data right now
+        if res.status_code >= 500 or res.status_code == 429:
+            raise HTTPError(f"The statistics server responded with status {res.status_code}", response=res)
+
+    @staticmethod
+    def _status(code: int) -> str:
+        return "409" if code == 409 else f"{code // 100}xx"
+
+    def _post(self, url: str, content: Any, token: str, mode: str) -> requests.Response:
+        # serialization includes compression
+        with get_profiler().measure("uploader", "serialize"):
+            body = self._encoder.encode(content)
+        UPLOAD_RAW_BYTES.inc(amount=body.raw_size)
+        res = self._send(url, body, token, mode)
+        if "Content-Encoding" in body.headers and self._rejects_encoding(res):
+            # the server might not decode compressed bodies (415, or 400 and rejections from servers
+            # that ignore the header), the same body goes again uncompressed
+            plain = self._send(url, self._encoder.plain(body), token, mode)
+            if res.status_code == 415 or not self._rejects_encoding(plain):
+                DTProcess.get_instance().logger.info(
+                    f"The statistics server does not accept '{self._encoder.codec}' bodies. "
+                    f"Uploads will not be compressed.")
+                self._encoder.disable()
+            res = plain
+        self._check_server(res)
+        return res
+
+    def _send(self, url: str, body: EncodedBody, token: str, mode: str) -> requests.Response:
+        headers = {"X-Duckietown-Token": token, **body.headers}
+        data = ThrottledBody(body.data, Priority.STATISTICS)
+        start = time.monotonic()
+        try:
+            with get_profiler().measure("uploader", "upload"):
+                res = get_session().post(url, data=data, headers=headers)
+        except RequestException:
+            UPLOAD_REQUESTS.inc("error")
+            raise
+        UPLOAD_SECONDS.observe(mode, value=time.monotonic() - start)
+        UPLOAD_REQUESTS.inc(self._status(res.status_code))
+        UPLOAD_BYTES.inc(amount=body.size)
+        return res
+
+    @staticmethod
+    def _rejects_encoding(res: requests.Response) -> bool:
+        if res.status_code in [400, 415]:
+            return True
+        if res.status_code != 200:
+            return False
+        try:
+            outcome = res.json()
+        except ValueError:
+            return False
+        # the body as a whole was turned down (duplicates are not), maybe because it could not be decoded
+        return isinstance(outcome, dict) and outcome.get("success", None) is False \
+            and outcome.get("code", 0) != 409
+
+    @staticmethod
+    def _is_done(res: dict) -> bool:
+        # a point is done when it was accepted or when the server already has it (409)
+        if res.get("code", 0) == 409:
+            UPLOAD_POINTS.inc("duplicate")
+            return True
+        success = bool(res.get("success", False))
+        UPLOAD_POINTS.inc("accepted" if success else "rejected")
+        return success
+
+    def _upload_point(self, point: StatisticsPoint, payload: dict, token: str) -> bool:
+        url = STATS_API_URL.format(
+            category=point.category.value,
+            key=point.key,
+            device=point.device,
+            boot_id=self._boot_id,
+            # the server is expecting milliseconds, we worked with seconds float so far
+            stamp=int(point.stamp * 1000)
+        )
+        res = self._post(url, payload, token, "point")
+        if not 200 <= res.status_code < 300:
+            # the server does not want this point (e.g., it is malformed or too large), server-side errors
+            # never get here
+            UPLOAD_POINTS.inc("rejected")
+            return False
+        res = res.json()
+        if not isinstance(res, dict):
+            raise ValueError("The statistics server gave an invalid response to a point")
+        return self._is_done(res)
+
+    def _upload_batch(self, points: List[StatisticsPoint], payloads: List[dict], token: str) \
+            -> Optional[List[bool]]:
+        url = STATS_API_BATCH_URL.format(boot_id=self._boot_id)
+        body = [
+            {
+                "category": point.category.value,
+                "key": point.key,
+                "device": point.device,
+                # the server is expecting milliseconds, we worked with seconds float so far
+                "stamp": int(point.stamp * 1000),
+                "payload": payload
+            } for point, payload in zip(points, payloads)
+        ]
+        res = self._post(url, body, token, "batch")
+        if res.status_code in [404, 405, 501]:
+            # the server does not know about batches, fallback to single-point uploads
+            return None
+        if res.status_code != 200:
+            raise ValueError(f"The statistics server refused a batch of {len(points)} points "
+                             f"with status {res.status_code}")
+        res = res.json()
+        # the server reports one outcome per point, in the same order they were sent
+        outcomes = res.get("data", None) if isinstance(res, dict) and res.get("success", False) else None
+        if not isinstance(outcomes, list) or len(outcomes) != len(points):
+            raise ValueError(f"The statistics server gave an invalid response to a batch of "
+                             f"{len(points)} points")
+        return [self._is_done(outcome) for outcome in outcomes]
+
+    @staticmethod
+    def _batches(loaded: List[Tuple[StatisticsPoint, dict]]) -> List[List[Tuple[StatisticsPoint, dict]]]:
+        # consecutive points, up to STATS_UPLOAD_BATCH_SIZE of them and STATS_UPLOAD_BATCH_BYTES of payload
+        batches = []
+        batch, size = [], 0
+        for point, payload in loaded:
+            point_size = len(json.dumps(payload))
+            full = len(batch) >= STATS_UPLOAD_BATCH_SIZE or size + point_size > STATS_UPLOAD_BATCH_BYTES
+            if batch and full:
+                batches.append(batch)
+                batch, size = [], 0
+            batch.append((point, payload))
+            size += point_size
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def _upload(self, queue: List[StatisticsPoint], token: str) -> List[StatisticsPoint]:
+        app = DTProcess.get_instance()
+        done = []
+        uploaded = []
+        rejected = []
+        # load the payloads (lazy points only now read their data back)
+        loaded = []
+        for point in queue:
+            try:
+                loaded.append((point, point.get_payload()))
+            except (OSError, ValueError) as e:
+                # the data is gone, there is nothing left to upload for this point
+                app.logger.warning(f"Dropping statistics point '{point.key}', reason: {str(e)}")
+                done.append(point)
+        # publish in batches
+        batches = []
+        if self._batch_supported:
+            batches, loaded = self._batches(loaded), []
+        while batches:
+            batch = batches.pop(0)
+            if len(batch) == 1:
+                # a batch of one is no better than the point on its own (e.g., a point too big to share one)
+                loaded.extend(batch)
+                continue
+            points, payloads = [p for p, _ in batch], [d for _, d in batch]
+            try:
+                outcomes = self._upload_batch(points, payloads, token)
+            except RequestException:
+                # the server is not reachable, no point in trying with the other points
+                raise
+            except Exception as e:
+                # e.g., the batch is too large, its points go one at a time, the ones the server does not
+                # want are found (and counted) that way
+                app.logger.debug(str(e))
+                loaded.extend(batch)
+                continue
+            if outcomes is None:
+                app.logger.info("The statistics server does not support batch uploads. "
+                                "Falling back to single-point uploads.")
+                self._batch_supported = False
+                loaded.extend(batch)
+                for batch in batches:
+                    loaded.extend(batch)
+                break
+            for point, payload, success in zip(points, payloads, outcomes):
+                if success:
+                    # cleanup provider resource
+                    point.cleanup()
+                    # mark it as DONE
+                    done.append(point)
+                    uploaded.append(point)
+                else:
+                    rejected.append((point, payload))
+        # publish whatever is left one point at a time
+        for point, payload in loaded:
+            try:
+                if self._upload_point(point, payload, token):
+                    # cleanup provider resource
+                    point.cleanup()
+                    # mark it as DONE
+                    done.append(point)
+                    uploaded.append(point)
+                else:
+                    rejected.append((point, payload))
+            except RequestException:
+                # the server is not reachable, no point in trying with the other points
+                raise
+            except Exception as e:
+                app.logger.debug(str(e))
+        if uploaded:
+            for callback in self._upload_callbacks:
+                callback(uploaded)
+        # points the server does not want do not stay in the outbox (and in the files window) forever
+        done.extend(self._reject(rejected))
+        for point in done:
+            self._rejections.pop(point.seq, None)
+        return done
+
+    def _reject(self, rejected: List[Tuple[StatisticsPoint, dict]]) -> List[StatisticsPoint]:
+        # returns the points that were rejected too many times, they are moved to the dead-letter directory
+        dropped = []
+        for point, payload in rejected:
+            self._rejections[point.seq] = self._rejections.get(point.seq, 0) + 1
+            if self._rejections[point.seq] < STATS_UPLOAD_MAX_REJECTIONS:
+                continue
+            DTProcess.get_instance().logger.warning(
+                f"Dropping statistics point '{point.key}', rejected {STATS_UPLOAD_MAX_REJECTIONS} times "
+                f"by the server. A copy is kept in '{STATS_DEAD_LETTER_DIR}'.")
+            UPLOAD_POINTS.inc("dropped")
+            self._dead_letter(point, payload)
+            # this deletes the event file (or acknowledges the spool record) the point came from
+            point.cleanup()
+            dropped.append(point)
+        return dropped
+
+    @staticmethod
+    def _dead_letter(point: StatisticsPoint, payload: dict):
+        # files are named after the time they were written, the oldest ones make room for the new ones
+        try:
+            os.makedirs(STATS_DEAD_LETTER_DIR, exist_ok=True)
+            filename = f"{int(time.time() * 1000):016d}-{point.seq}.json"
+            with open(os.path.join(STATS_DEAD_LETTER_DIR, filename), "wt") as fout:
+                json.dump({
+                    "category": point.category.value,
+                    "key": point.key,
+                    "device": point.device,
+                    "stamp": point.stamp,
+                    "payload": payload
+                }, fout, default=str)
+            for filename in sorted(os.listdir(STATS_DEAD_LETTER_DIR))[:-STATS_DEAD_LETTER_MAX_FILES]:
+                os.remove(os.path.join(STATS_DEAD_LETTER_DIR, filename))
+        except OSError as e:
+            DTProcess.get_instance().logger.debug(f"Could not keep a copy of the rejected point: {str(e)}")
+
+    @staticmethod
+    def _get_token() -> Optional[str]:
         app = DTProcess.get_instance()
         # read the permissions
         granted = permission_granted('allow_push_stats_data')
         if not granted:
             app.logger.warning("Permission 'allow_push_stats_data' not granted. Won't share data.")
-            return
+            return None
         # (try to) read the token
         try:
             token = get_secret('tokens/dt1')
@@ -208,54 +733,92 @@ class StatisticsUploader(Thread):
         except FileNotFoundError:
             # no token? nothing to do
             app.logger.warning('No secret token dt1 found. Cannot share statistics.')
-            return
+            return None
         except dt_authentication.InvalidToken as e:
             # no token? nothing to do
             app.logger.warning(f'{str(e)}. Cannot share statistics.')
+            return None
+        return token
+
+    def run(self):
+        outbox = self._outbox
+        token = self._get_token()
+        if token is None:
             return
         # if we are it means that the user agreed to share their data
-        counter = 0
+        scheduler = get_scheduler()
+        self._tasks.append(scheduler.call_every(self._period, self._wakeup.set))
+        # write pending points to disk if they have been waiting for too long
+        self._tasks.append(scheduler.call_every(
+            STATS_OUTBOX_SYNC_SECS, outbox.sync, delay=STATS_OUTBOX_SYNC_SECS))
         while not self.is_shutdown():
-            if counter % STATS_PUBLISHER_PERIOD_SECS == 0:
-                counter = 1
-                done = []
-                with self._lock:
-                    queue = copy.copy(self._queue)
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if self.is_shutdown():
+                break
+            # skip attempts while the device is offline, resume as soon as it is back
+            if not has_default_route():
+                self._wait_for_connectivity()
+                continue
+            # a retry is already scheduled if the server is backing off
+            if not self._retry.allow():
+                continue
+            self._flush(token)
+        # ---
+        for task in self._tasks + [self._retry_task, self._connectivity_task]:
+            if task is not None:
+                task.cancel()
+        # make sure nothing is lost
+        outbox.close()
+
+    def _wait_for_connectivity(self):
+        app = DTProcess.get_instance()
+
+        def _back_online():
+            app.logger.debug("The device is back online, flushing statistics.")
+            self._connectivity_task = None
+            self._retry.reset()
+            self._wakeup.set()
+
+        if self._connectivity_task is None:
+            self._connectivity_task = wait_for_connectivity(_back_online)
+
+    def _flush(self, token: str):
+        app = DTProcess.get_instance()
+        # make sure everything we have is on disk before we start
+        self._outbox.sync(force=True)
+        # go through the outbox one page at a time
+        cursor = 0
+        raw_bytes, sent_bytes = self._encoder.raw_bytes, self._encoder.sent_bytes
+        try:
+            while not self.is_shutdown():
+                # after an outage, a single point probes the server before we release the whole outbox
+                limit = 1 if self._retry.probing else STATS_OUTBOX_PAGE_SIZE
+                queue = self._outbox.batch(after=cursor, limit=limit)
+                if not queue:
+                    break
+                cursor = queue[-1].seq
                 # publish
-                for point in queue:
-                    # publish
-                    url = STATS_API_URL.format(
-                        category=point.category.value,
-                        key=point.key,
-                        device=point.device,
-                        boot_id=self._boot_id,
-                        # the server is expecting milliseconds, we worked with seconds float so far
-                        stamp=int(point.stamp * 1000)
-                    )
-                    res = requests.post(url, json=point.payload,
-                                        headers={"X-Duckietown-Token": token})
-                    try:
-                        assert res.status_code == 200
-                        res = res.json()
-                        assert 'success' in res
-                        if res['success']:
-                            # cleanup provider resource
-                            point.provider.cleanup()
-                            # mark it as DONE
-                            done.append(point)
-                        else:
-                            if res.get("code", 0) == 409:
-                                # this data point already exists
-                                # cleanup provider resource
-                                point.provider.cleanup()
-                                # mark it as DONE
-                                done.append(point)
-
-                    except (Exception, AssertionError) as e:
-                        app.logger.debug(str(e))
-                # remove correctly uploaded points from queue
-                with self._lock:
-                    self._queue = list(filter(lambda p: p not in done, self._queue))
-            # ---
-            time.sleep(1)
-            counter += 1
+                done = self._upload(queue, token)
+                # remove correctly uploaded points from the outbox
+                self._outbox.ack(done)
+                # there is room for more (the new points are picked up by the next pages)
+                for callback in self._flush_callbacks:
+                    callback()
+                # the server is reachable
+                if self._retry.failures > 0:
+                    app.logger.info("The statistics server is reachable again.")
+                self._retry.success()
+        except RequestException as e:
+            delay = self._retry.failure()
+            self._retry_task = get_scheduler().call_later(delay, self._wakeup.set)
+            log = app.logger.warning if self._retry.failures == 1 else app.logger.debug
+            log(f"Could not reach the statistics server, reason: {str(e)}. "
+                f"Retrying in {int(delay)} seconds.")
+        # compressed vs raw bytes
+        raw_bytes = self._encoder.raw_bytes - raw_bytes
+        sent_bytes = self._encoder.sent_bytes - sent_bytes
+        if raw_bytes > 0:
+            app.logger.debug(f"Statistics flush sent {sent_bytes} bytes "
+                             f"({raw_bytes} bytes before compression, "
+                             f"{100.0 * sent_bytes / raw_bytes:.1f}%).")
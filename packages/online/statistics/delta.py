@@ -0,0 +1,79 @@
+import copy
+import json
+from collections import Counter
+from typing import Any
+
+# A delta describes how to go from one JSON document to the next, section by section, where a
+# section is a top-level key of the document:
+#  - dict sections are diffed by key: {"set": {key: value}, "unset": [key]}
+#  - list sections are diffed as multisets of items: {"add": [item], "remove": [item]}
+#  - any other section is replaced as a whole: {"value": value}
+# Sections that disappear from the document are listed under the "removed" key of the delta.
+
+
+def _canonical(item: Any) -> str:
+    return json.dumps(item, sort_keys=True)
+
+
+def compute_delta(old: dict, new: dict) -> dict:
+    sections = {}
+    for name, value in new.items():
+        previous = old.get(name, None)
+        if previous == value:
+            continue
+        if isinstance(value, dict) and isinstance(previous, dict):
+            changes = {}
+            updated = {k: v for k, v in value.items() if k not in previous or previous[k] != v}
+            if updated:
+                changes["set"] = updated
+            removed = [k for k in previous if k not in value]
+            if removed:
+                changes["unset"] = removed
+            if changes:
+                sections[name] = changes
+        elif isinstance(value, list) and isinstance(previous, list):
+            before = Counter(map(_canonical, previous))
+            after = Counter(map(_canonical, value))
+            changes = {}
+            added = after - before
+            if added:
+                changes["add"] = [json.loads(item) for item in added.elements()]
+            removed = before - after
+            if removed:
+                changes["remove"] = [json.loads(item) for item in removed.elements()]
+            # a list that was only reordered did not change
+            if changes:
+                sections[name] = changes
+        else:
+            sections[name] = {"value": value}
+    delta = {"sections": sections}
+    removed = [name for name in old if name not in new]
+    if removed:
+        delta["removed"] = removed
+    return delta
+
+
+def is_empty(delta: dict) -> bool:
+    return not delta["sections"] and not delta.get("removed", [])
+
+
+def apply_delta(base: dict, delta: dict) -> dict:
+    document = copy.deepcopy(base)
+    for name, changes in delta["sections"].items():
+        if "value" in changes:
+            document[name] = changes["value"]
+            continue
+        if "set" in changes or "unset" in changes:
+            section = document.setdefault(name, {})
+            section.update(changes.get("set", {}))
+            for key in changes.get("unset", []):
+                section.pop(key, None)
+            continue
+        section = Counter(map(_canonical, document.get(name, [])))
+        section.update(map(_canonical, changes.get("add", [])))
+        section.subtract(map(_canonical, changes.get("remove", [])))
+        # the order of the items in a list section is not preserved
+        document[name] = [json.loads(item) for item in sorted(section.elements())]
+    for name in delta.get("removed", []):
+        document.pop(name, None)
+    return document
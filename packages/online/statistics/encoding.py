@@ -0,0 +1,86 @@
+import dataclasses
+import gzip
+import json
+from typing import Any, Dict, Optional
+
+from dt_class_utils import DTProcess
+
+from ..constants import \
+    STATS_UPLOAD_COMPRESSION, \
+    STATS_UPLOAD_COMPRESSION_THRESHOLD, \
+    STATS_UPLOAD_COMPRESSION_LEVEL
+
+# zstd is optional
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULT_GZIP_LEVEL = 6
+DEFAULT_ZSTD_LEVEL = 3
+
+
+@dataclasses.dataclass
+class EncodedBody:
+    data: bytes
+    headers: Dict[str, str]
+    # the body before compression
+    raw: bytes
+
+    @property
+    def raw_size(self) -> int:
+        return len(self.raw)
+
+    @property
+    def size(self) -> int:
+        return len(self.data)
+
+
+class BodyEncoder:
+
+    def __init__(self,
+                 codec: str = STATS_UPLOAD_COMPRESSION,
+                 threshold: int = STATS_UPLOAD_COMPRESSION_THRESHOLD,
+                 level: Optional[int] = STATS_UPLOAD_COMPRESSION_LEVEL):
+        logger = DTProcess.get_instance().logger
+        if codec == "zstd" and zstandard is None:
+            logger.warning("The 'zstandard' package is not installed, using gzip instead of zstd.")
+            codec = "gzip"
+        if codec not in ["gzip", "zstd", "none"]:
+            logger.warning(f"Unknown compression codec '{codec}', uploads will not be compressed.")
+            codec = "none"
+        self._codec = codec
+        self._threshold = threshold
+        self._level = level
+        self._zstd = None
+        if codec == "zstd":
+            self._zstd = zstandard.ZstdCompressor(level=level or DEFAULT_ZSTD_LEVEL)
+        # accounting
+        self.raw_bytes: int = 0
+        self.sent_bytes: int = 0
+
+    @property
+    def codec(self) -> str:
+        return self._codec
+
+    def disable(self):
+        self._codec = "none"
+
+    def encode(self, content: Any) -> EncodedBody:
+        raw = json.dumps(content).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        data = raw
+        if self._codec != "none" and len(raw) >= self._threshold:
+            if self._codec == "zstd":
+                data = self._zstd.compress(raw)
+            else:
+                data = gzip.compress(raw, compresslevel=self._level or DEFAULT_GZIP_LEVEL)
+            headers["Content-Encoding"] = self._codec
+        self.raw_bytes += len(raw)
+        self.sent_bytes += len(data)
+        return EncodedBody(data, headers, raw)
+
+    def plain(self, body: EncodedBody) -> EncodedBody:
+        # the same body, not compressed (e.g., for a server that did not understand it)
+        self.sent_bytes += body.raw_size
+        return EncodedBody(body.raw, {"Content-Type": "application/json"}, body.raw)
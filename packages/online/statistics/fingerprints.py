@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import time
+from threading import Semaphore
+from typing import Any, Container, Dict, Iterable, List, Optional, Tuple
+
+from dt_class_utils import DTProcess
+
+from .point import StatisticsPoint
+from .providers import StatisticsProvider
+from ..constants import STATS_FINGERPRINTS_FILE, STATS_ONESHOT_HEARTBEAT_SECS
+
+
+def _strip(data: Any, ignore: Iterable[Tuple[str, ...]]) -> Any:
+    # removes the fields at the given paths, "*" matches any key at that level
+    if not isinstance(data, dict):
+        return data
+    ignore = list(ignore)
+    out = {}
+    for key, value in data.items():
+        matching = [path for path in ignore if path[0] in ["*", key]]
+        if any(len(path) == 1 for path in matching):
+            continue
+        out[key] = _strip(value, [path[1:] for path in matching])
+    return out
+
+
+def fingerprint(data: Any, ignore: Iterable[Tuple[str, ...]] = ()) -> str:
+    # stable hash of a canonical serialization (sorted keys, no whitespace)
+    canonical = json.dumps(_strip(data, ignore), sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()
+
+
+class FingerprintStore:
+    # Remembers the fingerprint of the last payload uploaded by each provider (and when it was uploaded),
+    # across restarts. The file is only written when something is uploaded. One-shot providers report
+    # once per boot, their entries belong to the boot they were uploaded in.
+
+    def __init__(self, filepath: str = STATS_FINGERPRINTS_FILE, boot_id: Optional[str] = None):
+        self._filepath = filepath
+        self._boot_id = boot_id
+        self._lock = Semaphore(1)
+        self._entries: Dict[str, Tuple[str, float]] = {}
+        # fingerprint and sequence number of the last point queued by each provider, not uploaded yet
+        self._queued: Dict[str, Tuple[str, int]] = {}
+        try:
+            with open(filepath, "rt") as fin:
+                self._entries = {key: (fp, stamp) for key, (fp, stamp) in json.load(fin).items()}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, TypeError) as e:
+            DTProcess.get_instance().logger.warning(
+                f"Could not read the fingerprints file '{filepath}', reason: {str(e)}")
+        # entries of the previous boots are of no use anymore
+        self._entries = {key: entry for key, entry in self._entries.items()
+                         if "@" not in key or key.endswith(f"@{boot_id}")}
+
+    def _key(self, provider: StatisticsProvider) -> str:
+        if provider.one_shot and self._boot_id is not None:
+            return f"{provider.key}@{self._boot_id}"
+        return provider.key
+
+    def should_send(self, provider: StatisticsProvider, payload: Any, queued: Container[int]) -> bool:
+        # returns False for an unchanged payload, unless the heartbeat is due, `queued` holds the sequence
+        # numbers of the points still waiting to be uploaded
+        fp = fingerprint(payload, provider.ignore_fields)
+        key = self._key(provider)
+        with self._lock:
+            # the same payload is already on its way
+            last_fp, seq = self._queued.get(key, (None, None))
+            if fp == last_fp and seq in queued:
+                return False
+            last_fp, last_stamp = self._entries.get(key, (None, 0))
+            if fp == last_fp:
+                every = STATS_ONESHOT_HEARTBEAT_SECS if provider.one_shot \
+                    else provider.heartbeat * provider.period
+                if every <= 0 or time.time() - last_stamp < every:
+                    return False
+        return True
+
+    def queue(self, point: StatisticsPoint):
+        # called once the point is in the outbox
+        provider = point.provider
+        with self._lock:
+            self._queued[self._key(provider)] = (fingerprint(point.payload, provider.ignore_fields), point.seq)
+
+    def commit(self, points: List[StatisticsPoint]):
+        # called with the points the server accepted, only these count as sent
+        now = time.time()
+        changed = False
+        with self._lock:
+            for point in points:
+                provider = point.provider
+                # points replayed from disk are not attached to their provider anymore
+                if provider is None or not provider.deduplicate:
+                    continue
+                key = self._key(provider)
+                self._entries[key] = (fingerprint(point.payload, provider.ignore_fields), now)
+                if self._queued.get(key, (None, None))[1] == point.seq:
+                    del self._queued[key]
+                changed = True
+            if changed:
+                self._write()
+
+    def _write(self):
+        try:
+            os.makedirs(os.path.dirname(self._filepath), exist_ok=True)
+            with open(self._filepath + ".tmp", "wt") as fout:
+                json.dump(self._entries, fout)
+            os.rename(self._filepath + ".tmp", self._filepath)
+        except OSError as e:
+            DTProcess.get_instance().logger.debug(f"Could not write the fingerprints file: {str(e)}")
@@ -0,0 +1,122 @@
+import json
+import re
+from typing import Any, Dict, Iterable, List, Optional, Pattern, TextIO
+
+# Reads some top-level fields of a JSON object (e.g., the type and stamp of a statistics file) without
+# decoding the rest of it. The file is read a chunk at a time until all the fields are found, the values
+# of the other fields are skipped by looking for the characters that delimit them (quotes, escapes,
+# brackets), so memory does not grow with the size of the file.
+
+_STRING = re.compile(r'["\\]')
+_CONTAINER = re.compile(r'["{}\[\]]')
+_SCALAR_END = re.compile(r'[,}\]\s]')
+_WHITESPACE = " \t\r\n"
+
+
+class _Reader:
+
+    def __init__(self, fin: TextIO, chunk_size: int):
+        self._fin = fin
+        self._chunk_size = chunk_size
+        self._buffer = ""
+        self._pos = 0
+        # text of the value being captured, up to the start of the current buffer
+        self._captured: Optional[List[str]] = None
+        self._mark = 0
+
+    def _more(self):
+        # called once the buffer is exhausted, positions past its end carry over to the next one
+        if self._captured is not None:
+            self._captured.append(self._buffer[self._mark:])
+            self._mark = 0
+        self._pos -= len(self._buffer)
+        self._buffer = self._fin.read(self._chunk_size)
+        if not self._buffer:
+            raise ValueError("Unexpected end of file")
+
+    def _search(self, pattern: Pattern) -> str:
+        # moves to the next match of the pattern, returns the matching character
+        while True:
+            while self._pos >= len(self._buffer):
+                self._more()
+            match = pattern.search(self._buffer, self._pos)
+            if match is not None:
+                self._pos = match.start()
+                return match.group()
+            self._pos = len(self._buffer)
+
+    def peek(self) -> str:
+        # next character that is not whitespace, not consumed
+        while True:
+            while self._pos >= len(self._buffer):
+                self._more()
+            char = self._buffer[self._pos]
+            if char not in _WHITESPACE:
+                return char
+            self._pos += 1
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at offset {self._pos} of the current chunk")
+        self._pos += 1
+
+    def _skip_string(self):
+        self._pos += 1
+        while self._search(_STRING) == "\\":
+            # the escaped character is skipped too (the digits of \uXXXX are plain characters)
+            self._pos += 2
+        self._pos += 1
+
+    def _skip_value(self):
+        char = self.peek()
+        if char == '"':
+            self._skip_string()
+            return
+        if char in "{[":
+            depth = 0
+            while True:
+                char = self._search(_CONTAINER)
+                if char == '"':
+                    self._skip_string()
+                    continue
+                depth += 1 if char in "{[" else -1
+                self._pos += 1
+                if depth == 0:
+                    return
+        # numbers, booleans and null end where the next token starts
+        self._search(_SCALAR_END)
+
+    def value(self, decode: bool) -> Any:
+        if not decode:
+            self._skip_value()
+            return None
+        self.peek()
+        self._captured, self._mark = [], self._pos
+        self._skip_value()
+        self._captured.append(self._buffer[self._mark:self._pos])
+        text, self._captured = "".join(self._captured), None
+        return json.loads(text)
+
+
+def read_fields(fin: TextIO, fields: Iterable[str], chunk_size: int = 64 * 1024) -> Dict[str, Any]:
+    # returns the given top-level fields of the JSON object in `fin` (the ones it has), raises ValueError
+    # if `fin` does not contain a JSON object
+    missing = set(fields)
+    found = {}
+    reader = _Reader(fin, chunk_size)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return found
+    while missing:
+        if reader.peek() != '"':
+            raise ValueError("Expected a key")
+        key = reader.value(decode=True)
+        reader.expect(":")
+        value = reader.value(decode=key in missing)
+        if key in missing:
+            found[key] = value
+            missing.discard(key)
+        if reader.peek() == "}":
+            break
+        reader.expect(",")
+    return found
@@ -0,0 +1,314 @@
+import bisect
+import dataclasses
+import itertools
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from threading import Semaphore
+from typing import List, Dict, Optional, Set, Tuple
+
+from dt_class_utils import DTProcess
+
+from .point import StatisticsPoint, StatisticsCategory
+from ..constants import \
+    STATS_OUTBOX_FILE, \
+    STATS_OUTBOX_SYNC_POINTS, \
+    STATS_OUTBOX_SYNC_SECS, \
+    STATS_OUTBOX_VACUUM_PAGES, \
+    STATS_OUTBOX_PAGE_SIZE, \
+    STATS_OUTBOX_MAX_POINTS, \
+    STATS_OUTBOX_MAX_BYTES, \
+    STATS_OUTBOX_COALESCE, \
+    STATS_OUTBOX_CHAINS
+
+
+@dataclasses.dataclass
+class _Entry:
+    key: str
+    size: int
+    # whether the point can be dropped to make room for newer ones
+    evictable: bool
+    # chain (keyframe key, keyframe stamp in milliseconds) the point belongs to, see STATS_OUTBOX_CHAINS
+    chain: Optional[Tuple[str, int]] = None
+
+
+class StatisticsOutbox:
+    # Points coming from providers whose data is already on disk (e.g., event files) are only
+    # indexed in memory, everything else is written to a SQLite database so that it survives
+    # restarts. Writes are grouped into a single transaction (i.e., one fsync) every
+    # STATS_OUTBOX_SYNC_POINTS points or STATS_OUTBOX_SYNC_SECS seconds.
+    # An in-memory index (sequence number -> metadata) makes acknowledgements and evictions O(1)
+    # and keeps track of the size of the outbox.
+
+    def __init__(self, filepath: str = STATS_OUTBOX_FILE):
+        self._lock = Semaphore(1)
+        self._db = self._open(filepath)
+        # points waiting to be written to disk, together with their serialized payload
+        self._pending: Dict[int, Tuple[StatisticsPoint, str]] = OrderedDict()
+        self._last_sync = time.time()
+        # points whose data is persisted by their own provider
+        self._memory: Dict[int, StatisticsPoint] = {}
+        # index of all the points in the outbox, in order
+        self._index: Dict[int, _Entry] = OrderedDict()
+        # sequence numbers in ascending order for paging, the ones removed from the index are skipped and
+        # compacted away once they are the majority
+        self._seqs: List[int] = []
+        self._evictable: Dict[int, None] = OrderedDict()
+        self._by_key: Dict[str, Dict[int, None]] = {}
+        self._chains: Dict[Tuple[str, int], Dict[int, None]] = {}
+        # chains that lost a point before it was uploaded, their next deltas cannot be applied
+        self._broken: Set[Tuple[str, int]] = set()
+        self._bytes = 0
+        # rebuild the index from disk
+        rows = self._db.execute(
+            "SELECT seq, category, key, stamp, LENGTH(payload) FROM points ORDER BY seq").fetchall()
+        deltas = self._read_deltas()
+        for seq, category, key, stamp, size in rows:
+            chain = deltas[seq] if seq in deltas else self._chain(key, stamp, None)
+            self._insert(seq, _Entry(key, size, evictable=category != StatisticsCategory.EVENT.value, chain=chain))
+        # sequence numbers continue from where the previous run left off
+        self._next_seq = (rows[-1][0] + 1) if rows else 1
+        # replay
+        if rows:
+            DTProcess.get_instance().logger.info(f"Replaying {len(rows)} statistics points from disk.")
+
+    @staticmethod
+    def _open(filepath: str) -> sqlite3.Connection:
+        try:
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            db = sqlite3.connect(filepath, check_same_thread=False, isolation_level=None)
+            # this has to be set before the table is created to have any effect
+            db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=FULL")
+        except (OSError, sqlite3.Error) as e:
+            DTProcess.get_instance().logger.warning(
+                f"Could not open the outbox file '{filepath}', reason: {str(e)}. "
+                f"Statistics will not survive a restart.")
+            db = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        db.execute("CREATE TABLE IF NOT EXISTS points ("
+                   "seq INTEGER PRIMARY KEY, "
+                   "category TEXT NOT NULL, "
+                   "key TEXT NOT NULL, "
+                   "device TEXT NOT NULL, "
+                   "stamp REAL NOT NULL, "
+                   "payload TEXT NOT NULL)")
+        return db
+
+    def _read_deltas(self) -> Dict[int, Optional[Tuple[str, int]]]:
+        # only deltas need their payload to know which chain they belong to
+        keys = list(STATS_OUTBOX_CHAINS)
+        if not keys:
+            return {}
+        rows = self._db.execute(
+            f"SELECT seq, key, stamp, payload FROM points WHERE key IN ({','.join('?' * len(keys))})", keys
+        ).fetchall()
+        return {seq: self._chain(key, stamp, json.loads(payload)) for seq, key, stamp, payload in rows}
+
+    @staticmethod
+    def _chain(key: str, stamp: float, payload: Optional[dict]) -> Optional[Tuple[str, int]]:
+        # keyframes start a chain, deltas point to the keyframe of theirs
+        if key in STATS_OUTBOX_CHAINS.values():
+            return key, int(stamp * 1000)
+        if key in STATS_OUTBOX_CHAINS and isinstance(payload, dict) and "keyframe" in payload:
+            return STATS_OUTBOX_CHAINS[key], payload["keyframe"]
+        return None
+
+    def _insert(self, seq: int, entry: _Entry):
+        self._index[seq] = entry
+        # points come in with increasing sequence numbers
+        self._seqs.append(seq)
+        self._by_key.setdefault(entry.key, OrderedDict())[seq] = None
+        if entry.chain is not None:
+            self._chains.setdefault(entry.chain, OrderedDict())[seq] = None
+        if entry.evictable:
+            self._evictable[seq] = None
+        self._bytes += entry.size
+
+    def _remove(self, seq: int) -> bool:
+        entry = self._index.pop(seq, None)
+        if entry is None:
+            return False
+        del self._by_key[entry.key][seq]
+        if entry.chain is not None:
+            members = self._chains[entry.chain]
+            del members[seq]
+            if not members:
+                del self._chains[entry.chain]
+        self._evictable.pop(seq, None)
+        self._bytes -= entry.size
+        if len(self._seqs) > 2 * len(self._index) + STATS_OUTBOX_PAGE_SIZE:
+            self._seqs = [s for s in self._seqs if s in self._index]
+        # points that were never written to disk do not need to be deleted from it
+        if self._memory.pop(seq, None) is not None or self._pending.pop(seq, None) is not None:
+            return False
+        return True
+
+    def add(self, point: StatisticsPoint):
+        persistent = point.provider is not None and point.provider.persistent
+        payload = None if persistent else json.dumps(point.payload)
+        chain = self._chain(point.key, point.stamp, point.payload)
+        with self._lock:
+            if chain is not None and point.key in STATS_OUTBOX_CHAINS and chain in self._broken:
+                # the delta cannot be applied anymore, the provider starts a new chain with a keyframe
+                broken = True
+            else:
+                broken = False
+                self._add(point, payload, persistent, chain)
+        if broken:
+            DTProcess.get_instance().logger.debug(
+                f"Dropping statistics point '{point.key}', the point it builds upon was dropped.")
+            if point.provider is not None:
+                point.provider.resync()
+
+    def _add(self, point: StatisticsPoint, payload: Optional[str], persistent: bool,
+             chain: Optional[Tuple[str, int]]):
+        if chain is not None and point.key not in STATS_OUTBOX_CHAINS:
+            # a new keyframe, older chains are over
+            self._broken = {c for c in self._broken if c[0] != chain[0] or c[1] >= chain[1]}
+        point.seq = self._next_seq
+        self._next_seq += 1
+        entry = _Entry(
+            point.key,
+            point.provider.size if persistent else len(payload),
+            evictable=not persistent and point.category != StatisticsCategory.EVENT,
+            chain=chain
+        )
+        self._insert(point.seq, entry)
+        if persistent:
+            self._memory[point.seq] = point
+        else:
+            self._pending[point.seq] = (point, payload)
+        # make room
+        to_delete = self._coalesce(point.key) + self._enforce_caps()
+        if to_delete:
+            self._delete(to_delete)
+        # write to disk
+        if len(self._pending) >= STATS_OUTBOX_SYNC_POINTS:
+            self._sync()
+
+    def _coalesce(self, key: str) -> List[int]:
+        keep = STATS_OUTBOX_COALESCE.get(key, None)
+        if keep is None:
+            return []
+        # only the newest `keep` points of a snapshot-style key are worth uploading
+        to_delete = []
+        siblings = self._by_key[key]
+        for seq in list(itertools.islice(siblings, max(0, len(siblings) - keep))):
+            if seq in self._evictable:
+                to_delete.extend(self._evict(seq))
+        return to_delete
+
+    def _enforce_caps(self) -> List[int]:
+        to_delete = []
+        while self._evictable and \
+                (len(self._index) > STATS_OUTBOX_MAX_POINTS or self._bytes > STATS_OUTBOX_MAX_BYTES):
+            seq = next(iter(self._evictable))
+            to_delete.extend(self._evict(seq))
+        return to_delete
+
+    def _evict(self, seq: int) -> List[int]:
+        # drops a point that was not uploaded, returns the sequence numbers to delete from disk
+        chain = self._index[seq].chain
+        to_delete = [seq] if self._remove(seq) else []
+        if chain is not None:
+            # the deltas that come after it cannot be applied anymore, neither can the ones still to come
+            self._broken.add(chain)
+            for other in [s for s in self._chains.get(chain, {}) if s > seq]:
+                if self._remove(other):
+                    to_delete.append(other)
+        return to_delete
+
+    def _delete(self, seqs: List[int]):
+        self._db.execute("BEGIN")
+        self._db.executemany("DELETE FROM points WHERE seq = ?", [(seq,) for seq in seqs])
+        self._db.execute("COMMIT")
+        # compact the file once enough space was freed
+        free, = self._db.execute("PRAGMA freelist_count").fetchone()
+        if free >= STATS_OUTBOX_VACUUM_PAGES:
+            self._db.execute("PRAGMA incremental_vacuum")
+
+    def sync(self, force: bool = False):
+        with self._lock:
+            if not self._pending:
+                return
+            if not force and time.time() - self._last_sync < STATS_OUTBOX_SYNC_SECS:
+                return
+            self._sync()
+
+    def _sync(self):
+        rows = [
+            (p.seq, p.category.value, p.key, p.device, p.stamp, payload)
+            for p, payload in self._pending.values()
+        ]
+        self._db.execute("BEGIN")
+        self._db.executemany("INSERT INTO points VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self._db.execute("COMMIT")
+        self._pending = OrderedDict()
+        self._last_sync = time.time()
+
+    def batch(self, after: int, limit: int) -> List[StatisticsPoint]:
+        with self._lock:
+            seqs = []
+            i = bisect.bisect_right(self._seqs, after)
+            while i < len(self._seqs) and len(seqs) < limit:
+                if self._seqs[i] in self._index:
+                    seqs.append(self._seqs[i])
+                i += 1
+            points: Dict[int, StatisticsPoint] = {}
+            stored = []
+            for seq in seqs:
+                if seq in self._memory:
+                    points[seq] = self._memory[seq]
+                elif seq in self._pending:
+                    points[seq] = self._pending[seq][0]
+                else:
+                    stored.append(seq)
+            # fetch the payload of the stored points
+            for i in range(0, len(stored), 500):
+                chunk = stored[i:i + 500]
+                rows = self._db.execute(
+                    "SELECT seq, category, key, device, stamp, payload FROM points "
+                    f"WHERE seq IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                for seq, category, key, device, stamp, payload in rows:
+                    points[seq] = StatisticsPoint(
+                        category=StatisticsCategory(category),
+                        key=key,
+                        device=device,
+                        stamp=stamp,
+                        payload=json.loads(payload),
+                        seq=seq
+                    )
+        return [points[seq] for seq in seqs if seq in points]
+
+    def ack(self, points: List[StatisticsPoint]):
+        if not points:
+            return
+        with self._lock:
+            to_delete = [point.seq for point in points if self._remove(point.seq)]
+            if to_delete:
+                self._delete(to_delete)
+
+    def close(self):
+        self.sync(force=True)
+        with self._lock:
+            self._db.close()
+
+    @property
+    def size(self) -> int:
+        return self._bytes
+
+    @property
+    def provider_backed(self) -> int:
+        # number of points whose data is kept by their providers (e.g., files)
+        return len(self._memory)
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, seq: int) -> bool:
+        # whether the point is still waiting to be uploaded
+        return seq in self._index
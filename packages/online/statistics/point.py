@@ -0,0 +1,48 @@
+import json
+import dataclasses
+from enum import Enum
+from typing import Optional
+
+from .providers import StatisticsProvider
+
+
+class StatisticsCategory(Enum):
+    EVENT = "event"
+    USAGE = "usage"
+    CONFIGURATION = "configuration"
+
+
+@dataclasses.dataclass
+class StatisticsPoint:
+    category: StatisticsCategory
+    key: str
+    device: str
+    stamp: float
+    # lazy providers leave this empty, see `get_payload()`
+    payload: Optional[dict]
+    # points replayed from disk are not attached to a provider anymore
+    provider: Optional[StatisticsProvider] = None
+    # position of the point in the outbox, assigned by the outbox itself
+    seq: Optional[int] = None
+
+    def get_payload(self) -> dict:
+        if self.payload is None and self.provider is not None and self.provider.lazy:
+            # the payload is not kept in memory, it is loaded only for as long as it takes to upload it
+            with self.provider.profile("load"):
+                content = self.provider.load()
+            with self.provider.profile("format"):
+                return self.provider.format(content)
+        return self.payload
+
+    def cleanup(self):
+        if self.provider is not None:
+            self.provider.cleanup()
+
+    def __str__(self):
+        return json.dumps({
+            "category": self.category.value,
+            "key": self.key,
+            "device": self.device,
+            "stamp": self.stamp,
+            "payload": self.payload
+        })
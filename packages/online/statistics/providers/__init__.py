@@ -1,9 +1,11 @@
 import abc
 import json
 import os
-from typing import Optional, Tuple
+from typing import Optional, Tuple, Callable, List, ContextManager
 
-from dt_class_utils import DTReminder
+from online.constants import STATS_PROVIDER_TIMEOUT_SECS, STATS_HEARTBEAT_EVERY
+from online.profiling import get_profiler
+from online.statistics.header import read_fields
 
 
 class StatisticsProvider(abc.ABC):
@@ -12,8 +14,7 @@ class StatisticsProvider(abc.ABC):
         self._category = category
         self._key = key
         self._frequency = frequency or 0
-        self._ever_run = False
-        self._reminder = None if self.one_shot else DTReminder(frequency=self._frequency)
+        self._trigger: Optional[Callable[[], None]] = None
 
     @property
     def category(self) -> str:
@@ -27,21 +28,80 @@ class StatisticsProvider(abc.ABC):
     def data(self) -> Tuple[Optional[float], Optional[dict]]:
         return self.step()
 
+    def point_key(self, payload: Optional[dict]) -> str:
+        # key of the point made of the payload of the last step, providers that produce more than one
+        # kind of point tell them apart here
+        return self.key
+
     @property
     def one_shot(self) -> bool:
         return self._frequency <= 0
 
     @property
-    def istime(self) -> bool:
-        if not self._ever_run:
-            self._ever_run = True
-            return True
-        return self._reminder.is_time() if self._reminder else True
+    def period(self) -> float:
+        # seconds between two consecutive steps, 0 for one-shot providers
+        return 0 if self.one_shot else 1.0 / self._frequency
+
+    @property
+    def timeout(self) -> float:
+        # deadline for a single step, providers that are known to be slow can extend it
+        return STATS_PROVIDER_TIMEOUT_SECS
+
+    @property
+    def persistent(self) -> bool:
+        # whether the data of this provider survives a restart without the help of the outbox
+        return False
+
+    @property
+    def lazy(self) -> bool:
+        # lazy providers step without a payload, it is loaded (see `load()`) only when needed
+        return False
+
+    @property
+    def size(self) -> int:
+        # size of the data kept by persistent providers
+        return 0
+
+    @property
+    def deduplicate(self) -> bool:
+        # whether a payload identical to the last one sent should be suppressed
+        return False
+
+    @property
+    def ignore_fields(self) -> List[Tuple[str, ...]]:
+        # paths of the fields that do not count as a change (e.g., timestamps), "*" matches any key
+        return []
+
+    @property
+    def heartbeat(self) -> int:
+        # an unchanged payload is sent anyway every N intervals, 0 to never send it again
+        return STATS_HEARTBEAT_EVERY
+
+    @property
+    def ready(self) -> bool:
+        # when to step is decided by the scheduler, providers can opt out if they have nothing to give
+        return True
 
     @abc.abstractmethod
     def step(self) -> Tuple[Optional[float], Optional[dict]]:
         pass
 
+    def set_trigger(self, trigger: Callable[[], None]):
+        self._trigger = trigger
+
+    def trigger(self):
+        # providers that learn about changes on their own can ask to be stepped right away
+        if self._trigger is not None:
+            self._trigger()
+
+    def resync(self):
+        # called when a point this provider builds upon (e.g., a keyframe) was dropped before being uploaded
+        pass
+
+    def profile(self, phase: str) -> ContextManager[None]:
+        # instrumentation hook around the work done for this provider, a no-op unless profiling is enabled
+        return get_profiler().measure(type(self).__name__, phase)
+
     def cleanup(self):
         pass
 
@@ -76,29 +136,93 @@ class ConfigurationStatsProvider(StatisticsProvider):
     def __init__(self, key: str):
         super(ConfigurationStatsProvider, self).__init__("configuration", key, 0)
 
+    @property
+    def deduplicate(self) -> bool:
+        # configurations rarely change, they are sent again only when they do
+        return True
+
     @abc.abstractmethod
     def step(self) -> Tuple[Optional[float], Optional[dict]]:
         pass
 
 
 class FileStatsProvider(StatisticsProvider):
+    # Only the path, the size and a small header (key and stamp) of the file are kept in memory, the
+    # header is read without decoding the body, which is read when the point is serialized for upload
+    # (see `load()`).
 
     def __init__(self, category: str, key: Optional[str], filepath: str):
         super(FileStatsProvider, self).__init__(category, key, 0)
         self._filepath = os.path.abspath(filepath)
-        self._content = None
+        self._stamp: Optional[float] = None
+        # None means that we did not look at the content of the file yet
+        self._valid: Optional[bool] = None
+        self._size = 0
+        try:
+            self._size = os.path.getsize(self._filepath)
+        except OSError:
+            self._valid = False
+
+    @property
+    def filepath(self) -> str:
+        return self._filepath
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    @property
+    def persistent(self) -> bool:
+        # the file stays on disk until the data is uploaded
+        return True
+
+    @property
+    def lazy(self) -> bool:
+        return True
+
+    @property
+    def ready(self) -> bool:
+        return self._valid is not False
+
+    @property
+    def header_fields(self) -> List[str]:
+        # top-level fields of the file `parse_header()` looks at
+        return []
+
+    def _read(self) -> Optional[dict]:
         # noinspection PyBroadException
         try:
             with open(self._filepath, 'rt') as fin:
-                self._content = json.load(fin)
+                return json.load(fin)
         except Exception:
-            pass
+            return None
 
-    @property
-    def istime(self) -> bool:
-        # no need to check `super()`, we know it is always True given that `frequency` is 0
-        return self._content is not None and self._key is not None
+    def _read_header(self) -> Optional[dict]:
+        try:
+            with open(self._filepath, 'rt') as fin:
+                return read_fields(fin, self.header_fields)
+        except (OSError, ValueError):
+            return None
 
-    @abc.abstractmethod
     def step(self) -> Tuple[Optional[float], Optional[dict]]:
+        content = self._read_header()
+        self._valid = content is not None and self.parse_header(content)
+        if not self._valid:
+            return None, None
+        # the content is dropped here, we only keep the header
+        return self._stamp, None
+
+    def load(self) -> dict:
+        content = self._read()
+        if content is None:
+            raise FileNotFoundError(f"Could not read the statistics file '{self._filepath}'")
+        return self.body(content)
+
+    @abc.abstractmethod
+    def parse_header(self, content: dict) -> bool:
+        # takes the header fields, sets key and stamp, returns whether the file is valid
+        pass
+
+    @abc.abstractmethod
+    def body(self, content: dict) -> dict:
         pass
@@ -1,7 +1,8 @@
 import time
 from typing import Tuple, Optional
 
-from dt_robot_utils import get_robot_configuration, RobotConfiguration
+from dt_robot_utils import RobotConfiguration
+from online.device import get_device_facts
 from online.statistics.providers import ConfigurationStatsProvider
 
 
@@ -11,7 +12,7 @@ class RobotConfigurationProvider(ConfigurationStatsProvider):
         super(RobotConfigurationProvider, self).__init__("robot/configuration")
 
     def step(self) -> Tuple[Optional[float], Optional[dict]]:
-        rconfiguration = get_robot_configuration()
+        rconfiguration = get_device_facts().robot_configuration
         if rconfiguration == RobotConfiguration.UNKNOWN:
             return None, None
         # ---
@@ -1,7 +1,7 @@
 import time
 from typing import Tuple, Optional
 
-from dt_device_utils import get_device_hostname
+from online.device import get_device_facts
 from online.statistics.providers import ConfigurationStatsProvider
 
 
@@ -12,6 +12,6 @@ class RobotHostnameProvider(ConfigurationStatsProvider):
 
     def step(self) -> Tuple[Optional[float], Optional[dict]]:
         data = {
-            "value": get_device_hostname()
+            "value": get_device_facts().hostname
         }
         return time.time(), data
@@ -1,7 +1,8 @@
 import time
 from typing import Tuple, Optional
 
-from dt_robot_utils import get_robot_type, get_robot_configuration, RobotType, RobotConfiguration
+from dt_robot_utils import RobotType
+from online.device import get_device_facts
 from online.statistics.providers import ConfigurationStatsProvider
 
 
@@ -11,7 +12,7 @@ class RobotTypeProvider(ConfigurationStatsProvider):
         super(RobotTypeProvider, self).__init__("robot/type")
 
     def step(self) -> Tuple[Optional[float], Optional[dict]]:
-        rtype = get_robot_type()
+        rtype = get_device_facts().robot_type
         if rtype == RobotType.UNKNOWN:
             return None, None
         # ---
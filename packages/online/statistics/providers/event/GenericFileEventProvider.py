@@ -1,5 +1,5 @@
 import os
-from typing import Tuple, Optional
+from typing import List
 
 from online.statistics.providers import FileStatsProvider
 
@@ -8,15 +8,25 @@ class GenericFileEventProvider(FileStatsProvider):
 
     def __init__(self, filepath: str):
         super(GenericFileEventProvider, self).__init__("event", "null", filepath)
-        if self._content is None or "type" not in self._content or "stamp" not in self._content:
-            return
-        self._key = self._content["type"]
+
+    @property
+    def header_fields(self) -> List[str]:
+        return ["type", "stamp"]
+
+    def parse_header(self, content: dict) -> bool:
+        if "type" not in content or "stamp" not in content:
+            return False
+        self._key = content["type"]
         # events represent their timestamps in nanoseconds, use seconds instead
-        self._stamp = self._content["stamp"] / (10 ** 9)
+        self._stamp = content["stamp"] / (10 ** 9)
+        return True
 
-    def step(self) -> Tuple[Optional[float], Optional[dict]]:
-        data = self._content.get("data", "{}")
-        return self._stamp, data
+    def body(self, content: dict) -> dict:
+        return content.get("data", "{}")
 
     def cleanup(self):
-        os.remove(self._filepath)
+        try:
+            os.remove(self._filepath)
+        except FileNotFoundError:
+            # the same file might have been reported twice
+            pass
@@ -0,0 +1,42 @@
+from typing import Tuple, Optional, List
+
+from online.statistics.providers.event.GenericFileEventProvider import GenericFileEventProvider
+from online.statistics.spool import SpoolSegment, SpoolRecord
+
+
+class SpoolEventProvider(GenericFileEventProvider):
+    # One record of a sealed spool segment, the record is acknowledged instead of deleting a file.
+
+    def __init__(self, segment: SpoolSegment, record: SpoolRecord):
+        super(SpoolEventProvider, self).__init__(segment.path)
+        self._segment = segment
+        self._record = record
+
+    @staticmethod
+    def from_segment(filepath: str) -> List['SpoolEventProvider']:
+        segment = SpoolSegment(filepath)
+        return [SpoolEventProvider(segment, record) for record in segment.records]
+
+    @property
+    def size(self) -> int:
+        return self._record.size
+
+    def _read(self) -> Optional[dict]:
+        try:
+            return self._segment.read(self._record)
+        except (OSError, ValueError):
+            return None
+
+    def _read_header(self) -> Optional[dict]:
+        # records are small, reading one whole also verifies its checksum
+        return self._read()
+
+    def step(self) -> Tuple[Optional[float], Optional[dict]]:
+        stamp, payload = super(SpoolEventProvider, self).step()
+        if not self._valid:
+            # corrupted records cannot be recovered, they are dropped with the rest of the segment
+            self._segment.ack(self._record)
+        return stamp, payload
+
+    def cleanup(self):
+        self._segment.ack(self._record)
@@ -0,0 +1,46 @@
+import dataclasses
+import importlib
+from typing import List, Optional, Type
+
+from online.constants import FREQUENCY
+from online.statistics.providers import StatisticsProvider
+
+PROVIDERS_PACKAGE = "online.statistics.providers"
+
+
+@dataclasses.dataclass(frozen=True)
+class ProviderSpec:
+    # Where to find a provider and how to create it. The module of the provider (together with its
+    # dependencies, e.g., docker, netifaces, iwlib, psutil) is only imported when the provider is created.
+    key: str
+    # module relative to PROVIDERS_PACKAGE, named after the provider class it defines
+    path: str
+    # None for configuration providers, they do not take one
+    frequency: Optional[float] = None
+
+    def load(self) -> Type[StatisticsProvider]:
+        module = importlib.import_module(f"{PROVIDERS_PACKAGE}.{self.path}")
+        return getattr(module, self.path.rsplit(".", 1)[-1])
+
+    def create(self) -> StatisticsProvider:
+        cls = self.load()
+        return cls() if self.frequency is None else cls(self.frequency)
+
+
+PROVIDERS: List[ProviderSpec] = [
+    ProviderSpec("docker/ps", "usage.DockerPSProvider", FREQUENCY.EVERY_MINUTE),
+    ProviderSpec("docker/images", "usage.DockerImagesProvider", FREQUENCY.EVERY_MINUTE),
+    ProviderSpec("uptime", "usage.UptimeProvider", FREQUENCY.EVERY_30_MINUTES),
+    ProviderSpec("network/configuration", "usage.NetworkConfigurationProvider", FREQUENCY.EVERY_1_HOUR),
+    ProviderSpec("ros/graph", "usage.ROSGraphProvider", FREQUENCY.EVERY_30_MINUTES),
+    ProviderSpec("health", "usage.HealthProvider", FREQUENCY.EVERY_30_MINUTES),
+    ProviderSpec("network/public_ip", "usage.PublicIPProvider", FREQUENCY.ONESHOT),
+    ProviderSpec("geolocation", "usage.GeolocationProvider", FREQUENCY.ONESHOT),
+    ProviderSpec("battery/history", "usage.BatteryHistoryProvider", FREQUENCY.EVERY_2_HOURS),
+    ProviderSpec("battery/info", "usage.BatteryInfoProvider", FREQUENCY.ONESHOT),
+    ProviderSpec("lsusb", "usage.LSUSBProvider", FREQUENCY.EVERY_2_HOURS),
+    ProviderSpec("wireless/status", "usage.WirelessStatusProvider", FREQUENCY.EVERY_30_MINUTES),
+    ProviderSpec("robot/hostname", "configuration.RobotHostnameProvider"),
+    ProviderSpec("robot/type", "configuration.RobotTypeProvider"),
+    ProviderSpec("robot/configuration", "configuration.RobotConfigurationProvider"),
+]
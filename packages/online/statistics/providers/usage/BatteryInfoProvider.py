@@ -1,10 +1,8 @@
 import time
 from typing import Tuple, Optional
 
-import requests
-
-from dt_device_utils import get_device_hostname
 from online.statistics.providers import UsageStatsProvider
+from .device_health import get_device_health, BATTERY_INFO
 
 
 class BatteryInfoProvider(UsageStatsProvider):
@@ -13,11 +11,7 @@ class BatteryInfoProvider(UsageStatsProvider):
         super(BatteryInfoProvider, self).__init__("battery/info", frequency)
 
     def step(self) -> Tuple[Optional[float], Optional[dict]]:
-        hostname = get_device_hostname()
-        url = f"http://{hostname}.local/health/battery/info"
-        # noinspection PyBroadException
-        try:
-            data = requests.get(url).json()
-            return time.time(), data
-        except Exception:
+        data = get_device_health().get(BATTERY_INFO)
+        if data is None:
             return None, None
+        return time.time(), data
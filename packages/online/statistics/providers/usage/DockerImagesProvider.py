@@ -3,30 +3,47 @@ from typing import Tuple, Optional
 
 import docker
 
+from online.constants import DOCKER_API_TIMEOUT_SECS, DOCKER_STATS_MODE
 from online.statistics.providers import UsageStatsProvider
+from .docker_events import get_docker_monitor, IMAGES
 
 
 class DockerImagesProvider(UsageStatsProvider):
 
     def __init__(self, frequency: float):
         super(DockerImagesProvider, self).__init__("docker/images", frequency)
-        self._client = docker.from_env()
-        self._last = None
+        self._events = DOCKER_STATS_MODE == "events"
+        # created on first use, connecting to the engine takes a request to negotiate the API version
+        self._client: Optional[docker.DockerClient] = None
+        # report as soon as the events stream tells us something changed
+        if self._events:
+            get_docker_monitor().subscribe(IMAGES, self.trigger)
+
+    @property
+    def client(self) -> docker.DockerClient:
+        if self._client is None:
+            self._client = docker.from_env(timeout=DOCKER_API_TIMEOUT_SECS)
+        return self._client
+
+    @property
+    def deduplicate(self) -> bool:
+        return True
 
     def step(self) -> Tuple[Optional[float], Optional[dict]]:
+        if self._events:
+            return self._step_events()
         try:
             # get list of images
             images = {
-                image["Id"]: image for image in self._client.api.images()
+                image["Id"]: image for image in self.client.api.images()
             }
-            # compute the current set of image IDs
-            current = set(images.keys())
-            if current == self._last:
-                # no changes since last time we checked, do not report
-                return None, None
-            # store current set
-            self._last = current
             # ---
             return time.time(), images
         except docker.errors.APIError:
             return None, None
+
+    def _step_events(self) -> Tuple[Optional[float], Optional[dict]]:
+        _, images = get_docker_monitor().snapshot(IMAGES)
+        if images is None:
+            return None, None
+        return time.time(), images
@@ -1,34 +1,56 @@
 import time
-from typing import Tuple, Optional
+from typing import Tuple, Optional, List
 
 import docker
 
+from online.constants import DOCKER_API_TIMEOUT_SECS, DOCKER_STATS_MODE
 from online.statistics.providers import UsageStatsProvider
+from .docker_events import get_docker_monitor, CONTAINERS
 
 
 class DockerPSProvider(UsageStatsProvider):
 
     def __init__(self, frequency: float):
         super(DockerPSProvider, self).__init__("docker/ps", frequency)
-        self._client = docker.from_env()
-        self._last = None
+        self._events = DOCKER_STATS_MODE == "events"
+        # created on first use, connecting to the engine takes a request to negotiate the API version
+        self._client: Optional[docker.DockerClient] = None
+        # report as soon as the events stream tells us something changed
+        if self._events:
+            get_docker_monitor().subscribe(CONTAINERS, self.trigger)
+
+    @property
+    def client(self) -> docker.DockerClient:
+        if self._client is None:
+            self._client = docker.from_env(timeout=DOCKER_API_TIMEOUT_SECS)
+        return self._client
+
+    @property
+    def deduplicate(self) -> bool:
+        return True
+
+    @property
+    def ignore_fields(self) -> List[Tuple[str, ...]]:
+        # results of the periodic health checks
+        return [("*", "State", "Health", "Log")]
 
     def step(self) -> Tuple[Optional[float], Optional[dict]]:
+        if self._events:
+            return self._step_events()
         data = {}
         try:
             # get list of containers
-            containers = self._client.containers.list(sparse=True)
-            # compute the current set of container IDs
-            current = set(map(lambda c: c.id, containers))
-            if current == self._last:
-                # no changes since last time we checked, do not report
-                return None, None
-            # inspect containers
+            containers = self.client.containers.list(sparse=True)
+            # inspect containers (unchanged results are suppressed by the change detection)
             for container in containers:
-                data[container.id] = self._client.api.inspect_container(container.id)
-            # store current set
-            self._last = current
+                data[container.id] = self.client.api.inspect_container(container.id)
             # ---
             return time.time(), data
         except docker.errors.APIError:
             return None, None
+
+    def _step_events(self) -> Tuple[Optional[float], Optional[dict]]:
+        _, data = get_docker_monitor().snapshot(CONTAINERS)
+        if data is None:
+            return None, None
+        return time.time(), data
@@ -1,5 +1,5 @@
 import os
-from typing import Tuple, Optional
+from typing import List
 
 from online.statistics.providers import FileStatsProvider
 
@@ -8,12 +8,23 @@ class GenericFileUsageProvider(FileStatsProvider):
 
     def __init__(self, key: str, filepath: str):
         super(GenericFileUsageProvider, self).__init__("usage", key, filepath)
-        if self._content is None or "stamp" not in self._content:
-            return
-        self._stamp = self._content["stamp"]
 
-    def step(self) -> Tuple[Optional[float], Optional[dict]]:
-        return self._stamp, self._content
+    @property
+    def header_fields(self) -> List[str]:
+        return ["stamp"]
+
+    def parse_header(self, content: dict) -> bool:
+        if "stamp" not in content:
+            return False
+        self._stamp = content["stamp"]
+        return True
+
+    def body(self, content: dict) -> dict:
+        return content
 
     def cleanup(self):
-        os.remove(self._filepath)
+        try:
+            os.remove(self._filepath)
+        except FileNotFoundError:
+            # the same file might have been reported twice
+            pass
@@ -1,8 +1,7 @@
 import time
 from typing import Tuple, Optional
 
-import requests
-
+from online.session import get_session
 from online.statistics.providers import UsageStatsProvider
 
 
@@ -15,7 +14,7 @@ class GeolocationProvider(UsageStatsProvider):
         url = "https://freegeoip.app/json/"
         # noinspection PyBroadException
         try:
-            data = requests.get(url).json()
+            data = get_session().get(url).json()
             return time.time(), data
         except Exception:
             return None, None
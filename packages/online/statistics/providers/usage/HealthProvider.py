@@ -1,10 +1,8 @@
 import time
 from typing import Tuple, Optional
 
-import requests
-
-from dt_device_utils import get_device_hostname
 from online.statistics.providers import UsageStatsProvider
+from .device_health import get_device_health, HEALTH
 
 
 class HealthProvider(UsageStatsProvider):
@@ -12,12 +10,13 @@ class HealthProvider(UsageStatsProvider):
     def __init__(self, frequency: float):
         super(HealthProvider, self).__init__("health", frequency)
 
+    @property
+    def deduplicate(self) -> bool:
+        # an unchanged document (e.g., a 304 response) does not make a new point
+        return True
+
     def step(self) -> Tuple[Optional[float], Optional[dict]]:
-        hostname = get_device_hostname()
-        url = f"http://{hostname}.local/health"
-        # noinspection PyBroadException
-        try:
-            data = requests.get(url).json()
-            return time.time(), data
-        except Exception:
+        data = get_device_health().get(HEALTH)
+        if data is None:
             return None, None
+        return time.time(), data
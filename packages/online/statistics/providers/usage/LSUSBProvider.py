@@ -3,6 +3,7 @@ import subprocess
 import time
 from typing import Tuple, Optional
 
+from online.constants import STATS_PROVIDER_TIMEOUT_SECS
 from online.statistics.providers import UsageStatsProvider
 
 
@@ -11,11 +12,15 @@ class LSUSBProvider(UsageStatsProvider):
     def __init__(self, frequency: float):
         super(LSUSBProvider, self).__init__("lsusb", frequency)
 
+    @property
+    def deduplicate(self) -> bool:
+        return True
+
     def step(self) -> Tuple[Optional[float], Optional[dict]]:
         device_re = re.compile(
             "Bus\s+(?P<bus>\d+)\s+Device\s+(?P<device>\d+).+ID\s(?P<id>\w+:\w+)\s(?P<tag>.+)$",
             re.I)
-        df = subprocess.check_output("lsusb").decode('utf-8')
+        df = subprocess.check_output("lsusb", timeout=STATS_PROVIDER_TIMEOUT_SECS).decode('utf-8')
         devices = []
         for i in df.split('\n'):
             if i:
@@ -19,6 +19,10 @@ class NetworkConfigurationProvider(UsageStatsProvider):
     def __init__(self, frequency: float):
         super(NetworkConfigurationProvider, self).__init__("network/configuration", frequency)
 
+    @property
+    def deduplicate(self) -> bool:
+        return True
+
     def step(self) -> Tuple[Optional[float], Optional[dict]]:
         data = {}
         ifaces = netifaces.interfaces()
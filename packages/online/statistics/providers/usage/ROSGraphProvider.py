@@ -1,23 +1,67 @@
 import time
 from typing import Tuple, Optional
 
-import requests
-
-from dt_device_utils import get_device_hostname
+from online.constants import ROS_GRAPH_DELTA_MODE, ROS_GRAPH_KEYFRAME_EVERY
+from online.device import get_local_endpoints
+from online.statistics.delta import compute_delta, is_empty
 from online.statistics.providers import UsageStatsProvider
 
+KEYFRAME_KEY = "ros/graph"
+DELTA_KEY = "ros/graph/delta"
+
 
 class ROSGraphProvider(UsageStatsProvider):
 
     def __init__(self, frequency: float):
-        super(ROSGraphProvider, self).__init__("ros/graph", frequency)
+        super(ROSGraphProvider, self).__init__(KEYFRAME_KEY, frequency)
+        # last graph reported and its position in the keyframe/delta chain
+        self._last: Optional[dict] = None
+        self._keyframe_stamp: Optional[int] = None
+        self._last_stamp: Optional[int] = None
+        self._seq: int = 0
+        # whether the last step gave a delta (the provider key stays the same, points tell them apart)
+        self._delta: bool = False
 
     def step(self) -> Tuple[Optional[float], Optional[dict]]:
-        hostname = get_device_hostname()
-        url = f"http://{hostname}.local/ros/graph"
         # noinspection PyBroadException
         try:
-            data = requests.get(url).json()['data']
-            return time.time(), data
+            data = get_local_endpoints().get("/ros/graph").json()['data']
         except Exception:
             return None, None
+        stamp = time.time()
+        self._delta = False
+        if not ROS_GRAPH_DELTA_MODE:
+            return stamp, data
+        # stamps are referenced in milliseconds, the same way the server identifies points
+        stamp_ms = int(stamp * 1000)
+        # full keyframe
+        if self._last is None or self._seq >= ROS_GRAPH_KEYFRAME_EVERY:
+            self._last = data
+            self._keyframe_stamp = self._last_stamp = stamp_ms
+            self._seq = 1
+            return stamp, data
+        # the delta always counts as a step, so keyframes are sent periodically even if nothing changes
+        self._seq += 1
+        delta = compute_delta(self._last, data)
+        if is_empty(delta):
+            return None, None
+        # the graph can be rebuilt by applying (`online.statistics.delta.apply_delta`) the deltas
+        # following a keyframe, in order
+        self._delta = True
+        payload = {
+            "keyframe": self._keyframe_stamp,
+            "previous": self._last_stamp,
+            "seq": self._seq,
+            "delta": delta
+        }
+        self._last = data
+        self._last_stamp = stamp_ms
+        return stamp, payload
+
+    def point_key(self, payload: Optional[dict]) -> str:
+        return DELTA_KEY if self._delta else KEYFRAME_KEY
+
+    def resync(self):
+        # the server cannot rebuild the graph from our deltas anymore, start over with a keyframe
+        self._last = None
+        self.trigger()
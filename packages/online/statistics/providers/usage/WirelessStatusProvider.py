@@ -1,7 +1,8 @@
 import time
 import iwlib
-from typing import Tuple, Optional
+from typing import Tuple, Optional, List
 
+from online.bandwidth import get_governor, parse_bitrate
 from online.statistics.providers import UsageStatsProvider
 
 WIFI_DEVICE = "wlan0"
@@ -12,10 +13,22 @@ class WirelessStatusProvider(UsageStatsProvider):
     def __init__(self, frequency: float):
         super(WirelessStatusProvider, self).__init__("wireless/status", frequency)
 
+    @property
+    def deduplicate(self) -> bool:
+        return True
+
+    @property
+    def ignore_fields(self) -> List[Tuple[str, ...]]:
+        # time of the last update of the link statistics
+        return [("stats", "updated")]
+
     def step(self) -> Tuple[Optional[float], Optional[dict]]:
         try:
             data = iwlib.get_iwconfig(WIFI_DEVICE)
             data = {k: v.decode('utf-8') if isinstance(v, bytes) else v for k, v in data.items()}
+            # let the outbound traffic make room for others when the link is poor
+            get_governor().adapt_to_link(data.get("stats", {}).get("quality", None),
+                                         parse_bitrate(data.get("BitRate", None)))
             return time.time(), data
         except (Exception, OSError):
             return None, None
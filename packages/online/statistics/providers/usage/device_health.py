@@ -0,0 +1,94 @@
+import dataclasses
+import time
+from threading import Semaphore
+from typing import Dict, Optional
+
+import requests
+
+from dt_class_utils import DTProcess
+
+from online.constants import DEVICE_HEALTH_MAX_AGE_SECS
+from online.device import get_local_endpoints
+from online.metrics import get_registry
+
+HEALTH = "/health"
+BATTERY_HISTORY = "/health/battery/history"
+BATTERY_INFO = "/health/battery/info"
+
+DEVICE_HEALTH_REQUESTS = get_registry().counter(
+    "dt_online_device_health_requests_total", "Requests to the device health API by outcome (200, 304, error).",
+    ["outcome"])
+
+
+@dataclasses.dataclass
+class _Resource:
+    data: Optional[dict] = None
+    # validators of the content we have, sent back with the next request
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # time (monotonic) of the last request, and whether it went well
+    fetched: float = -DEVICE_HEALTH_MAX_AGE_SECS
+    ok: bool = False
+    # callers of the same resource wait for an ongoing request instead of making their own
+    lock: Semaphore = dataclasses.field(default_factory=lambda: Semaphore(1))
+
+
+class DeviceHealthClient:
+    # Fetches the resources of the device health API for the providers, over the shared pool of keep-alive
+    # connections. Requests are conditional (ETag, Last-Modified), unchanged resources come back as empty
+    # 304 responses and the content we already have is used instead.
+
+    def __init__(self, max_age: float = DEVICE_HEALTH_MAX_AGE_SECS):
+        self._max_age = max_age
+        self._lock = Semaphore(1)
+        self._resources: Dict[str, _Resource] = {}
+
+    def get(self, path: str) -> Optional[dict]:
+        # returns the content of the resource, None if it could not be fetched
+        with self._lock:
+            resource = self._resources.setdefault(path, _Resource())
+        # each resource is fetched on its own, a slow one does not hold up the others
+        with resource.lock:
+            if time.monotonic() - resource.fetched >= self._max_age:
+                self._refresh(path, resource)
+            return resource.data if resource.ok else None
+
+    def _refresh(self, path: str, resource: _Resource):
+        try:
+            self._fetch(path, resource)
+            resource.ok = True
+        except (requests.RequestException, ValueError) as e:
+            DEVICE_HEALTH_REQUESTS.inc("error")
+            DTProcess.get_instance().logger.debug(
+                f"Could not fetch '{path}' from the device health API, reason: {str(e)}")
+            resource.ok = False
+        resource.fetched = time.monotonic()
+
+    @staticmethod
+    def _fetch(path: str, resource: _Resource):
+        headers = {}
+        if resource.etag is not None:
+            headers["If-None-Match"] = resource.etag
+        if resource.last_modified is not None:
+            headers["If-Modified-Since"] = resource.last_modified
+        res = get_local_endpoints().get(path, headers=headers)
+        if res.status_code == 304 and resource.data is not None:
+            DEVICE_HEALTH_REQUESTS.inc("304")
+            return
+        res.raise_for_status()
+        resource.data = res.json()
+        resource.etag = res.headers.get("ETag", None)
+        resource.last_modified = res.headers.get("Last-Modified", None)
+        DEVICE_HEALTH_REQUESTS.inc("200")
+
+
+_client: Optional[DeviceHealthClient] = None
+_client_lock = Semaphore(1)
+
+
+def get_device_health() -> DeviceHealthClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = DeviceHealthClient()
+        return _client
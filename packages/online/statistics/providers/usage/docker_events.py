@@ -0,0 +1,169 @@
+import copy
+from threading import Thread, Semaphore, Event
+from typing import Callable, Dict, List, Optional, Tuple
+
+import docker
+
+from dt_class_utils import DTProcess
+
+from online.constants import DOCKER_API_TIMEOUT_SECS, DOCKER_EVENTS_DEBOUNCE_SECS
+from online.retry import RetryPolicy
+from online.scheduler import get_scheduler, ScheduledTask
+
+CONTAINERS = "containers"
+IMAGES = "images"
+
+# container actions that do not change what `docker ps` reports
+IGNORED_CONTAINER_ACTIONS = {"attach", "commit", "copy", "detach", "exec_create", "exec_detach", "exec_start",
+                             "exec_die", "export", "health_status", "resize", "top", "archive-path",
+                             "extract-to-dir"}
+# container actions after which the container is not running anymore
+GONE_CONTAINER_ACTIONS = {"die", "kill", "stop", "destroy", "oom"}
+
+
+class DockerEventsMonitor(Thread):
+    # Keeps an in-memory model of the running containers (as returned by `inspect`) and of the
+    # images on the device, updated incrementally from the Docker events stream. The full listing
+    # only happens when the stream is (re)opened, i.e., at startup and after a connection drop.
+
+    def __init__(self):
+        super(DockerEventsMonitor, self).__init__(daemon=True)
+        self._shutdown = False
+        # created by the monitor thread, connecting to the engine takes a request
+        self._client: Optional[docker.DockerClient] = None
+        self._stream = None
+        self._lock = Semaphore(1)
+        self._ready = Event()
+        self._containers: Dict[str, dict] = {}
+        self._images: Dict[str, dict] = {}
+        # each change bumps the version of the corresponding model
+        self._versions: Dict[str, int] = {CONTAINERS: 0, IMAGES: 0}
+        self._listeners: Dict[str, List[Callable[[], None]]] = {CONTAINERS: [], IMAGES: []}
+        self._notify_tasks: Dict[str, Optional[ScheduledTask]] = {CONTAINERS: None, IMAGES: None}
+
+    def is_shutdown(self) -> bool:
+        return self._shutdown
+
+    def shutdown(self):
+        self._shutdown = True
+        if self._stream is not None:
+            self._stream.close()
+
+    def subscribe(self, model: str, callback: Callable[[], None]):
+        self._listeners[model].append(callback)
+
+    def snapshot(self, model: str) -> Tuple[int, Optional[dict]]:
+        # wait for the first full listing (bounded, we do not want to hang a provider)
+        if not self._ready.wait(DOCKER_API_TIMEOUT_SECS):
+            return 0, None
+        with self._lock:
+            data = self._containers if model == CONTAINERS else self._images
+            return self._versions[model], copy.copy(data)
+
+    def _changed(self, model: str):
+        self._versions[model] += 1
+        # bursts of events (e.g., a whole stack starting) are reported together
+        if self._notify_tasks[model] is None:
+            self._notify_tasks[model] = get_scheduler().call_later(
+                DOCKER_EVENTS_DEBOUNCE_SECS, lambda: self._notify(model))
+
+    def _notify(self, model: str):
+        self._notify_tasks[model] = None
+        for callback in self._listeners[model]:
+            callback()
+
+    def _inspect(self, container_id: str) -> Optional[dict]:
+        try:
+            return self._client.api.inspect_container(container_id)
+        except docker.errors.NotFound:
+            return None
+
+    def _resync(self):
+        containers = {}
+        for container in self._client.api.containers():
+            info = self._inspect(container["Id"])
+            if info is not None:
+                containers[container["Id"]] = info
+        images = {image["Id"]: image for image in self._client.api.images()}
+        with self._lock:
+            if containers != self._containers:
+                self._containers = containers
+                self._changed(CONTAINERS)
+            if images != self._images:
+                self._images = images
+                self._changed(IMAGES)
+        self._ready.set()
+
+    def _on_container_event(self, action: str, container_id: str):
+        # actions can carry arguments (e.g., "exec_start: bash")
+        action = action.split(":")[0].strip()
+        if action in IGNORED_CONTAINER_ACTIONS:
+            return
+        info = None if action in GONE_CONTAINER_ACTIONS else self._inspect(container_id)
+        running = info is not None and info.get("State", {}).get("Running", False)
+        with self._lock:
+            if running:
+                if self._containers.get(container_id, None) != info:
+                    self._containers[container_id] = info
+                    self._changed(CONTAINERS)
+            elif self._containers.pop(container_id, None) is not None:
+                self._changed(CONTAINERS)
+
+    def _on_image_event(self, action: str, image_id: str):
+        if action == "delete":
+            with self._lock:
+                if self._images.pop(image_id, None) is not None:
+                    self._changed(IMAGES)
+            return
+        # the events do not carry the image summary, one listing gives us the new state
+        images = {image["Id"]: image for image in self._client.api.images()}
+        with self._lock:
+            if images != self._images:
+                self._images = images
+                self._changed(IMAGES)
+
+    def run(self):
+        app = DTProcess.get_instance()
+        retry = RetryPolicy(initial_delay=5, max_delay=5 * 60)
+        while not self.is_shutdown():
+            try:
+                if self._client is None:
+                    self._client = docker.from_env(timeout=DOCKER_API_TIMEOUT_SECS)
+                # subscribe first so that nothing happening during the listing gets lost
+                self._stream = self._client.events(decode=True, filters={"type": ["container", "image"]})
+                self._resync()
+                retry.success()
+                for event in self._stream:
+                    kind = event.get("Type", None)
+                    action = event.get("Action", event.get("status", ""))
+                    object_id = event.get("Actor", {}).get("ID", event.get("id", None))
+                    if object_id is None:
+                        continue
+                    if kind == "container":
+                        self._on_container_event(action, object_id)
+                    elif kind == "image":
+                        self._on_image_event(action, object_id)
+                if not self.is_shutdown():
+                    raise ConnectionError("The stream was closed by the Docker engine")
+            except Exception as e:
+                if self.is_shutdown():
+                    return
+                delay = retry.failure()
+                app.logger.warning(f"Lost the Docker events stream, reason: {str(e)}. "
+                                   f"Reconnecting in {int(delay)} seconds.")
+                stopped = Event()
+                get_scheduler().call_later(delay, stopped.set)
+                stopped.wait()
+
+
+_monitor: Optional[DockerEventsMonitor] = None
+_monitor_lock = Semaphore(1)
+
+
+def get_docker_monitor() -> DockerEventsMonitor:
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = DockerEventsMonitor()
+            _monitor.start()
+        return _monitor
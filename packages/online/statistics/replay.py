@@ -0,0 +1,147 @@
+import time
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+from ..scheduler import get_scheduler
+from .collector import StatisticsWorker, StatisticsUploader
+from .fingerprints import FingerprintStore
+from .providers import StatisticsProvider
+from .trace import Trace
+
+
+class ReplayClock:
+    # Maps the time of a trace to the time of its replay, `speed` times faster.
+
+    def __init__(self, origin: float, speed: float):
+        self._origin = origin
+        self._speed = speed
+        self._monotonic = time.monotonic()
+        self._wall = time.time()
+
+    def start(self):
+        self._monotonic = time.monotonic()
+        self._wall = time.time()
+
+    def due(self, t: float) -> float:
+        # seconds after the start of the replay at which what happened at `t` is replayed
+        return (t - self._origin) / self._speed
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self._monotonic
+
+    def wall(self, t: float) -> float:
+        return self._wall + self.due(t)
+
+    def scale(self, secs: float) -> float:
+        return secs / self._speed
+
+
+class ReplayProvider(StatisticsProvider):
+    # Gives back the recorded steps of a provider, in order, each one once it is due. A step takes as
+    # long as it did when it was recorded (scaled) and fails if it failed.
+
+    def __init__(self, description: dict, steps: List[dict], clock: ReplayClock):
+        period = clock.scale(description["period"])
+        super(ReplayProvider, self).__init__(description["category"], description["key"],
+                                             1.0 / period if period > 0 else 0)
+        self._description = description
+        self._clock = clock
+        self._steps: Deque[Tuple[float, dict]] = deque((clock.due(s["time"]), s) for s in steps)
+        self.replayed: int = 0
+
+    @property
+    def due(self) -> List[float]:
+        return [due for due, _ in self._steps]
+
+    @property
+    def timeout(self) -> float:
+        return self._clock.scale(self._description["timeout"])
+
+    @property
+    def deduplicate(self) -> bool:
+        return self._description["deduplicate"]
+
+    @property
+    def ignore_fields(self) -> List[Tuple[str, ...]]:
+        return [tuple(path) for path in self._description["ignore_fields"]]
+
+    @property
+    def heartbeat(self) -> int:
+        return self._description["heartbeat"]
+
+    @property
+    def ready(self) -> bool:
+        return bool(self._steps) and self._steps[0][0] <= self._clock.elapsed()
+
+    def step(self) -> Tuple[Optional[float], Optional[dict]]:
+        _, step = self._steps.popleft()
+        self.replayed += 1
+        time.sleep(self._clock.scale(step["duration"]))
+        if step["error"] is not None:
+            raise RuntimeError(step["error"])
+        if step["stamp"] is None:
+            return None, None
+        return self._clock.wall(step["stamp"]), step["payload"]
+
+
+class ReplayWorker(StatisticsWorker):
+    # Feeds a trace through the collector (scheduling, deadlines, quarantine, change detection, outbox)
+    # and the given uploader. Statistics files and the events spool of this device are left alone.
+
+    def __init__(self, trace: Trace, uploader: StatisticsUploader, fingerprints_file: str,
+                 speed: float = 1.0):
+        self._trace = trace
+        self._clock = ReplayClock(trace.start, speed)
+        self._replayed: List[ReplayProvider] = [
+            ReplayProvider(trace.providers[key], steps, self._clock) for key, steps in trace.steps.items()
+        ]
+        # time it takes to replay the whole trace
+        self._duration = max([p.due[-1] for p in self._replayed if p.due] or [0.0])
+        super(ReplayWorker, self).__init__(uploader)
+        self._fingerprints = FingerprintStore(fingerprints_file, boot_id=uploader.boot_id)
+        # steps are replayed when they happened, with the schedule they had when they were recorded
+        self._adaptive = False
+        self._files_factories = {}
+
+    @property
+    def steps(self) -> int:
+        return sum(len(steps) for steps in self._trace.steps.values())
+
+    @property
+    def replayed(self) -> int:
+        return sum(p.replayed for p in self._replayed)
+
+    @property
+    def duration(self) -> float:
+        return self._duration
+
+    @property
+    def finished(self) -> bool:
+        # steps that are still not replayed by the end (e.g., the provider was quarantined) are skipped
+        with self._lock:
+            busy = bool(self._running)
+        return not busy and self._clock.elapsed() >= self.duration and len(self._outbox) == 0
+
+    def _register_providers(self):
+        self._providers.extend(self._replayed)
+
+    def _read_device_id(self) -> str:
+        if self._trace.device is None:
+            raise ValueError("The trace does not say which device it was recorded on")
+        return self._trace.device
+
+    def _maintain_spool(self):
+        pass
+
+    def _schedule(self, provider: StatisticsProvider):
+        super(ReplayWorker, self)._schedule(provider)
+        if not isinstance(provider, ReplayProvider):
+            return
+        # steps happen when they happened, not only when their period says so (e.g., triggered steps)
+        scheduler = get_scheduler()
+        for due in provider.due:
+            self._tasks.append(scheduler.call_later(due - self._clock.elapsed(), provider.trigger))
+
+    def run(self):
+        self._clock.start()
+        super(ReplayWorker, self).run()
@@ -0,0 +1,280 @@
+import dataclasses
+import fcntl
+import glob
+import json
+import os
+import struct
+import time
+import zlib
+from contextlib import contextmanager
+from threading import Semaphore
+from typing import List, Optional, Set
+
+from dt_class_utils import DTProcess
+
+from ..constants import \
+    STATS_SPOOL_DIR, \
+    STATS_SPOOL_SEGMENT_BYTES, \
+    STATS_SPOOL_SEGMENT_SECS, \
+    STATS_SPOOL_MAX_BYTES, \
+    STATS_SPOOL_MAX_AGE_SECS
+
+# A spool is a directory of append-only segment files. Each segment is named after the time (in
+# milliseconds) it was created and contains a sequence of records:
+#
+#   magic (2) | version (1) | reserved (1) | crc32 (4) | length (4) | stamp (8) | type length (2)
+#   type (utf-8) | data (json, utf-8)
+#
+# The CRC covers type and data. Producers append to the open segment (`<name>.seg.open`), which is
+# sealed (renamed to `<name>.seg`) once it is big or old enough, together with an index of its
+# records (`<name>.idx`). Acknowledged records are appended to `<name>.ack`, a segment is deleted
+# as a whole once all of its records are acknowledged.
+# All changes to the directory happen while holding an exclusive lock on `.lock`.
+
+_HEADER = struct.Struct("<2sBBIIqH")
+_MAGIC = b"DS"
+_VERSION = 1
+_ACK = struct.Struct("<Q")
+
+OPEN_SUFFIX = ".seg.open"
+SEALED_SUFFIX = ".seg"
+INDEX_SUFFIX = ".idx"
+ACK_SUFFIX = ".ack"
+
+# sealed segments (by path) this process is consuming, the retention policy leaves them alone until all of
+# their records are acknowledged
+_in_flight: Set[str] = set()
+
+
+@dataclasses.dataclass(frozen=True)
+class SpoolRecord:
+    offset: int
+    # size of the whole record, header included
+    size: int
+    type: str
+    # nanoseconds
+    stamp: int
+
+
+def pack(kind: str, stamp: int, data: dict) -> bytes:
+    type_b = kind.encode("utf-8")
+    data_b = json.dumps(data).encode("utf-8")
+    crc = zlib.crc32(data_b, zlib.crc32(type_b))
+    return _HEADER.pack(_MAGIC, _VERSION, 0, crc, len(data_b), stamp, len(type_b)) + type_b + data_b
+
+
+def scan(path: str) -> List[SpoolRecord]:
+    # reads the headers only, the scan stops at the first incomplete or corrupted record
+    records = []
+    with open(path, "rb") as fin:
+        size = os.fstat(fin.fileno()).st_size
+        offset = 0
+        while offset + _HEADER.size <= size:
+            header = fin.read(_HEADER.size)
+            magic, version, _, _, length, stamp, type_len = _HEADER.unpack(header)
+            if magic != _MAGIC or version != _VERSION:
+                break
+            record_size = _HEADER.size + type_len + length
+            if offset + record_size > size:
+                break
+            kind = fin.read(type_len).decode("utf-8", errors="replace")
+            records.append(SpoolRecord(offset, record_size, kind, stamp))
+            offset += record_size
+            fin.seek(offset)
+    return records
+
+
+def read(path: str, record: SpoolRecord) -> dict:
+    with open(path, "rb") as fin:
+        fin.seek(record.offset)
+        buffer = fin.read(record.size)
+    if len(buffer) != record.size:
+        raise ValueError(f"Record at offset {record.offset} of '{path}' is truncated")
+    _, _, _, crc, length, stamp, type_len = _HEADER.unpack_from(buffer)
+    type_b = buffer[_HEADER.size:_HEADER.size + type_len]
+    data_b = buffer[_HEADER.size + type_len:]
+    if zlib.crc32(data_b, zlib.crc32(type_b)) != crc:
+        raise ValueError(f"Record at offset {record.offset} of '{path}' failed the checksum")
+    # same layout as the event files
+    return {"type": type_b.decode("utf-8"), "stamp": stamp, "data": json.loads(data_b)}
+
+
+@contextmanager
+def _locked(directory: str):
+    fd = os.open(os.path.join(directory, ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+def _name(path: str) -> str:
+    return os.path.basename(path).split(".")[0]
+
+
+def _age(path: str) -> float:
+    return time.time() - int(_name(path)) / 1000.0
+
+
+def _remove(base: str):
+    for suffix in [OPEN_SUFFIX, SEALED_SUFFIX, INDEX_SUFFIX, ACK_SUFFIX]:
+        try:
+            os.remove(base + suffix)
+        except FileNotFoundError:
+            pass
+
+
+def _seal(path: str):
+    base = path[:-len(OPEN_SUFFIX)]
+    records = scan(path)
+    if not records:
+        os.remove(path)
+        return
+    # the index goes first, a sealed segment always has one (unless it was lost in a crash)
+    with open(base + INDEX_SUFFIX + ".tmp", "wt") as fout:
+        json.dump([dataclasses.astuple(r) for r in records], fout)
+    os.rename(base + INDEX_SUFFIX + ".tmp", base + INDEX_SUFFIX)
+    os.rename(path, base + SEALED_SUFFIX)
+
+
+def maintain(directory: str = STATS_SPOOL_DIR):
+    # seals the open segments that are old enough and applies the retention policy
+    if not os.path.isdir(directory):
+        return
+    with _locked(directory):
+        for path in glob.glob(os.path.join(directory, "*" + OPEN_SUFFIX)):
+            if _age(path) >= STATS_SPOOL_SEGMENT_SECS:
+                _seal(path)
+        sealed = sorted(glob.glob(os.path.join(directory, "*" + SEALED_SUFFIX)))
+        sizes = {path: os.path.getsize(path) for path in sealed}
+        total = sum(sizes.values())
+        dropped = 0
+        for path in sealed:
+            if total <= STATS_SPOOL_MAX_BYTES and _age(path) <= STATS_SPOOL_MAX_AGE_SECS:
+                break
+            # records on their way to the server would be lost, the next segments go instead
+            if path in _in_flight:
+                continue
+            _remove(path[:-len(SEALED_SUFFIX)])
+            total -= sizes[path]
+            dropped += 1
+    if dropped:
+        DTProcess.get_instance().logger.warning(
+            f"Dropped {dropped} segments from the events spool to stay within the retention policy.")
+
+
+class SpoolWriter:
+    # Used by producers to append events to a spool. Safe to use from multiple processes.
+
+    def __init__(self, directory: str = STATS_SPOOL_DIR):
+        self._directory = directory
+        self._path: Optional[str] = None
+        self._fd: Optional[int] = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _open(self):
+        self._close()
+        existing = glob.glob(os.path.join(self._directory, "*" + OPEN_SUFFIX))
+        if existing:
+            self._path = existing[0]
+        else:
+            # names are creation times in milliseconds, they also keep the segments in order
+            names = [int(_name(p)) for p in glob.glob(os.path.join(self._directory, "*.seg*"))]
+            name = max([int(time.time() * 1000)] + [n + 1 for n in names])
+            self._path = os.path.join(self._directory, f"{name:016d}{OPEN_SUFFIX}")
+        self._fd = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def _close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = self._path = None
+
+    def append(self, kind: str, stamp: int, data: dict):
+        record = pack(kind, stamp, data)
+        with _locked(self._directory):
+            # the segment might have been sealed by someone else
+            if self._path is None or not os.path.exists(self._path):
+                self._open()
+            if os.fstat(self._fd).st_size >= STATS_SPOOL_SEGMENT_BYTES or \
+                    _age(self._path) >= STATS_SPOOL_SEGMENT_SECS:
+                _seal(self._path)
+                self._open()
+            # a single write, a crash can only leave an incomplete record at the end of the segment
+            os.write(self._fd, record)
+
+    def close(self):
+        self._close()
+
+
+class SpoolSegment:
+    # Consumer side of a sealed segment, keeps track of the records that were acknowledged.
+
+    def __init__(self, path: str):
+        self._path = path
+        self._base = path[:-len(SEALED_SUFFIX)]
+        self._lock = Semaphore(1)
+        self._ack_fd: Optional[int] = None
+        # the retention policy cannot drop the segment while we read it
+        with _locked(os.path.dirname(path)):
+            try:
+                with open(self._base + INDEX_SUFFIX, "rt") as fin:
+                    records = [SpoolRecord(*r) for r in json.load(fin)]
+            except (OSError, ValueError, TypeError):
+                records = scan(path)
+            acked = self._acked()
+            self._records = [r for r in records if r.offset not in acked]
+            self._pending: Set[int] = {r.offset for r in self._records}
+            if self._pending:
+                _in_flight.add(path)
+        if not self._pending:
+            self._delete()
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    @property
+    def records(self) -> List[SpoolRecord]:
+        # records that were not acknowledged yet
+        return self._records
+
+    def _acked(self) -> Set[int]:
+        try:
+            with open(self._base + ACK_SUFFIX, "rb") as fin:
+                buffer = fin.read()
+        except FileNotFoundError:
+            return set()
+        usable = len(buffer) - len(buffer) % _ACK.size
+        return {offset for offset, in _ACK.iter_unpack(buffer[:usable])}
+
+    def read(self, record: SpoolRecord) -> dict:
+        return read(self._path, record)
+
+    def ack(self, record: SpoolRecord):
+        with self._lock:
+            if record.offset not in self._pending:
+                return
+            self._pending.discard(record.offset)
+            if not self._pending:
+                self._delete()
+                return
+            # the segment might have been removed by someone else
+            if not os.path.exists(self._path):
+                return
+            if self._ack_fd is None:
+                self._ack_fd = os.open(self._base + ACK_SUFFIX, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            os.write(self._ack_fd, _ACK.pack(record.offset))
+
+    def _delete(self):
+        if self._ack_fd is not None:
+            os.close(self._ack_fd)
+            self._ack_fd = None
+        directory = os.path.dirname(self._path)
+        try:
+            with _locked(directory):
+                _in_flight.discard(self._path)
+                _remove(self._base)
+        except OSError as e:
+            DTProcess.get_instance().logger.warning(
+                f"Could not remove the spool segment '{self._path}', reason: {str(e)}")
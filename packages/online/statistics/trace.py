@@ -0,0 +1,142 @@
+import dataclasses
+import json
+import os
+import time
+from threading import Semaphore
+from typing import Any, Dict, List, Optional, Set, TextIO
+
+from dt_class_utils import DTProcess
+
+from .providers import StatisticsProvider
+from ..constants import STATS_TRACE_FILE, STATS_TRACE_MAX_BYTES
+
+# A trace is a file of JSON lines. Every recording session (i.e., every run of the collector) starts
+# with a `session` line, each provider is described by a `provider` line the first time it steps,
+# followed by one line per step with its output (what `step()` returned) and its duration:
+#
+#   {"session": {"device": "...", "time": 1700000000.0}}
+#   {"provider": {"key": "docker/ps", "category": "usage", "class": "DockerPSProvider", "period": 60, ...}}
+#   {"step": {"key": "docker/ps", "time": 1700000000.1, "duration": 0.25, "stamp": ..., "payload": {...}}}
+#
+# Lazy (file-based) providers are not recorded, their data is already on disk.
+
+
+class TraceRecorder:
+
+    def __init__(self, filepath: str = STATS_TRACE_FILE, max_bytes: int = STATS_TRACE_MAX_BYTES):
+        self._filepath = filepath
+        self._max_bytes = max_bytes
+        self._lock = Semaphore(1)
+        self._file: Optional[TextIO] = None
+        self._described: Set[str] = set()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._filepath)
+
+    def start(self, device: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self._filepath)), exist_ok=True)
+                self._file = open(self._filepath, "at")
+            except OSError as e:
+                DTProcess.get_instance().logger.warning(
+                    f"Could not open the trace file '{self._filepath}', reason: {str(e)}")
+                return
+            self._write({"session": {"device": device, "time": time.time()}})
+
+    def _write(self, line: dict):
+        self._file.write(json.dumps(line, default=str) + "\n")
+        self._file.flush()
+        if self._file.tell() >= self._max_bytes:
+            DTProcess.get_instance().logger.warning(
+                f"The trace file '{self._filepath}' reached {self._max_bytes} bytes, recording stopped.")
+            self._close()
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def record(self, provider: StatisticsProvider, duration: float, stamp: Optional[float] = None,
+               payload: Any = None, error: Optional[str] = None):
+        if self._file is None or provider.lazy:
+            return
+        with self._lock:
+            if self._file is None:
+                return
+            if provider.key not in self._described:
+                self._described.add(provider.key)
+                self._write({"provider": {
+                    "key": provider.key,
+                    "category": provider.category,
+                    "class": type(provider).__name__,
+                    "period": provider.period,
+                    "timeout": provider.timeout,
+                    "deduplicate": provider.deduplicate,
+                    "ignore_fields": provider.ignore_fields,
+                    "heartbeat": provider.heartbeat,
+                }})
+                if self._file is None:
+                    return
+            self._write({"step": {
+                "key": provider.key,
+                "time": time.time() - duration,
+                "duration": duration,
+                "stamp": stamp,
+                "payload": payload,
+                "error": error,
+            }})
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+@dataclasses.dataclass
+class Trace:
+    device: Optional[str]
+    # time of the first step
+    start: float
+    # key -> description
+    providers: Dict[str, dict]
+    # key -> steps, in order
+    steps: Dict[str, List[dict]]
+
+
+def load(filepath: str) -> Trace:
+    device = None
+    providers: Dict[str, dict] = {}
+    steps: Dict[str, List[dict]] = {}
+    with open(filepath, "rt") as fin:
+        for line in fin:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # e.g., the last line of a recording that was interrupted
+                continue
+            if "session" in entry and device is None:
+                device = entry["session"]["device"]
+            elif "provider" in entry:
+                # later sessions win, providers might have changed in between
+                providers[entry["provider"]["key"]] = entry["provider"]
+            elif "step" in entry:
+                steps.setdefault(entry["step"]["key"], []).append(entry["step"])
+    # steps without a description cannot be replayed
+    steps = {key: s for key, s in steps.items() if key in providers}
+    start = min([s[0]["time"] for s in steps.values()] or [0.0])
+    return Trace(device, start, providers, steps)
+
+
+_recorder: Optional[TraceRecorder] = None
+_lock = Semaphore(1)
+
+
+def get_recorder() -> TraceRecorder:
+    global _recorder
+    with _lock:
+        if _recorder is None:
+            _recorder = TraceRecorder()
+        return _recorder
@@ -0,0 +1,137 @@
+import fnmatch
+import glob
+import os
+import time
+from threading import Thread, Semaphore, Event
+from typing import Callable, Iterable, Optional, Set, Dict
+
+from dt_class_utils import DTProcess
+
+from ..constants import STATS_WATCHER_RESCAN_SECS, STATS_WATCHER_SETTLE_SECS
+from ..inotify import \
+    Inotify, \
+    IN_CLOSE_WRITE, \
+    IN_MOVED_TO, \
+    IN_MOVED_FROM, \
+    IN_DELETE, \
+    IN_IGNORED, \
+    IN_Q_OVERFLOW, \
+    IN_ONLYDIR
+from ..scheduler import get_scheduler, ScheduledTask
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_ONLYDIR
+
+
+class StatisticsFilesWatcher(Thread):
+    # Reports files that appear in a set of directories. Files are picked up as soon as they are
+    # closed after writing (or moved into the directory) through inotify, a periodic rescan covers
+    # for directories that do not exist yet, lost events and systems without inotify.
+
+    def __init__(self, callback: Callable[[str, str], None], pattern: str = "*.json"):
+        super(StatisticsFilesWatcher, self).__init__(daemon=True)
+        self._shutdown = False
+        self._callback = callback
+        self._pattern = pattern
+        # directory -> pattern of the files to report
+        self._directories: Dict[str, str] = {}
+        self._known: Set[str] = set()
+        self._lock = Semaphore(1)
+        self._rescan_needed = True
+        self._wakeup = Event()
+        self._rescan_task: Optional[ScheduledTask] = None
+        try:
+            self._inotify: Optional[Inotify] = Inotify()
+        except OSError as e:
+            DTProcess.get_instance().logger.warning(
+                f"Could not initialize inotify, reason: {str(e)}. "
+                f"New statistics files will be picked up every {STATS_WATCHER_RESCAN_SECS} seconds.")
+            self._inotify = None
+
+    def is_shutdown(self) -> bool:
+        return self._shutdown
+
+    def shutdown(self):
+        self._shutdown = True
+        if self._rescan_task is not None:
+            self._rescan_task.cancel()
+        self._wakeup.set()
+        if self._inotify is not None:
+            self._inotify.wakeup()
+
+    def watch(self, directory: str, known: Iterable[str] = (), pattern: Optional[str] = None):
+        # files in `known` are already taken care of and will not be reported
+        with self._lock:
+            self._directories[os.path.abspath(directory)] = pattern or self._pattern
+            self._known.update(map(os.path.abspath, known))
+
+    def _request_rescan(self):
+        self._rescan_needed = True
+        self._wakeup.set()
+        if self._inotify is not None:
+            self._inotify.wakeup()
+
+    def _add_watches(self):
+        if self._inotify is None:
+            return
+        watched = set(self._inotify.watched)
+        for directory in set(self._directories) - watched:
+            if not os.path.isdir(directory):
+                continue
+            try:
+                self._inotify.add_watch(directory, WATCH_MASK)
+            except OSError as e:
+                DTProcess.get_instance().logger.debug(f"Could not watch '{directory}': {str(e)}")
+
+    def _found(self, filepath: str):
+        with self._lock:
+            if filepath in self._known:
+                return
+            self._known.add(filepath)
+        self._callback(os.path.dirname(filepath), filepath)
+
+    def _rescan(self):
+        self._rescan_needed = False
+        self._add_watches()
+        now = time.time()
+        present = set()
+        for directory, pattern in list(self._directories.items()):
+            for filepath in glob.glob(os.path.join(directory, pattern)):
+                present.add(filepath)
+                # files that are still being written will be reported when they are closed
+                try:
+                    if now - os.path.getmtime(filepath) < STATS_WATCHER_SETTLE_SECS:
+                        continue
+                except OSError:
+                    continue
+                self._found(filepath)
+        # forget about the files that are gone
+        with self._lock:
+            self._known = {f for f in self._known if f in present or os.path.exists(f)}
+
+    def run(self):
+        self._rescan_task = get_scheduler().call_every(
+            STATS_WATCHER_RESCAN_SECS, self._request_rescan, delay=STATS_WATCHER_RESCAN_SECS)
+        while not self.is_shutdown():
+            if self._rescan_needed:
+                self._rescan()
+            if self._inotify is None:
+                # no inotify, we only rely on the periodic rescan
+                self._wakeup.wait()
+                self._wakeup.clear()
+                continue
+            for directory, name, mask in self._inotify.read():
+                if mask & (IN_Q_OVERFLOW | IN_IGNORED):
+                    # we lost events or a watch, look at the directories again
+                    self._rescan_needed = True
+                    continue
+                if not fnmatch.fnmatch(name, self._directories.get(directory, self._pattern)):
+                    continue
+                filepath = os.path.join(directory, name)
+                if mask & (IN_DELETE | IN_MOVED_FROM):
+                    with self._lock:
+                        self._known.discard(filepath)
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    self._found(filepath)
+        # ---
+        if self._inotify is not None:
+            self._inotify.close()
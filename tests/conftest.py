@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# the code lives in `packages/`, the same way it is laid out in the image
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "packages"))
+
+from dt_class_utils import DTProcess  # noqa: E402
+
+
+class TestsProcess(DTProcess):
+    __test__ = False
+
+
+@pytest.fixture(scope="session", autouse=True)
+def process() -> DTProcess:
+    # the code under test logs through the process
+    return TestsProcess()
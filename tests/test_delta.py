@@ -0,0 +1,89 @@
+import os
+import random
+
+from online.statistics import outbox as outbox_module
+from online.statistics.delta import compute_delta, apply_delta, is_empty
+from online.statistics.outbox import StatisticsOutbox
+from online.statistics.point import StatisticsPoint, StatisticsCategory
+
+
+def _normalized(document: dict) -> dict:
+    # the order of the items in a list section is not preserved
+    return {k: sorted(v, key=repr) if isinstance(v, list) else v for k, v in document.items()}
+
+
+def test_round_trip():
+    old = {
+        "nodes": ["/a", "/b", "/c"],
+        "topics": {"/t1": {"type": "std_msgs/String"}, "/t2": {"type": "std_msgs/Int32"}},
+        "version": 1,
+        "gone": {"x": 1},
+    }
+    new = {
+        "nodes": ["/a", "/c", "/d", "/d"],
+        "topics": {"/t1": {"type": "std_msgs/String"}, "/t3": {"type": "std_msgs/Bool"}},
+        "version": 2,
+        "services": [],
+    }
+    delta = compute_delta(old, new)
+    assert not is_empty(delta)
+    assert delta["removed"] == ["gone"]
+    assert delta["sections"]["topics"] == {"set": {"/t3": {"type": "std_msgs/Bool"}}, "unset": ["/t2"]}
+    assert _normalized(apply_delta(old, delta)) == _normalized(new)
+    # the base is left untouched
+    assert old["nodes"] == ["/a", "/b", "/c"]
+
+
+def test_random_round_trips():
+    rng = random.Random(0)
+    for _ in range(200):
+        def document():
+            return {
+                "nodes": [rng.choice("abcde") for _ in range(rng.randint(0, 5))],
+                "topics": {rng.choice("abcde"): rng.randint(0, 2) for _ in range(rng.randint(0, 5))},
+                "value": rng.randint(0, 2),
+            }
+        old, new = document(), document()
+        assert _normalized(apply_delta(old, compute_delta(old, new))) == _normalized(new)
+
+
+def test_unchanged_documents_give_empty_deltas():
+    document = {"nodes": ["/a", "/b"], "topics": {"/t": 1}}
+    assert is_empty(compute_delta(document, dict(document)))
+    # a list that was only reordered did not change
+    assert is_empty(compute_delta(document, {"nodes": ["/b", "/a"], "topics": {"/t": 1}}))
+
+
+def _point(key: str, stamp: float, payload: dict) -> StatisticsPoint:
+    return StatisticsPoint(category=StatisticsCategory.USAGE, key=key, device="device", stamp=stamp,
+                           payload=payload)
+
+
+def _delta(stamp: float, keyframe: float) -> StatisticsPoint:
+    return _point("ros/graph/delta", stamp, {"keyframe": int(keyframe * 1000), "delta": {"sections": {}}})
+
+
+def test_evicted_keyframe_takes_its_deltas_along(tmp_path, monkeypatch):
+    monkeypatch.setattr(outbox_module, "STATS_OUTBOX_MAX_POINTS", 4)
+    filepath = os.path.join(tmp_path, "outbox.sqlite")
+    outbox = StatisticsOutbox(filepath)
+    outbox.add(_point("ros/graph", 1.0, {"nodes": []}))
+    outbox.add(_delta(2.0, keyframe=1.0))
+    outbox.add(_delta(3.0, keyframe=1.0))
+    outbox.add(_point("usage/key", 4.0, {}))
+    # the keyframe is the oldest point, making room for this one drops the whole chain
+    outbox.add(_point("usage/key", 5.0, {}))
+    assert [p.key for p in outbox.batch(after=0, limit=10)] == ["usage/key", "usage/key"]
+    # later deltas of the same chain cannot be applied either
+    late = _delta(6.0, keyframe=1.0)
+    outbox.add(late)
+    assert late.seq is None and len(outbox) == 2
+    # a new keyframe starts a new chain
+    outbox.add(_point("ros/graph", 7.0, {"nodes": []}))
+    outbox.add(_delta(8.0, keyframe=7.0))
+    outbox.close()
+    # chains are rebuilt from disk
+    outbox = StatisticsOutbox(filepath)
+    assert [p.key for p in outbox.batch(after=0, limit=10)] == \
+        ["usage/key", "usage/key", "ros/graph", "ros/graph/delta"]
+    outbox.close()
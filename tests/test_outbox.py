@@ -0,0 +1,116 @@
+import os
+
+from online.statistics import outbox as outbox_module
+from online.statistics.outbox import StatisticsOutbox
+from online.statistics.point import StatisticsPoint, StatisticsCategory
+
+
+def _point(key: str, stamp: float, category: StatisticsCategory = StatisticsCategory.USAGE) -> StatisticsPoint:
+    return StatisticsPoint(category=category, key=key, device="device", stamp=stamp, payload={"stamp": stamp})
+
+
+def test_points_survive_a_restart(tmp_path):
+    filepath = os.path.join(tmp_path, "outbox.sqlite")
+    outbox = StatisticsOutbox(filepath)
+    for i in range(3):
+        outbox.add(_point("usage/key", float(i), StatisticsCategory.EVENT if i == 1 else StatisticsCategory.USAGE))
+    outbox.close()
+    # ---
+    outbox = StatisticsOutbox(filepath)
+    points = outbox.batch(after=0, limit=10)
+    assert [p.seq for p in points] == [1, 2, 3]
+    assert [p.payload for p in points] == [{"stamp": 0.0}, {"stamp": 1.0}, {"stamp": 2.0}]
+    assert [p.category for p in points] == \
+        [StatisticsCategory.USAGE, StatisticsCategory.EVENT, StatisticsCategory.USAGE]
+    assert all(p.key == "usage/key" and p.device == "device" for p in points)
+    assert outbox.size > 0
+    # sequence numbers continue from where the previous run left off
+    point = _point("usage/key", 3.0)
+    outbox.add(point)
+    assert point.seq == 4
+    outbox.close()
+
+
+def test_acknowledged_points_are_not_replayed(tmp_path):
+    filepath = os.path.join(tmp_path, "outbox.sqlite")
+    outbox = StatisticsOutbox(filepath)
+    for i in range(4):
+        outbox.add(_point("usage/key", float(i)))
+    outbox.sync(force=True)
+    outbox.ack(outbox.batch(after=0, limit=2))
+    outbox.close()
+    # ---
+    outbox = StatisticsOutbox(filepath)
+    assert len(outbox) == 2
+    assert [p.seq for p in outbox.batch(after=0, limit=10)] == [3, 4]
+    outbox.close()
+
+
+def test_unsynced_points_are_written_on_close(tmp_path):
+    filepath = os.path.join(tmp_path, "outbox.sqlite")
+    outbox = StatisticsOutbox(filepath)
+    outbox.add(_point("usage/key", 0.0))
+    # points waiting to be written to disk are served from memory
+    assert [p.seq for p in outbox.batch(after=0, limit=10)] == [1]
+    outbox.close()
+    assert len(StatisticsOutbox(filepath)) == 1
+
+
+def test_caps_evict_the_oldest_usage_points(tmp_path, monkeypatch):
+    monkeypatch.setattr(outbox_module, "STATS_OUTBOX_MAX_POINTS", 3)
+    outbox = StatisticsOutbox(os.path.join(tmp_path, "outbox.sqlite"))
+    outbox.add(_point("event/key", 0.0, StatisticsCategory.EVENT))
+    for i in range(1, 5):
+        outbox.add(_point("usage/key", float(i)))
+    outbox.sync(force=True)
+    # events are never dropped, usage points make room for newer ones
+    assert len(outbox) == 3
+    assert [p.stamp for p in outbox.batch(after=0, limit=10)] == [0.0, 3.0, 4.0]
+    outbox.close()
+
+
+def test_caps_are_enforced_on_bytes_too(tmp_path, monkeypatch):
+    outbox = StatisticsOutbox(os.path.join(tmp_path, "outbox.sqlite"))
+    outbox.add(_point("usage/key", 0.0))
+    monkeypatch.setattr(outbox_module, "STATS_OUTBOX_MAX_BYTES", outbox.size * 2)
+    for i in range(1, 5):
+        outbox.add(_point("usage/key", float(i)))
+    assert outbox.size <= outbox_module.STATS_OUTBOX_MAX_BYTES
+    assert [p.stamp for p in outbox.batch(after=0, limit=10)] == [3.0, 4.0]
+    outbox.close()
+
+
+def test_snapshot_keys_are_coalesced(tmp_path, monkeypatch):
+    monkeypatch.setattr(outbox_module, "STATS_OUTBOX_COALESCE", {"snapshot/key": 1})
+    filepath = os.path.join(tmp_path, "outbox.sqlite")
+    outbox = StatisticsOutbox(filepath)
+    for i in range(3):
+        outbox.add(_point("snapshot/key", float(i)))
+        outbox.add(_point("usage/key", float(i)))
+    outbox.close()
+    # the points dropped from memory are gone from disk as well
+    outbox = StatisticsOutbox(filepath)
+    points = outbox.batch(after=0, limit=10)
+    assert [p.stamp for p in points if p.key == "snapshot/key"] == [2.0]
+    assert [p.stamp for p in points if p.key == "usage/key"] == [0.0, 1.0, 2.0]
+    outbox.close()
+
+
+def test_batches_page_through_the_outbox(tmp_path):
+    outbox = StatisticsOutbox(os.path.join(tmp_path, "outbox.sqlite"))
+    for i in range(10):
+        outbox.add(_point("usage/key", float(i)))
+    outbox.sync(force=True)
+    cursor, pages = 0, []
+    while True:
+        page = outbox.batch(after=cursor, limit=3)
+        if not page:
+            break
+        pages.append([p.seq for p in page])
+        cursor = page[-1].seq
+        # acknowledged points leave the outbox while we go through it
+        outbox.ack(page[:1])
+    assert pages == [[1, 2, 3], [4, 5, 6], [7, 8, 9], [10]]
+    assert [p.seq for p in outbox.batch(after=0, limit=10)] == [2, 3, 5, 6, 8, 9]
+    assert [p.seq for p in outbox.batch(after=5, limit=2)] == [6, 8]
+    outbox.close()
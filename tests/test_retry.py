@@ -0,0 +1,62 @@
+import pytest
+
+from online import retry
+from online.retry import RetryPolicy, CircuitState
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(retry.time, "time", lambda: now[0])
+    return now
+
+
+def test_circuit_goes_through_all_states(clock):
+    policy = RetryPolicy(initial_delay=10, max_delay=100, factor=2, jitter=0, threshold=2)
+    assert policy.state == CircuitState.CLOSED and policy.allow()
+    # below the threshold failures are retried right away
+    assert policy.failure() == 0
+    assert policy.state == CircuitState.CLOSED and policy.allow()
+    # the circuit opens, nothing goes through until the backoff expires
+    assert policy.failure() == 10
+    assert policy.state == CircuitState.OPEN
+    assert not policy.allow()
+    clock[0] += 9.5
+    assert not policy.allow() and policy.delay == pytest.approx(0.5)
+    # a single probe is let through
+    clock[0] += 0.5
+    assert policy.allow()
+    assert policy.state == CircuitState.HALF_OPEN and policy.probing
+    # a successful probe closes the circuit
+    policy.success()
+    assert policy.state == CircuitState.CLOSED and not policy.probing
+    assert policy.failures == 0 and policy.allow()
+
+
+def test_failed_probe_opens_the_circuit_again(clock):
+    policy = RetryPolicy(initial_delay=10, max_delay=100, factor=2, jitter=0)
+    assert policy.failure() == 10
+    clock[0] += 10
+    assert policy.allow() and policy.probing
+    assert policy.failure() == 20
+    assert policy.state == CircuitState.OPEN and not policy.allow()
+
+
+def test_delay_is_capped(clock):
+    policy = RetryPolicy(initial_delay=10, max_delay=100, factor=2, jitter=0)
+    delays = [policy.failure() for _ in range(5000)]
+    assert delays[:5] == [10, 20, 40, 80, 100]
+    assert max(delays) == 100
+
+
+def test_jitter_shortens_the_delay(clock):
+    policy = RetryPolicy(initial_delay=10, max_delay=100, factor=2, jitter=0.5)
+    for _ in range(100):
+        assert 5 <= policy.failure() <= 100
+
+
+def test_reset_closes_the_circuit(clock):
+    policy = RetryPolicy(initial_delay=10, max_delay=100, factor=2, jitter=0)
+    policy.failure()
+    policy.reset()
+    assert policy.state == CircuitState.CLOSED and policy.allow() and policy.failures == 0
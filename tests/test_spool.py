@@ -0,0 +1,88 @@
+import glob
+import os
+
+import pytest
+
+from online.statistics import spool
+from online.statistics.spool import SpoolWriter, SpoolSegment, pack, scan, read
+
+
+def _write(path: str, records: list) -> bytes:
+    content = b"".join(pack(kind, stamp, data) for kind, stamp, data in records)
+    with open(path, "wb") as fout:
+        fout.write(content)
+    return content
+
+
+def test_pack_scan_read(tmp_path):
+    path = os.path.join(tmp_path, "segment.seg")
+    _write(path, [("boot", 1, {"a": 1}), ("shutdown", 2, {"b": "é"})])
+    records = scan(path)
+    assert [(r.type, r.stamp) for r in records] == [("boot", 1), ("shutdown", 2)]
+    assert records[0].offset == 0 and records[1].offset == records[0].size
+    assert read(path, records[1]) == {"type": "shutdown", "stamp": 2, "data": {"b": "é"}}
+
+
+def test_scan_stops_at_a_torn_tail(tmp_path):
+    path = os.path.join(tmp_path, "segment.seg")
+    content = _write(path, [("boot", 1, {"a": 1})])
+    # a crash in the middle of a write leaves an incomplete record at the end
+    with open(path, "ab") as fout:
+        fout.write(pack("boot", 2, {"a": 2})[:-3])
+    records = scan(path)
+    assert len(records) == 1 and records[0].size == len(content)
+    # and so does a partial header
+    with open(path, "wb") as fout:
+        fout.write(content + pack("boot", 2, {})[:5])
+    assert len(scan(path)) == 1
+
+
+def test_read_rejects_a_bad_checksum(tmp_path):
+    path = os.path.join(tmp_path, "segment.seg")
+    content = bytearray(_write(path, [("boot", 1, {"a": 1})]))
+    content[-2] ^= 0xFF
+    with open(path, "wb") as fout:
+        fout.write(content)
+    record, = scan(path)
+    with pytest.raises(ValueError):
+        read(path, record)
+
+
+def test_segments_are_deleted_once_acknowledged(tmp_path, monkeypatch):
+    writer = SpoolWriter(str(tmp_path))
+    for i in range(3):
+        writer.append("event", i, {"i": i})
+    writer.close()
+    # seal the segment
+    monkeypatch.setattr(spool, "STATS_SPOOL_SEGMENT_SECS", 0)
+    spool.maintain(str(tmp_path))
+    path, = glob.glob(os.path.join(tmp_path, "*" + spool.SEALED_SUFFIX))
+    segment = SpoolSegment(path)
+    assert [segment.read(r)["data"] for r in segment.records] == [{"i": 0}, {"i": 1}, {"i": 2}]
+    segment.ack(segment.records[0])
+    # acknowledged records are not handed out again
+    assert len(SpoolSegment(path).records) == 2
+    for record in segment.records[1:]:
+        segment.ack(record)
+    assert glob.glob(os.path.join(tmp_path, "*.*")) == []
+
+
+def test_retention_spares_segments_in_flight(tmp_path, monkeypatch):
+    # two sealed segments, the oldest one is being uploaded
+    for i in range(2):
+        writer = SpoolWriter(str(tmp_path))
+        writer.append("event", i, {"i": i})
+        writer.close()
+        with monkeypatch.context() as patch:
+            patch.setattr(spool, "STATS_SPOOL_SEGMENT_SECS", 0)
+            spool.maintain(str(tmp_path))
+    paths = sorted(glob.glob(os.path.join(tmp_path, "*" + spool.SEALED_SUFFIX)))
+    assert len(paths) == 2
+    oldest = SpoolSegment(paths[0])
+    # the spool is over its size, the newest segment goes instead of the oldest one
+    monkeypatch.setattr(spool, "STATS_SPOOL_MAX_BYTES", 0)
+    spool.maintain(str(tmp_path))
+    assert sorted(glob.glob(os.path.join(tmp_path, "*" + spool.SEALED_SUFFIX))) == paths[:1]
+    # once its records are acknowledged it goes too
+    oldest.ack(oldest.records[0])
+    assert glob.glob(os.path.join(tmp_path, "*" + spool.SEALED_SUFFIX)) == []
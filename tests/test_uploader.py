@@ -0,0 +1,72 @@
+import os
+from typing import Any, List, Tuple
+
+import pytest
+
+from online.statistics import collector
+from online.statistics.collector import StatisticsUploader
+from online.statistics.point import StatisticsPoint, StatisticsCategory
+
+
+class _Response:
+
+    def __init__(self, status_code: int, content: Any = None):
+        self.status_code = status_code
+        self._content = content
+        self.headers = {}
+
+    def json(self) -> Any:
+        return self._content
+
+
+@pytest.fixture
+def uploader(tmp_path, monkeypatch) -> StatisticsUploader:
+    boot_id = os.path.join(tmp_path, "boot_id")
+    with open(boot_id, "wt") as fout:
+        fout.write("boot")
+    monkeypatch.setattr(collector, "STATS_BOOT_ID_FILE", boot_id)
+    monkeypatch.setattr(collector, "STATS_DEAD_LETTER_DIR", os.path.join(tmp_path, "rejected"))
+    uploader = StatisticsUploader(os.path.join(tmp_path, "outbox.sqlite"))
+    for i in range(10):
+        uploader.add(StatisticsPoint(category=StatisticsCategory.EVENT, key="event/key", device="device",
+                                     stamp=float(i), payload={"i": i}))
+    return uploader
+
+
+def _server(monkeypatch, batch_status: int, bad: int) -> List[Tuple[str, Any]]:
+    # batches are refused with `batch_status`, single points are accepted unless their payload is `bad`
+    requests = []
+
+    def _post(_, url: str, content: Any, token: str, mode: str) -> _Response:
+        requests.append((mode, content))
+        if mode == "batch":
+            return _Response(batch_status)
+        if content["i"] == bad:
+            return _Response(400)
+        return _Response(200, {"success": True})
+
+    monkeypatch.setattr(StatisticsUploader, "_post", _post)
+    return requests
+
+
+def test_refused_batches_do_not_block_the_outbox(uploader, monkeypatch):
+    requests = _server(monkeypatch, batch_status=413, bad=3)
+    uploader._flush("token")
+    # the batch was refused, its points went one at a time
+    assert [mode for mode, _ in requests] == ["batch"] + ["point"] * 10
+    assert len(uploader) == 1
+    # the point the server does not want leaves the outbox after a few attempts
+    for _ in range(collector.STATS_UPLOAD_MAX_REJECTIONS):
+        uploader._flush("token")
+    assert len(uploader) == 0
+    assert len(os.listdir(collector.STATS_DEAD_LETTER_DIR)) == 1
+
+
+def test_batches_are_capped_in_size(uploader, monkeypatch):
+    requests = _server(monkeypatch, batch_status=404, bad=-1)
+    monkeypatch.setattr(collector, "STATS_UPLOAD_BATCH_BYTES", 30)
+    assert [len(batch) for batch in uploader._batches([(None, {"i": i}) for i in range(10)])] == [3, 3, 3, 1]
+    # servers that do not know about batches get single points
+    uploader._flush("token")
+    assert [mode for mode, _ in requests] == ["batch"] + ["point"] * 10
+    assert len(uploader) == 0